@@ -74,3 +74,10 @@ class MistralCredentialsAdmin(admin.ModelAdmin):
 class OpenRouterCredentialsAdmin(admin.ModelAdmin):
     list_display = ("user",)
     list_filter = ("user__username",)
+
+
+@admin.register(models.MattermostEvent)
+class MattermostEventAdmin(admin.ModelAdmin):
+    list_display = ("kind", "root_id", "status", "attempts", "created_at")
+    list_filter = ("status", "kind")
+    search_fields = ("root_id", "post_id", "last_error")
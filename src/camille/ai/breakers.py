@@ -0,0 +1,217 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from time import monotonic
+from typing import Any, Optional
+
+import logfire
+from django.conf import settings
+from httpx import TransportError
+from pydantic_ai import RunContext
+from pydantic_ai.exceptions import ModelAPIError, ModelHTTPError
+from pydantic_ai.messages import ModelMessage, ModelResponse
+from pydantic_ai.models import Model, ModelRequestParameters, StreamedResponse
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.settings import ModelSettings
+
+state_gauge = logfire.metric_gauge(
+    "camille.ai.breaker.state",
+    description="State of the model circuit breakers (0 closed, 1 half-open, 2 open)",
+)
+transitions_counter = logfire.metric_counter(
+    "camille.ai.breaker.transitions",
+    description="Number of state changes of the model circuit breakers",
+)
+
+
+class BreakerState(IntEnum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitOpenError(ModelAPIError):
+    pass
+
+
+class CircuitBreaker:
+    """Stop sending requests to a model failing or too slow.
+
+    The breaker opens when the failed or slow calls of the sliding window
+    exceed the error rate. After a cool down, a single trial call is let
+    through: its outcome closes or reopens the breaker.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = BreakerState.CLOSED
+        self.calls: deque[tuple[float, bool]] = deque()  # (time, failed)
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def transition(self, state: BreakerState):
+        logfire.warn(
+            "Circuit breaker of {model} goes from {old} to {new}",
+            model=self.name,
+            old=self.state.name,
+            new=state.name,
+        )
+        transitions_counter.add(
+            1, {"model": self.name, "from": self.state.name, "to": state.name}
+        )
+        state_gauge.set(state, {"model": self.name})
+        self.state = state
+
+    def allow(self) -> bool:
+        if self.state == BreakerState.OPEN:
+            if monotonic() - self.opened_at < settings.MODEL_BREAKER_COOL_DOWN:
+                return False
+
+            self.transition(BreakerState.HALF_OPEN)
+
+        if self.state == BreakerState.HALF_OPEN:
+            if self.trial_in_flight:
+                return False
+
+            self.trial_in_flight = True
+
+        return True
+
+    def record(self, duration: float, failed: bool):
+        failed = failed or duration > settings.MODEL_BREAKER_SLOW_CALL
+        now = monotonic()
+        if self.state == BreakerState.HALF_OPEN:
+            self.trial_in_flight = False
+            self.calls.clear()
+            if failed:
+                self.open(now)
+            else:
+                self.transition(BreakerState.CLOSED)
+            return
+
+        self.calls.append((now, failed))
+        while self.calls and self.calls[0][0] < now - settings.MODEL_BREAKER_WINDOW:
+            self.calls.popleft()
+
+        failures = sum(call_failed for _, call_failed in self.calls)
+        if (
+            self.state == BreakerState.CLOSED
+            and len(self.calls) >= settings.MODEL_BREAKER_MIN_CALLS
+            and failures / len(self.calls) >= settings.MODEL_BREAKER_ERROR_RATE
+        ):
+            self.calls.clear()
+            self.open(now)
+
+    def release(self):
+        """End a call which says nothing of the health of the model."""
+        if self.state == BreakerState.HALF_OPEN:
+            self.trial_in_flight = False
+
+    def open(self, now: float):
+        self.opened_at = now
+        self.transition(BreakerState.OPEN)
+
+
+def is_unhealthy(error: BaseException) -> bool:
+    """Whether the error tells the provider is unhealthy. Cancellations and
+    client errors, such as a revoked key, don't."""
+    if isinstance(error, ModelHTTPError):
+        return error.status_code == 429 or error.status_code >= 500
+
+    return isinstance(
+        error, (ModelAPIError, TimeoutError, ConnectionError, TransportError)
+    )
+
+
+# Shared by all the users, by model string
+breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    if (breaker := breakers.get(name)) is None:
+        breaker = breakers[name] = CircuitBreaker(name)
+
+    return breaker
+
+
+class CircuitBreakerModel(WrapperModel):
+    """Fail fast while the breaker of the wrapped model is open, so a
+    FallbackModel moves on to the next model."""
+
+    def __init__(self, wrapped: Model, breaker: CircuitBreaker):
+        super().__init__(wrapped)
+        self.breaker = breaker
+        self.answered_at: Optional[float] = None
+
+    def check(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.model_name, f"{self.breaker.name} is unhealthy")
+
+    def settle(self, duration: float, error: Optional[BaseException]):
+        if error is None:
+            self.answered_at = monotonic()
+
+        if error is None or is_unhealthy(error):
+            self.breaker.record(duration, error is not None)
+        else:
+            self.breaker.release()
+
+    async def request(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+    ) -> ModelResponse:
+        self.check()
+        started_at = monotonic()
+        try:
+            response = await super().request(
+                messages, model_settings, model_request_parameters
+            )
+        except BaseException as e:
+            self.settle(monotonic() - started_at, e)
+            raise
+
+        self.settle(monotonic() - started_at, None)
+        return response
+
+    @asynccontextmanager
+    async def request_stream(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+        run_context: RunContext[Any] | None = None,
+    ) -> AsyncIterator[StreamedResponse]:
+        self.check()
+        started_at = monotonic()
+        duration = None
+        try:
+            async with super().request_stream(
+                messages, model_settings, model_request_parameters, run_context
+            ) as response_stream:
+                # Time to first byte, the stream lasts as long as the answer
+                duration = monotonic() - started_at
+                yield response_stream
+        except BaseException as e:
+            self.settle(monotonic() - started_at if duration is None else duration, e)
+            raise
+
+        self.settle(duration, None)
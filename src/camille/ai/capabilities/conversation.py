@@ -15,22 +15,20 @@
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from json import dumps
-from typing import Any
 
-from asgiref.sync import sync_to_async
-from django.template.loader import render_to_string
 from pydantic_ai import RunContext
 from pydantic_ai.capabilities import AbstractCapability
 
+from camille.ai.capabilities.rendering import render_instructions
+from camille.ai.capabilities.static import StaticInstructionsToolset
 from camille.ai.deps import Deps
 
 
 class ConversationCapability(AbstractCapability):
-    def get_instructions(self) -> Any:
-        @sync_to_async
-        def inner(ctx: RunContext[Deps]) -> str:
-            return render_to_string(
-                "camille/ai/instructions/conversation.md",
+    def get_toolset(self) -> StaticInstructionsToolset:
+        async def inner(ctx: RunContext[Deps]) -> str:
+            return render_instructions(
+                "conversation",
                 {
                     "all_users": [
                         dumps(
@@ -47,4 +45,4 @@ class ConversationCapability(AbstractCapability):
                 },
             )
 
-        return inner
+        return StaticInstructionsToolset("conversation", inner)
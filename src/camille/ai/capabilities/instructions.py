@@ -14,25 +14,37 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Any
-
-from asgiref.sync import sync_to_async
-from django.template.loader import render_to_string
 from pydantic_ai import RunContext
 from pydantic_ai.capabilities import AbstractCapability
 
+from camille.ai.capabilities.rendering import fragments, render_instructions
+from camille.ai.capabilities.static import StaticInstructionsToolset
 from camille.ai.deps import Deps
 
 
 class InstructionsCapability(AbstractCapability):
-    def get_instructions(self) -> Any:
-        @sync_to_async
-        def inner(ctx: RunContext[Deps]) -> str:
-            return render_to_string(
-                "camille/ai/instructions/instructions.md",
+    def get_toolset(self) -> StaticInstructionsToolset:
+        async def inner(ctx: RunContext[Deps]) -> str:
+            return render_instructions(
+                "instructions",
                 {
-                    "all_users": ctx.deps.all_users,
+                    "blocks": [
+                        fragments.render(
+                            "user_instructions",
+                            (
+                                user.id,
+                                user.username,
+                                getattr(
+                                    getattr(user, "agent_config", None),
+                                    "updated_at",
+                                    None,
+                                ),
+                            ),
+                            {"user": user},
+                        )
+                        for user in ctx.deps.all_users
+                    ],
                 },
             )
 
-        return inner
+        return StaticInstructionsToolset("instructions", inner)
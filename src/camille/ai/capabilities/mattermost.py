@@ -14,20 +14,26 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Any
-
-from asgiref.sync import sync_to_async
-from django.template.loader import render_to_string
-from pydantic_ai import FunctionToolset, RunContext
+from pydantic_ai import RunContext
 from pydantic_ai.capabilities import AbstractCapability
 from pydantic_ai.messages import BinaryContent
 
+from camille.ai.capabilities.rendering import render_instructions
+from camille.ai.capabilities.static import StaticInstructionsToolset
 from camille.ai.deps import MattermostDeps
 
 
-class MattermostToolset(FunctionToolset):
+class MattermostToolset(StaticInstructionsToolset):
     def __init__(self):
-        super().__init__(id="mattermost")
+        async def render(ctx: RunContext[MattermostDeps]) -> str:
+            return render_instructions(
+                "mattermost",
+                {
+                    "channel_name": ctx.deps.channel_name,
+                },
+            )
+
+        super().__init__("mattermost", render)
 
         @self.tool()
         async def get_mattermost_file(
@@ -64,15 +70,3 @@ class MattermostToolset(FunctionToolset):
 class MattermostCapability(AbstractCapability):
     def get_toolset(self) -> MattermostToolset:
         return MattermostToolset()
-
-    def get_instructions(self) -> Any:
-        @sync_to_async
-        def inner(ctx: RunContext[MattermostDeps]) -> str:
-            return render_to_string(
-                "camille/ai/instructions/mattermost.md",
-                {
-                    "channel_name": ctx.deps.channel_name,
-                },
-            )
-
-        return inner
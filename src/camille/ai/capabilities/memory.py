@@ -14,15 +14,16 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Any
+from typing import Any, Optional
 
-from asgiref.sync import sync_to_async
-from django.template.loader import render_to_string
-from pydantic_ai import FunctionToolset, RunContext
+from pydantic_ai import FunctionToolset, ModelRetry, RunContext
 from pydantic_ai.capabilities import AbstractCapability
 
+from camille.ai.capabilities.rendering import fragments, render_instructions
 from camille.ai.deps import Deps
+from camille.ai.ranking import memory_index, recent_text, tokenize
 from camille.models import AgentMemory
+from camille.search import asearch_memories
 
 
 class MemoryToolset(FunctionToolset):
@@ -36,9 +37,10 @@ class MemoryToolset(FunctionToolset):
             :param content: The content of the memory to create.
             """
 
-            await AgentMemory.objects.acreate(
+            memory = await AgentMemory.objects.acreate(
                 user=ctx.deps.current_user, content=content
             )
+            memory_index.get(ctx.deps.current_user.id).add(memory)
 
         @self.tool()
         async def update_memory(ctx: RunContext[Deps], id: int, content: str) -> None:
@@ -49,7 +51,8 @@ class MemoryToolset(FunctionToolset):
             """
             memory = await AgentMemory.objects.aget(id=id, user=ctx.deps.current_user)
             memory.content = content
-            await memory.asave(update_fields=["content"])
+            await memory.asave(update_fields=["content", "updated_at"])
+            memory_index.get(ctx.deps.current_user.id).add(memory)
 
         @self.tool()
         async def delete_memory(ctx: RunContext[Deps], id: int) -> None:
@@ -59,6 +62,31 @@ class MemoryToolset(FunctionToolset):
             """
             memory = await AgentMemory.objects.aget(id=id, user=ctx.deps.current_user)
             await memory.adelete()
+            memory_index.get(ctx.deps.current_user.id).remove(id)
+
+        @self.tool()
+        async def search_memory(
+            ctx: RunContext[Deps],
+            query: str,
+            user_id: Optional[int] = None,
+            page: int = 1,
+        ) -> dict[str, Any]:
+            """Search the memories of the users in the conversation, including
+            the ones not shown in the instructions. The matches are
+            highlighted in bold in the snippets.
+
+            :param query: Words the memories must all contain.
+            :param user_id: Only search the memories of this user.
+            :param page: Page of the results, starting at 1.
+            """
+            user_ids = [user.id for user in ctx.deps.all_users]
+            if user_id is not None:
+                if user_id not in user_ids:
+                    raise ModelRetry(f"User {user_id} is not in the conversation")
+                user_ids = [user_id]
+
+            results, has_more = await asearch_memories(query, user_ids, page)
+            return {"results": results, "page": page, "has_more": has_more}
 
 
 class MemoryCapability(AbstractCapability):
@@ -66,14 +94,35 @@ class MemoryCapability(AbstractCapability):
         return MemoryToolset()
 
     def get_instructions(self) -> Any:
-        @sync_to_async
-        def inner(ctx: RunContext[Deps]) -> str:
-            return render_to_string(
-                "camille/ai/instructions/memory.md",
-                {
-                    "all_users": ctx.deps.all_users,
-                    "current_user": ctx.deps.current_user,
-                },
-            )
+        async def inner(ctx: RunContext[Deps]) -> str:
+            # Checked at each step, the memories may have changed elsewhere
+            await memory_index.refresh([user.id for user in ctx.deps.all_users])
+            query = tokenize(recent_text(ctx.messages))
+
+            blocks = []
+            for user in ctx.deps.all_users:
+                memories = memory_index.get(user.id)
+                selected = memories.select(query)
+                current = user == ctx.deps.current_user
+                blocks.append(
+                    fragments.render(
+                        "user_memories",
+                        (
+                            user.id,
+                            user.username,
+                            current,
+                            *memories.version(),
+                            *(memory.id for memory in selected),
+                        ),
+                        {
+                            "user": user,
+                            "current": current,
+                            "memories": selected,
+                            "hidden": len(memories) - len(selected),
+                        },
+                    )
+                )
+
+            return render_instructions("memory", {"blocks": blocks})
 
         return inner
@@ -14,29 +14,32 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Any
-
-from asgiref.sync import sync_to_async
-from django.template.loader import render_to_string
 from pydantic_ai import RunContext
 from pydantic_ai.capabilities import AbstractCapability
 
+from camille.ai.capabilities.rendering import fragments
+from camille.ai.capabilities.static import StaticInstructionsToolset
 from camille.ai.deps import Deps
 
 
 class PersonalityCapability(AbstractCapability):
-    def get_instructions(self) -> Any:
-        @sync_to_async
-        def inner(ctx: RunContext[Deps]) -> str:
+    def get_toolset(self) -> StaticInstructionsToolset:
+        async def inner(ctx: RunContext[Deps]) -> str:
             agent_config = ctx.deps.current_user.agent_config
             try:
                 prompt_template = agent_config.personality.prompt_template
             except AttributeError:
                 prompt_template = "You are {agent_name}."
 
-            return render_to_string(
-                "camille/ai/instructions/personality.md",
+            return fragments.render(
+                "personality",
+                (
+                    ctx.deps.current_user.id,
+                    ctx.deps.agent_name,
+                    agent_config.updated_at,
+                    getattr(agent_config.personality, "updated_at", None),
+                ),
                 {"prompt": prompt_template.format(agent_name=ctx.deps.agent_name)},
             )
 
-        return inner
+        return StaticInstructionsToolset("personality", inner)
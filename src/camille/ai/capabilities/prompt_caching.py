@@ -0,0 +1,38 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Any
+
+from django.conf import settings
+from pydantic_ai.capabilities import AbstractCapability
+
+
+class PromptCachingCapability(AbstractCapability):
+    """Put cache breakpoints after the tool definitions and the static
+    instructions, for the providers needing explicit ones. The others cache
+    the longest common prefix by themselves."""
+
+    def get_model_settings(self) -> Any:
+        if not settings.MODEL_PROMPT_CACHING:
+            return None
+
+        ttl = settings.MODEL_PROMPT_CACHE_TTL
+        return {
+            "anthropic_cache_tool_definitions": ttl,
+            "anthropic_cache_instructions": ttl,
+            "bedrock_cache_tool_definitions": ttl,
+            "bedrock_cache_instructions": ttl,
+        }
@@ -0,0 +1,83 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from time import perf_counter
+from typing import Any, Optional
+
+import logfire
+from django.conf import settings
+from django.template.loader import render_to_string
+
+render_histogram = logfire.metric_histogram(
+    "camille.ai.instructions.render",
+    unit="s",
+    description="Time spent rendering an instructions fragment",
+)
+lookups_counter = logfire.metric_counter(
+    "camille.ai.instructions.lookups",
+    description="Number of instructions fragments looked up in the cache",
+)
+
+
+def render_instructions(fragment: str, context: dict[str, Any]) -> str:
+    """Render an instructions template in the event loop.
+
+    The data must be loaded beforehand: the users of the deps come from
+    with_prompt_context(), anything else is queried with the async ORM. A
+    lazy query here would raise SynchronousOnlyOperation.
+    """
+    started_at = perf_counter()
+    try:
+        return render_to_string(f"camille/ai/instructions/{fragment}.md", context)
+    finally:
+        render_histogram.record(perf_counter() - started_at, {"fragment": fragment})
+
+
+class FragmentCache:
+    """Rendered instructions fragments, by version of the data they are
+    rendered from.
+
+    The key holds the id of the user and the modification times of the rows
+    the fragment reads, an edit makes a new key and the outdated fragment
+    ages out. The fragments are shared by the runs of all the channels.
+    """
+
+    def __init__(self):
+        self.fragments: OrderedDict[tuple, str] = OrderedDict()
+
+    def lookup(self, fragment: str, key: tuple) -> Optional[str]:
+        if (rendered := self.fragments.get((fragment, *key))) is not None:
+            self.fragments.move_to_end((fragment, *key))
+
+        lookups_counter.add(1, {"fragment": fragment, "hit": rendered is not None})
+        return rendered
+
+    def add(self, fragment: str, key: tuple, rendered: str) -> str:
+        self.fragments[(fragment, *key)] = rendered
+        while len(self.fragments) > settings.INSTRUCTIONS_CACHE_SIZE:
+            self.fragments.popitem(last=False)
+
+        return rendered
+
+    def render(self, fragment: str, key: tuple, context: dict[str, Any]) -> str:
+        if (rendered := self.lookup(fragment, key)) is not None:
+            return rendered
+
+        return self.add(fragment, key, render_instructions(fragment, context))
+
+
+fragments = FragmentCache()
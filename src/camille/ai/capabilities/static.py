@@ -0,0 +1,38 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from pydantic_ai import FunctionToolset, RunContext
+from pydantic_ai.messages import InstructionPart
+
+
+class StaticInstructionsToolset(FunctionToolset):
+    """Toolset contributing instructions which don't change along a
+    conversation.
+
+    pydantic-ai considers the instructions rendered by a function dynamic and
+    puts the prompt cache breakpoint before them. These ones are flagged as
+    static so they are part of the cached prefix.
+    """
+
+    def __init__(self, id: str, render: Callable[[RunContext[Any]], Awaitable[str]]):
+        super().__init__(id=id)
+        self.render = render
+
+    async def get_instructions(self, ctx: RunContext[Any]) -> InstructionPart:
+        return InstructionPart(content=await self.render(ctx), dynamic=False)
@@ -0,0 +1,169 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import perf_counter
+from typing import Optional
+
+import logfire
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from httpx import AsyncClient, AsyncHTTPTransport, HTTPStatusError, Limits
+from opentelemetry.metrics import CallbackOptions, Observation
+from pydantic_ai.providers.bedrock import BedrockProvider
+from pydantic_ai.retries import AsyncTenacityTransport, RetryConfig, wait_retry_after
+from tenacity import retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from camille.models import AWSBedrockCredentials
+
+lookups_counter = logfire.metric_counter(
+    "camille.ai.clients.lookups",
+    description="Number of provider HTTP clients requested from the pool",
+)
+bedrock_construction_histogram = logfire.metric_histogram(
+    "camille.ai.clients.bedrock_construction",
+    unit="s",
+    description="Time spent building a Bedrock runtime client",
+)
+
+
+def create_retrying_client(transport: Optional[AsyncHTTPTransport] = None):
+    """Create a client with smart retry handling for multiple error types."""
+
+    def should_retry_status(response):
+        """Raise exceptions for retryable HTTP status codes."""
+        if response.status_code in (429, 502, 503, 504):
+            response.raise_for_status()  # This will raise HTTPStatusError
+
+    transport = AsyncTenacityTransport(
+        config=RetryConfig(
+            # Retry on HTTP errors and connection issues
+            retry=retry_if_exception_type((HTTPStatusError, ConnectionError)),
+            # Smart waiting: respects Retry-After headers, falls back to exponential backoff
+            wait=wait_retry_after(
+                fallback_strategy=wait_exponential(multiplier=1, max=60), max_wait=300
+            ),
+            # Stop after 5 attempts
+            stop=stop_after_attempt(5),
+            # Re-raise the last exception if all retries fail
+            reraise=True,
+        ),
+        wrapped=transport,
+        validate_response=should_retry_status,
+    )
+    return AsyncClient(transport=transport, timeout=300)
+
+
+class ClientPool:
+    """HTTP clients shared by every user and run of a model provider.
+
+    The provider SDKs authenticate each request themselves, so a single
+    client, and its connections, can serve all the users. Idle connections
+    are closed after MODEL_CLIENT_KEEPALIVE_EXPIRY seconds.
+    """
+
+    def __init__(self):
+        self.clients: dict[tuple[str, Optional[str]], AsyncClient] = {}
+        self.transports: dict[tuple[str, Optional[str]], AsyncHTTPTransport] = {}
+
+    def get(self, provider: str, base_url: Optional[str] = None) -> AsyncClient:
+        key = (provider, base_url)
+        if (client := self.clients.get(key)) is not None and not client.is_closed:
+            lookups_counter.add(1, {"provider": provider, "hit": True})
+            return client
+
+        lookups_counter.add(1, {"provider": provider, "hit": False})
+        transport = AsyncHTTPTransport(
+            http2=True,
+            limits=Limits(
+                max_connections=settings.MODEL_CLIENT_MAX_CONNECTIONS,
+                keepalive_expiry=settings.MODEL_CLIENT_KEEPALIVE_EXPIRY,
+            ),
+        )
+        client = create_retrying_client(transport)
+        self.clients[key] = client
+        self.transports[key] = transport
+
+        return client
+
+    def connections(self, options: CallbackOptions):
+        for (provider, _), transport in list(self.transports.items()):
+            # httpcore doesn't expose the size of its pool publicly
+            pool = getattr(transport, "_pool", None)
+            yield Observation(
+                len(getattr(pool, "connections", [])), {"provider": provider}
+            )
+
+    async def aclose(self):
+        for client in self.clients.values():
+            await client.aclose()
+
+        self.clients.clear()
+        self.transports.clear()
+
+
+class BedrockProviderCache:
+    """Bedrock providers by (API key hash, region), built once per process.
+
+    Building the botocore client loads the service models from disk, this is
+    slow and blocking, so it is done in a thread.
+    """
+
+    def __init__(self):
+        self.providers: OrderedDict[tuple[str, str], BedrockProvider] = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, api_key: str, region_name: str) -> BedrockProvider:
+        key = (sha256(api_key.encode()).hexdigest(), region_name)
+        with self.lock:
+            if (provider := self.providers.get(key)) is not None:
+                self.providers.move_to_end(key)
+                lookups_counter.add(1, {"provider": "bedrock", "hit": True})
+                return provider
+
+            lookups_counter.add(1, {"provider": "bedrock", "hit": False})
+            started_at = perf_counter()
+            provider = BedrockProvider(api_key=api_key, region_name=region_name)
+            bedrock_construction_histogram.record(perf_counter() - started_at)
+
+            self.providers[key] = provider
+            while len(self.providers) > settings.BEDROCK_PROVIDER_CACHE_SIZE:
+                self.providers.popitem(last=False)
+
+            return provider
+
+    async def aget(self, api_key: str, region_name: str) -> BedrockProvider:
+        return await sync_to_async(self.get, thread_sensitive=False)(
+            api_key, region_name
+        )
+
+    @logfire.instrument("warm_bedrock_providers")
+    async def warm(self):
+        """Build the providers of the known credentials."""
+        async for credentials in AWSBedrockCredentials.objects.all():
+            await self.aget(credentials.api_key, credentials.region_name)
+
+
+client_pool = ClientPool()
+bedrock_providers = BedrockProviderCache()
+
+logfire.metric_gauge_callback(
+    "camille.ai.clients.connections",
+    [client_pool.connections],
+    description="Number of open connections to the model providers",
+)
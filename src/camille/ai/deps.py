@@ -17,9 +17,17 @@
 from dataclasses import dataclass, field
 
 from django.contrib.auth.models import User
+from django.db.models import QuerySet
 from httpx import AsyncClient
 
 
+def with_prompt_context(users: QuerySet[User]) -> QuerySet[User]:
+    """Users along with the agent config and personality the instructions read
+    about them, loaded in a single query whatever their number. The
+    instructions are rendered in the event loop, where lazy queries fail."""
+    return users.select_related("agent_config__personality")
+
+
 @dataclass
 class Deps:
     agent_name: str
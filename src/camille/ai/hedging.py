@@ -0,0 +1,239 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import (
+    FIRST_COMPLETED,
+    Event,
+    Future,
+    Task,
+    create_task,
+    gather,
+    get_running_loop,
+    wait,
+)
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from statistics import quantiles
+from time import monotonic
+from typing import Any, Optional, TypeVar
+
+import logfire
+from django.conf import settings
+from pydantic_ai import RunContext
+from pydantic_ai.messages import ModelMessage, ModelResponse
+from pydantic_ai.models import Model, ModelRequestParameters, StreamedResponse
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.settings import ModelSettings
+
+T = TypeVar("T")
+
+hedges_counter = logfire.metric_counter(
+    "camille.ai.hedges",
+    description="Number of hedged model requests, by outcome (won, lost, over_budget)",
+)
+
+
+class LatencyTracker:
+    """Recent latencies of a model, for a kind of request."""
+
+    def __init__(self):
+        self.samples: deque[float] = deque(maxlen=settings.MODEL_HEDGE_SAMPLES)
+
+    def record(self, latency: float):
+        self.samples.append(latency)
+
+    def delay(self) -> float:
+        """Delay before hedging a request."""
+        if len(self.samples) < settings.MODEL_HEDGE_MIN_SAMPLES:
+            return settings.MODEL_HEDGE_DEFAULT_DELAY
+
+        return quantiles(self.samples, n=100)[settings.MODEL_HEDGE_PERCENTILE - 1]
+
+
+class HedgeBudget:
+    """Hedges fired per user over the last hour, each one costs a request."""
+
+    def __init__(self):
+        self.hedges: dict[int, deque[float]] = {}
+
+    def allow(self, user_id: int) -> bool:
+        now = monotonic()
+        hedges = self.hedges.setdefault(user_id, deque())
+        while hedges and hedges[0] < now - 3600:
+            hedges.popleft()
+
+        if len(hedges) >= settings.MODEL_HEDGE_BUDGET:
+            return False
+
+        hedges.append(now)
+        return True
+
+
+# Shared by all the users. By model and mode: the time to the whole response
+# of a request, or to the opening of a stream.
+latencies: dict[tuple[str, str], LatencyTracker] = {}
+budget = HedgeBudget()
+
+
+def get_latency_tracker(name: str, mode: str) -> LatencyTracker:
+    if (tracker := latencies.get((name, mode))) is None:
+        tracker = latencies[name, mode] = LatencyTracker()
+
+    return tracker
+
+
+class HedgedModel(WrapperModel):
+    """Duplicate a request still without output after the usual delay.
+
+    The duplicate goes to the alternate model, the first to answer wins and
+    the other one is cancelled.
+    """
+
+    def __init__(
+        self,
+        wrapped: Model,
+        name: str,
+        alternate: Model,
+        alternate_name: str,
+        user_id: int,
+    ):
+        super().__init__(wrapped)
+        self.name = name
+        self.alternate = alternate
+        self.alternate_name = alternate_name
+        self.user_id = user_id
+        # Name of the model which won the last race
+        self.answered_by: Optional[str] = None
+
+    async def race(
+        self, attempt: Callable[[Model, str], Awaitable[T]], mode: str
+    ) -> tuple[T, Optional[Task]]:
+        """Run the attempt on the wrapped model, then on the alternate one if
+        it's too slow. Return the result and the attempt still running."""
+        hedge = None
+        tasks = {create_task(attempt(self.wrapped, self.name))}
+        try:
+            done, _ = await wait(
+                tasks, timeout=get_latency_tracker(self.name, mode).delay()
+            )
+            if not done:
+                if budget.allow(self.user_id):
+                    logfire.info("Hedging request to {model}", model=self.name)
+                    hedge = create_task(attempt(self.alternate, self.alternate_name))
+                    tasks.add(hedge)
+                else:
+                    hedges_counter.add(
+                        1, {"model": self.name, "outcome": "over_budget"}
+                    )
+
+            while True:
+                done, pending = await wait(tasks, return_when=FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                # Give the other attempt a chance to succeed
+                if not succeeded and pending:
+                    tasks = pending
+                    continue
+
+                winner = (succeeded or list(done))[0]
+                if winner in succeeded:
+                    self.answered_by = (
+                        self.alternate_name if winner is hedge else self.name
+                    )
+                if hedge is not None:
+                    hedges_counter.add(
+                        1,
+                        {
+                            "model": self.name,
+                            "outcome": "won" if winner is hedge else "lost",
+                        },
+                    )
+
+                return winner.result(), next(iter(pending), None)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def request(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+    ) -> ModelResponse:
+        async def attempt(model: Model, name: str) -> ModelResponse:
+            started_at = monotonic()
+            response = await model.request(
+                messages, model_settings, model_request_parameters
+            )
+            get_latency_tracker(name, "request").record(monotonic() - started_at)
+            return response
+
+        response, loser = await self.race(attempt, "request")
+        if loser is not None:
+            loser.cancel()
+            await gather(loser, return_exceptions=True)
+
+        return response
+
+    @asynccontextmanager
+    async def request_stream(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+        run_context: RunContext[Any] | None = None,
+    ) -> AsyncIterator[StreamedResponse]:
+        # The streams must be closed by the tasks which opened them, keep the
+        # tasks alive until the winning stream has been consumed
+        consumed = Event()
+        owners: list[Task] = []
+
+        async def attempt(model: Model, name: str) -> StreamedResponse:
+            opened: Future[StreamedResponse] = get_running_loop().create_future()
+
+            async def owner():
+                started_at = monotonic()
+                async with model.request_stream(
+                    messages, model_settings, model_request_parameters, run_context
+                ) as response_stream:
+                    get_latency_tracker(name, "stream").record(monotonic() - started_at)
+                    opened.set_result(response_stream)
+                    await consumed.wait()
+
+            def forward_error(task: Task):
+                if not opened.done() and not task.cancelled() and task.exception():
+                    opened.set_exception(task.exception())
+
+            task = create_task(owner())
+            task.add_done_callback(forward_error)
+            owners.append(task)
+            try:
+                return await opened
+            except BaseException:
+                task.cancel()
+                raise
+
+        response_stream, loser = await self.race(attempt, "stream")
+        if loser is not None:
+            loser.cancel()
+            await gather(loser, return_exceptions=True)
+
+        try:
+            yield response_stream
+        finally:
+            consumed.set()
+            await gather(*owners, return_exceptions=True)
@@ -14,23 +14,34 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import monotonic
+from typing import Optional
+
+import logfire
+from django.conf import settings
 from django.contrib.auth.models import User
-from httpx import AsyncClient, HTTPStatusError
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from pydantic_ai.models import Model
 from pydantic_ai.models.anthropic import AnthropicModel
 from pydantic_ai.models.bedrock import BedrockConverseModel
+from pydantic_ai.models.fallback import FallbackModel
 from pydantic_ai.models.google import GoogleModel
 from pydantic_ai.models.mistral import MistralModel
 from pydantic_ai.models.openrouter import OpenRouterModel
 from pydantic_ai.providers.anthropic import AnthropicProvider
-from pydantic_ai.providers.bedrock import BedrockProvider
 from pydantic_ai.providers.google import GoogleProvider
 from pydantic_ai.providers.mistral import MistralProvider
 from pydantic_ai.providers.openrouter import OpenRouterProvider
-from pydantic_ai.retries import AsyncTenacityTransport, RetryConfig, wait_retry_after
-from tenacity import retry_if_exception_type, stop_after_attempt, wait_exponential
 
+from camille.ai.breakers import CircuitBreakerModel, get_breaker
+from camille.ai.clients import bedrock_providers, client_pool
+from camille.ai.hedging import HedgedModel
+from camille.ai.router import Tier
 from camille.models import (
+    AgentConfig,
     AnthropicCredentials,
     AWSBedrockCredentials,
     GoogleGLACredentials,
@@ -38,37 +49,59 @@ from camille.models import (
     OpenRouterCredentials,
 )
 
-
-def create_retrying_client():
-    """Create a client with smart retry handling for multiple error types."""
-
-    def should_retry_status(response):
-        """Raise exceptions for retryable HTTP status codes."""
-        if response.status_code in (429, 502, 503, 504):
-            response.raise_for_status()  # This will raise HTTPStatusError
-
-    transport = AsyncTenacityTransport(
-        config=RetryConfig(
-            # Retry on HTTP errors and connection issues
-            retry=retry_if_exception_type((HTTPStatusError, ConnectionError)),
-            # Smart waiting: respects Retry-After headers, falls back to exponential backoff
-            wait=wait_retry_after(
-                fallback_strategy=wait_exponential(multiplier=1, max=60), max_wait=300
-            ),
-            # Stop after 5 attempts
-            stop=stop_after_attempt(5),
-            # Re-raise the last exception if all retries fail
-            reraise=True,
-        ),
-        validate_response=should_retry_status,
-    )
-    return AsyncClient(transport=transport, timeout=300)
+cache_counter = logfire.metric_counter(
+    "camille.ai.models.cache",
+    description="Number of model lookups in the cache, by outcome",
+)
 
 
 class NoCredentialsError(ValueError):
     pass
 
 
+class ModelCache:
+    """Ready to use models by (user id, model string), with TTL and LRU eviction.
+
+    Entries are invalidated when the credentials or the agent config of their
+    user change in this process, the TTL bounds the staleness otherwise.
+    """
+
+    def __init__(self):
+        self.entries: OrderedDict[tuple[int, str], tuple[float, Model]] = OrderedDict()
+
+    def get(self, key: tuple[int, str]) -> Optional[Model]:
+        try:
+            expires_at, model = self.entries[key]
+        except KeyError:
+            cache_counter.add(1, {"outcome": "miss"})
+            return None
+
+        if expires_at < monotonic():
+            del self.entries[key]
+            cache_counter.add(1, {"outcome": "expired"})
+            return None
+
+        self.entries.move_to_end(key)
+        cache_counter.add(1, {"outcome": "hit"})
+        return model
+
+    def set(self, key: tuple[int, str], model: Model):
+        self.entries[key] = (monotonic() + settings.MODEL_CACHE_TTL, model)
+        self.entries.move_to_end(key)
+        while len(self.entries) > settings.MODEL_CACHE_SIZE:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        for key in [key for key in self.entries if key[0] == user_id]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+
+model_cache = ModelCache()
+
+
 async def create_anthropic_model_for_user(user: User, model_name: str) -> Model:
     try:
         credentials = await AnthropicCredentials.objects.aget(user=user)
@@ -80,7 +113,7 @@ async def create_anthropic_model_for_user(user: User, model_name: str) -> Model:
     return AnthropicModel(
         model_name,
         provider=AnthropicProvider(
-            api_key=credentials.api_key, http_client=create_retrying_client()
+            api_key=credentials.api_key, http_client=client_pool.get("anthropic")
         ),
     )
 
@@ -95,8 +128,8 @@ async def create_bedrock_model_for_user(user: User, model_name: str) -> Model:
 
     return BedrockConverseModel(
         model_name,
-        provider=BedrockProvider(
-            api_key=credentials.api_key, region_name=credentials.region_name
+        provider=await bedrock_providers.aget(
+            credentials.api_key, credentials.region_name
         ),
     )
 
@@ -112,7 +145,7 @@ async def create_google_model_for_user(user: User, model_name: str) -> Model:
     return GoogleModel(
         model_name,
         provider=GoogleProvider(
-            api_key=credentials.api_key, http_client=create_retrying_client()
+            api_key=credentials.api_key, http_client=client_pool.get("google-gla")
         ),
     )
 
@@ -128,7 +161,7 @@ async def create_mistral_model_for_user(user: User, model_name: str) -> Model:
     return MistralModel(
         model_name,
         provider=MistralProvider(
-            api_key=credentials.api_key, http_client=create_retrying_client()
+            api_key=credentials.api_key, http_client=client_pool.get("mistral")
         ),
     )
 
@@ -144,29 +177,124 @@ async def create_openrouter_model_for_user(user: User, model_name: str) -> Model
     return OpenRouterModel(
         model_name,
         provider=OpenRouterProvider(
-            api_key=credentials.api_key, http_client=create_retrying_client()
+            api_key=credentials.api_key, http_client=client_pool.get("openrouter")
         ),
     )
 
 
 async def create_model_for_user(user: User, model: str) -> Model:
+    key = (user.id, model)
+    if (instance := model_cache.get(key)) is not None:
+        return instance
+
     model_provider, model_name = model.split(":", 1)
 
     match model_provider:
         case "anthropic":
-            return await create_anthropic_model_for_user(user, model_name)
+            instance = await create_anthropic_model_for_user(user, model_name)
 
         case "bedrock":
-            return await create_bedrock_model_for_user(user, model_name)
+            instance = await create_bedrock_model_for_user(user, model_name)
 
         case "google-gla":
-            return await create_google_model_for_user(user, model_name)
+            instance = await create_google_model_for_user(user, model_name)
 
         case "mistral":
-            return await create_mistral_model_for_user(user, model_name)
+            instance = await create_mistral_model_for_user(user, model_name)
 
         case "openrouter":
-            return await create_openrouter_model_for_user(user, model_name)
+            instance = await create_openrouter_model_for_user(user, model_name)
 
         case _:
             raise ValueError(f"Unsupported model provider: {model_provider}")
+
+    model_cache.set(key, instance)
+    return instance
+
+
+@dataclass
+class ModelChain:
+    """The model of an agent run, and the names of the models it is made of."""
+
+    model: Model
+    names: list[str]
+    tier: Tier = Tier.FULL  # LIGHT when the light model heads the chain
+
+    def answered(self) -> tuple[Tier, str]:
+        """Tier and name of the model of the last response, the first of the
+        chain if none."""
+        index = 0
+        model = self.model
+        if isinstance(model, FallbackModel):
+            answered_at = [wrapper.answered_at for wrapper in model.models]
+            if any(at is not None for at in answered_at):
+                index = answered_at.index(max(at or 0 for at in answered_at))
+            model = model.models[index].wrapped
+
+        tier = self.tier if index == 0 else Tier.FULL
+        # The hedge may have been answered by the alternate model
+        if isinstance(model, HedgedModel) and model.answered_by is not None:
+            return tier, model.answered_by
+
+        return tier, self.names[index]
+
+
+async def create_model_chain_for_user(
+    user: User, agent_config: AgentConfig, tier: Tier = Tier.FULL
+) -> ModelChain:
+    """The model of the agent, falling back on the next healthy model, hedged
+    if asked. Light turns go to the light model first, escalating to the model
+    when it fails."""
+    primary, *fallbacks = agent_config.model_chain()
+    models = [(primary, await create_model_for_user(user, primary))]
+    for name in fallbacks:
+        # Missing credentials or unsupported provider
+        try:
+            models.append((name, await create_model_for_user(user, name)))
+        except ValueError as e:
+            logfire.warn(
+                "Skipping fallback model {model}: {error}", model=name, error=str(e)
+            )
+
+    if agent_config.hedge_requests:
+        name, model = models[0]
+        alternate_name, alternate = models[1] if len(models) > 1 else models[0]
+        if alternate_name != name:
+            # The hedges respect the health of the alternate model too
+            alternate = CircuitBreakerModel(alternate, get_breaker(alternate_name))
+        models[0] = (
+            name,
+            HedgedModel(model, name, alternate, alternate_name, user.id),
+        )
+
+    used_tier = Tier.FULL
+    if tier == Tier.LIGHT and (light := agent_config.light_model):
+        try:
+            models.insert(0, (light, await create_model_for_user(user, light)))
+            used_tier = Tier.LIGHT
+        except ValueError as e:
+            logfire.warn(
+                "Skipping light model {model}: {error}", model=light, error=str(e)
+            )
+
+    names = [name for name, _ in models]
+    if len(models) == 1:
+        return ModelChain(models[0][1], names, used_tier)
+
+    return ModelChain(
+        FallbackModel(
+            *[CircuitBreakerModel(model, get_breaker(name)) for name, model in models]
+        ),
+        names,
+        used_tier,
+    )
+
+
+@receiver([post_save, post_delete], sender=AgentConfig)
+@receiver([post_save, post_delete], sender=AnthropicCredentials)
+@receiver([post_save, post_delete], sender=AWSBedrockCredentials)
+@receiver([post_save, post_delete], sender=GoogleGLACredentials)
+@receiver([post_save, post_delete], sender=MistralCredentials)
+@receiver([post_save, post_delete], sender=OpenRouterCredentials)
+def invalidate_model_cache(sender, instance, **kwargs):
+    model_cache.invalidate(instance.user_id)
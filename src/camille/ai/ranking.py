@@ -0,0 +1,210 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import re
+from collections import Counter
+from collections.abc import Iterable
+from datetime import datetime
+from json import JSONDecodeError, loads
+from math import log
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Count, Max
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    UserPromptPart,
+)
+
+from camille.models import AgentMemory
+
+# BM25 parameters, the usual ones
+K1 = 1.2
+B = 0.75
+
+word_re = re.compile(r"[^\W\d_]{2,}")
+
+
+def tokenize(text: str) -> list[str]:
+    return word_re.findall(text.lower())
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokens of the text for a model, roughly."""
+    return len(text) // 4 + 1
+
+
+def prompt_text(content: str) -> str:
+    """Message and file names of a user prompt, without its JSON envelope."""
+    try:
+        prompt = loads(content)
+    except JSONDecodeError:
+        return content
+
+    if not isinstance(prompt, dict) or not isinstance(prompt.get("message"), str):
+        return content
+
+    names = [
+        file["name"]
+        for file in prompt.get("files", [])
+        if isinstance(file, dict) and isinstance(file.get("name"), str)
+    ]
+    return "\n".join([prompt["message"], *names])
+
+
+def recent_text(messages: list[ModelMessage]) -> str:
+    """Text of the last messages of the conversation, the new prompt
+    included."""
+    texts = []
+    for message in messages[-settings.MEMORY_QUERY_MESSAGES :]:
+        if isinstance(message, ModelRequest):
+            texts.extend(
+                prompt_text(part.content)
+                for part in message.parts
+                if isinstance(part, UserPromptPart) and isinstance(part.content, str)
+            )
+        elif isinstance(message, ModelResponse):
+            texts.extend(
+                part.content for part in message.parts if isinstance(part, TextPart)
+            )
+
+    return "\n".join(texts)
+
+
+class UserMemories:
+    """Memories of a user and their inverted index, for BM25 ranking."""
+
+    def __init__(self):
+        self.memories: dict[int, AgentMemory] = {}
+        self.lengths: dict[int, int] = {}
+        self.total_length = 0
+        self.postings: dict[str, dict[int, int]] = {}  # Term frequency by memory
+
+    def __len__(self) -> int:
+        return len(self.memories)
+
+    def version(self) -> tuple[Optional[datetime], int]:
+        """Latest modification and count, as aggregated by the database."""
+        return (
+            max((memory.updated_at for memory in self.memories.values()), default=None),
+            len(self.memories),
+        )
+
+    def add(self, memory: AgentMemory):
+        """Add a memory, or replace its previous content."""
+        self.remove(memory.id)
+
+        terms = Counter(tokenize(memory.content))
+        self.memories[memory.id] = memory
+        self.lengths[memory.id] = terms.total()
+        self.total_length += terms.total()
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[memory.id] = frequency
+
+    def remove(self, memory_id: int):
+        if (memory := self.memories.pop(memory_id, None)) is None:
+            return
+
+        self.total_length -= self.lengths.pop(memory_id)
+        for term in set(tokenize(memory.content)):
+            del self.postings[term][memory_id]
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def scores(self, query: Iterable[str]) -> dict[int, float]:
+        """BM25 score of the memories matching the query."""
+        if not self.memories:
+            return {}
+
+        average_length = max(self.total_length / len(self.memories), 1)
+        scores: dict[int, float] = {}
+        for term in set(query):
+            if (postings := self.postings.get(term)) is None:
+                continue
+
+            idf = log(
+                1 + (len(self.memories) - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for memory_id, frequency in postings.items():
+                norm = K1 * (1 - B + B * self.lengths[memory_id] / average_length)
+                scores[memory_id] = scores.get(memory_id, 0.0) + idf * (
+                    frequency * (K1 + 1) / (frequency + norm)
+                )
+
+        return scores
+
+    def select(self, query: Iterable[str]) -> list[AgentMemory]:
+        """The most relevant memories, then the most recent ones, fitting in
+        the token budget. In chronological order."""
+        scores = self.scores(query)
+        ranked = sorted(
+            self.memories.values(),
+            key=lambda memory: (scores.get(memory.id, 0.0), memory.created_at),
+            reverse=True,
+        )
+
+        selected = []
+        budget = settings.MEMORY_TOKEN_BUDGET
+        for memory in ranked[: settings.MEMORY_TOP_K]:
+            if (tokens := estimate_tokens(memory.content)) <= budget:
+                selected.append(memory)
+                budget -= tokens
+
+        return sorted(selected, key=lambda memory: memory.created_at)
+
+
+class MemoryIndex:
+    """Indexed memories of the users, by user id.
+
+    The memory tools keep it up to date. The memories edited elsewhere, from
+    the web or by another process, are reloaded when the version in the
+    database differs.
+    """
+
+    def __init__(self):
+        self.users: dict[int, UserMemories] = {}
+
+    def get(self, user_id: int) -> UserMemories:
+        if (memories := self.users.get(user_id)) is None:
+            memories = self.users[user_id] = UserMemories()
+
+        return memories
+
+    async def refresh(self, user_ids: list[int]):
+        versions = {
+            row["user_id"]: (row["updated_at"], row["count"])
+            async for row in AgentMemory.objects.filter(user_id__in=user_ids)
+            .values("user_id")
+            .annotate(updated_at=Max("updated_at"), count=Count("id"))
+        }
+        outdated = [
+            user_id
+            for user_id in user_ids
+            if self.get(user_id).version() != versions.get(user_id, (None, 0))
+        ]
+        if not outdated:
+            return
+
+        reloaded = {user_id: UserMemories() for user_id in outdated}
+        async for memory in AgentMemory.objects.filter(user_id__in=outdated):
+            reloaded[memory.user_id].add(memory)
+        self.users.update(reloaded)
+
+
+memory_index = MemoryIndex()
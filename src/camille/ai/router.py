@@ -0,0 +1,73 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import re
+
+import logfire
+from django.conf import settings
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    ToolCallPart,
+    UserPromptPart,
+)
+
+from camille.models import MattermostConversationRun
+
+Tier = MattermostConversationRun.Tier
+
+decisions_counter = logfire.metric_counter(
+    "camille.ai.router.decisions",
+    description="Number of messages routed, by tier",
+)
+
+url_re = re.compile(r"https?://")
+
+
+def used_tools(history: list[ModelMessage]) -> bool:
+    """Whether tools were called since the last user prompt."""
+    for message in reversed(history):
+        if isinstance(message, ModelResponse):
+            if any(isinstance(part, ToolCallPart) for part in message.parts):
+                return True
+        elif isinstance(message, ModelRequest):
+            if any(isinstance(part, UserPromptPart) for part in message.parts):
+                return False
+
+    return False
+
+
+def classify(message: str, has_files: bool, history: list[ModelMessage]) -> Tier:
+    """Tier of the model answering the message.
+
+    Only short plain messages go to the light model. Files, links or code
+    call for tools or reasoning, as does a follow-up of a turn which used
+    tools.
+    """
+    if (
+        has_files
+        or len(message) > settings.MODEL_ROUTER_LIGHT_MAX_CHARS
+        or "`" in message
+        or url_re.search(message)
+        or used_tools(history)
+    ):
+        tier = Tier.FULL
+    else:
+        tier = Tier.LIGHT
+
+    decisions_counter.add(1, {"tier": tier.value})
+    return tier
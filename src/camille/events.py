@@ -0,0 +1,225 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import TaskGroup, create_task, sleep
+from collections.abc import Mapping
+from datetime import timedelta
+from json import loads
+from typing import TYPE_CHECKING, Any, Optional
+
+import logfire
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from camille.models import MattermostEvent
+
+if TYPE_CHECKING:
+    from camille.mattermost import Mattermost
+
+processed_counter = logfire.metric_counter(
+    "camille.events.processed",
+    description="Number of queued Mattermost events processed, by outcome",
+)
+latency_histogram = logfire.metric_histogram(
+    "camille.events.latency",
+    unit="s",
+    description="Time between the reception of an event and its processing",
+)
+
+
+class UnansweredError(Exception):
+    """A post failed to be answered before anything was posted, it can be
+    retried."""
+
+    def __init__(self, channel_id: str, root_id: str, error: Exception):
+        super().__init__(str(error))
+        self.channel_id = channel_id
+        self.root_id = root_id
+        self.error = error
+
+
+def post_priority(data: Mapping[str, Any]) -> int:
+    """Priority of a post mentioning the bot."""
+    if data.get("channel_type") != "D":
+        priority = "mention"
+    elif loads(data["post"])["message"].startswith("!/"):
+        priority = "command"
+    else:
+        priority = "direct"
+
+    priorities = settings.MATTERMOST_PRIORITIES
+    return priorities.get(priority, len(priorities))
+
+
+def event_root_id(kind: str, data: Mapping[str, Any]) -> str:
+    if kind == "webhook":
+        # Outgoing webhooks don't tell in which thread the post is, so their
+        # events are only ordered with the other events of the same post
+        return data["post_id"]
+
+    post_data = loads(data["post"])
+    return post_data["root_id"] or post_data["id"]
+
+
+def event_post_id(kind: str, data: Mapping[str, Any]) -> str:
+    if kind == "webhook":
+        return data["post_id"]
+
+    return loads(data["post"])["id"]
+
+
+def new_event(kind: str, data: Mapping[str, Any], priority: int) -> MattermostEvent:
+    return MattermostEvent(
+        kind=kind,
+        data=dict(data),
+        root_id=event_root_id(kind, data),
+        post_id=event_post_id(kind, data),
+        priority=priority,
+    )
+
+
+async def enqueue(kind: str, data: Mapping[str, Any], priority: int):
+    # A post already queued, by the listener, a relay or a webhook, is skipped
+    await MattermostEvent.objects.abulk_create(
+        [new_event(kind, data, priority)], ignore_conflicts=True
+    )
+
+
+@transaction.atomic
+def claim() -> Optional[MattermostEvent]:
+    """Lock the next event ready to be processed.
+
+    Events of a thread are processed one at a time, in reception order. Events
+    left in processing for longer than the lease belong to a dead worker and
+    are claimed again.
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.MATTERMOST_EVENT_LEASE)
+    earlier = MattermostEvent.objects.filter(
+        root_id=OuterRef("root_id"), id__lt=OuterRef("id")
+    ).exclude(status=MattermostEvent.Status.DEAD)
+    event = (
+        MattermostEvent.objects.select_for_update(skip_locked=True)
+        .filter(
+            Q(status=MattermostEvent.Status.PENDING, available_at__lte=now)
+            | Q(status=MattermostEvent.Status.PROCESSING, locked_at__lte=expired)
+        )
+        .exclude(Exists(earlier))
+        .order_by("priority", "id")
+        .first()
+    )
+    if event is None:
+        return None
+
+    event.status = MattermostEvent.Status.PROCESSING
+    event.locked_at = now
+    event.attempts = F("attempts") + 1
+    event.save(update_fields=["status", "locked_at", "attempts"])
+    event.refresh_from_db(fields=["attempts"])
+
+    return event
+
+
+def fail(event: MattermostEvent, error: Exception):
+    """Schedule a retry with exponential backoff, or give up on the event."""
+    event.last_error = repr(error)
+    event.locked_at = None
+    if event.attempts >= settings.MATTERMOST_EVENT_MAX_ATTEMPTS:
+        event.status = MattermostEvent.Status.DEAD
+        logfire.error(
+            "Giving up on {kind} event {id} after {attempts} attempts",
+            kind=event.kind,
+            id=event.id,
+            attempts=event.attempts,
+        )
+    else:
+        event.status = MattermostEvent.Status.PENDING
+        event.available_at = timezone.now() + timedelta(
+            seconds=settings.MATTERMOST_EVENT_RETRY_DELAY * 2 ** (event.attempts - 1)
+        )
+
+    event.save(update_fields=["last_error", "locked_at", "status", "available_at"])
+
+
+class EventWorker:
+    """Process the queued events with a Mattermost client not listening to
+    the WebSocket."""
+
+    def __init__(self, mattermost: "Mattermost", concurrency: int):
+        self.mattermost = mattermost
+        self.mattermost.retry_unanswered = True
+        self.concurrency = concurrency
+
+    async def run(self):
+        await self.mattermost.fetch_me()
+        async with TaskGroup() as tg:
+            for _ in range(self.concurrency):
+                tg.create_task(self.loop())
+
+    async def loop(self):
+        while True:
+            if (event := await sync_to_async(claim)()) is None:
+                await sleep(settings.MATTERMOST_WORKER_POLL_INTERVAL)
+                continue
+
+            await self.process(event)
+
+    async def process(self, event: MattermostEvent):
+        latency_histogram.record(
+            (timezone.now() - event.created_at).total_seconds(),
+            {"kind": event.kind},
+        )
+        heartbeat = create_task(self.heartbeat(event))
+        try:
+            await self.mattermost.handle_event(event.kind, event.data)
+        except Exception as e:
+            logfire.exception("Failed to process {kind} event", kind=event.kind)
+            await sync_to_async(fail)(event, e)
+            processed_counter.add(1, {"kind": event.kind, "outcome": event.status})
+            if event.status == MattermostEvent.Status.DEAD and isinstance(
+                e, UnansweredError
+            ):
+                await self.give_up(e)
+        else:
+            await event.adelete()
+            processed_counter.add(1, {"kind": event.kind, "outcome": "done"})
+        finally:
+            heartbeat.cancel()
+
+    async def heartbeat(self, event: MattermostEvent):
+        """Renew the lease of the event while it is processed, so another
+        worker doesn't claim it again."""
+        while True:
+            await sleep(settings.MATTERMOST_EVENT_LEASE / 3)
+            try:
+                await MattermostEvent.objects.filter(
+                    pk=event.pk, status=MattermostEvent.Status.PROCESSING
+                ).aupdate(locked_at=timezone.now())
+            except Exception:
+                logfire.exception(
+                    "Failed to renew the lease of event {id}", id=event.id
+                )
+
+    async def give_up(self, error: UnansweredError):
+        try:
+            await self.mattermost.send_error(
+                error.channel_id, error.root_id, error.error
+            )
+        except Exception:
+            logfire.exception("Failed to report the error")
@@ -0,0 +1,121 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import timedelta
+from typing import Any, Optional
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from camille.models import MattermostConversationRun
+
+GROUPS = {
+    "user": "user__username",
+    "model": "model",
+    "tier": "tier",
+}
+
+
+def seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+class Command(BaseCommand):
+    help = "Print the token usage and the latency of the agent runs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=7,
+            help="Number of days covered, up to now",
+        )
+        parser.add_argument(
+            "--by",
+            nargs="+",
+            choices=[*GROUPS, "day"],
+            default=["user", "model"],
+            help="Grouping of the runs",
+        )
+
+    def handle(self, *args, **options):
+        runs = MattermostConversationRun.objects.filter(
+            created_at__gte=timezone.now() - timedelta(days=options["days"])
+        )
+        fields = [GROUPS[group] for group in options["by"] if group in GROUPS]
+        expressions: dict[str, Any] = {}
+        if "day" in options["by"]:
+            expressions["day"] = TruncDate("created_at")
+
+        percentiles = runs.percentiles("duration", *fields, **expressions)
+        rows = [
+            [
+                *(group for group in options["by"] if group in GROUPS),
+                *expressions,
+                "runs",
+                "interrupted",
+                "input",
+                "output",
+                "cache read",
+                "cache write",
+                "requests",
+                "tool calls",
+                "queue",
+                "preamble",
+                "model",
+                "tools",
+                "post",
+                "p50",
+                "p95",
+                "p99",
+                "tool share",
+            ]
+        ]
+        for rollup in runs.rollup(*fields, **expressions):
+            group = tuple(rollup[key] for key in [*fields, *expressions])
+            tool_share = "-"
+            if rollup["total_duration"] and rollup["total_tool_time"] is not None:
+                tool_share = (
+                    f"{rollup['total_tool_time'] / rollup['total_duration']:.0%}"
+                )
+
+            rows.append(
+                [
+                    *(str(value) for value in group),
+                    str(rollup["runs"]),
+                    str(rollup["interruptions"]),
+                    str(rollup["total_input_tokens"]),
+                    str(rollup["total_output_tokens"]),
+                    str(rollup["total_cache_read_tokens"]),
+                    str(rollup["total_cache_write_tokens"]),
+                    str(rollup["total_requests"]),
+                    str(rollup["total_tool_calls"]),
+                    seconds(rollup["mean_queue_wait"]),
+                    seconds(rollup["mean_preamble"]),
+                    seconds(rollup["mean_model_time"]),
+                    seconds(rollup["mean_tool_time"]),
+                    seconds(rollup["mean_post_time"]),
+                    *(seconds(p) for p in percentiles.get(group, [None] * 3)),
+                    tool_share,
+                ]
+            )
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        for row in rows:
+            self.stdout.write(
+                "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+            )
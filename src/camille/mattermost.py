@@ -15,10 +15,15 @@
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 import random
-from asyncio import create_task
-from collections.abc import Mapping
+from asyncio import CancelledError, Task, create_task, sleep, timeout
+from collections import OrderedDict
+from collections.abc import AsyncIterable, Awaitable, Callable, Mapping
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
 from datetime import datetime
+from functools import partial
 from json import dumps, loads
+from time import monotonic, time
 from typing import Any, Optional
 from zoneinfo import ZoneInfo
 
@@ -32,45 +37,265 @@ from django.db import close_old_connections
 from django.urls import reverse
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
-from httpx import AsyncClient
-from httpx_ws import AsyncWebSocketSession, aconnect_ws
-from pydantic_ai import Agent, TextPart
+from httpx import AsyncClient, HTTPError, Timeout
+from httpx_ws import AsyncWebSocketSession, HTTPXWSException, aconnect_ws
+from pydantic_ai import (
+    Agent,
+    AgentRun,
+    ModelResponseStreamEvent,
+    PartDeltaEvent,
+    PartStartEvent,
+    TextPart,
+    TextPartDelta,
+    UsageLimitExceeded,
+)
 from pydantic_ai.capabilities import WebFetch, WebSearch
+from pydantic_ai.usage import RunUsage
 
+from camille import events
 from camille.ai.capabilities.conversation import ConversationCapability
 from camille.ai.capabilities.current_time import CurrentTimeCapability
 from camille.ai.capabilities.instructions import InstructionsCapability
 from camille.ai.capabilities.mattermost import MattermostCapability
 from camille.ai.capabilities.memory import MemoryCapability
 from camille.ai.capabilities.personality import PersonalityCapability
-from camille.ai.deps import MattermostDeps
-from camille.ai.models import NoCredentialsError, create_model_for_user
-from camille.models import AgentConfig, MattermostConversation
+from camille.ai.capabilities.prompt_caching import PromptCachingCapability
+from camille.ai.clients import bedrock_providers, client_pool
+from camille.ai.deps import MattermostDeps, with_prompt_context
+from camille.ai.models import NoCredentialsError, create_model_chain_for_user
+from camille.ai.router import classify
+from camille.members import ChannelMembersCache
+from camille.models import (
+    AgentConfig,
+    MattermostChannelCursor,
+    MattermostConversation,
+    MattermostConversationRun,
+)
+from camille.quotas import Quotas
+from camille.scheduler import Scheduler
+from camille.transport import create_mattermost_transport
 
+reconnect_counter = logfire.metric_counter(
+    "camille.mattermost.reconnects",
+    description="Number of WebSocket reconnections",
+)
+downtime_histogram = logfire.metric_histogram(
+    "camille.mattermost.downtime",
+    unit="s",
+    description="Time between a WebSocket disconnection and the next hello",
+)
+backfill_counter = logfire.metric_counter(
+    "camille.mattermost.backfilled",
+    description="Number of missed mentions fetched through the REST API",
+)
+time_to_first_post_histogram = logfire.metric_histogram(
+    "camille.mattermost.time_to_first_post",
+    unit="s",
+    description="Time between the start of an agent run and its first visible text",
+)
+interrupted_counter = logfire.metric_counter(
+    "camille.mattermost.interrupted",
+    description="Number of answers interrupted by a usage limit or the deadline",
+)
+duplicate_counter = logfire.metric_counter(
+    "camille.mattermost.duplicates",
+    description="Number of posted events dropped because already seen",
+)
 
-def get_client() -> AsyncClient:
+
+@dataclass
+class RunStats:
+    """Accounting of an agent run, filled as it goes."""
+
+    usage: RunUsage = field(default_factory=RunUsage)
+    model_time: float = 0.0
+    tool_time: float = 0.0
+    marked_at: float = field(default_factory=monotonic)
+    posted: float = 0.0  # Post time of the writer at the mark
+
+    def record(self, node: Any, writer: "PostWriter"):
+        """Account the time since the last mark, minus posting, to the node
+        run in the meantime."""
+        now = monotonic()
+        elapsed = now - self.marked_at - (writer.post_time - self.posted)
+        if Agent.is_model_request_node(node):
+            self.model_time += elapsed
+        elif Agent.is_call_tools_node(node):
+            self.tool_time += elapsed
+
+        self.marked_at = now
+        self.posted = writer.post_time
+
+
+@dataclass
+class ThreadPost:
+    user: User
+    data: Mapping[str, Any]
+    post_data: Mapping[str, Any]
+
+
+def coalesce(posts: list[ThreadPost]) -> list[list[ThreadPost]]:
+    """Group consecutive posts of the same user so they are answered by a single run."""
+    batches: list[list[ThreadPost]] = []
+    for post in posts:
+        if batches and batches[-1][-1].user.id == post.user.id:
+            batches[-1].append(post)
+        else:
+            batches.append([post])
+
+    return batches
+
+
+class PostWriter:
+    """Write the text parts of an agent run as Mattermost posts.
+
+    When streaming, the post is created on the first tokens then patched at a
+    throttled rate until the part is complete.
+    """
+
+    def __init__(
+        self,
+        mattermost: "Mattermost",
+        channel_id: str,
+        root_id: str,
+        deps: MattermostDeps,
+    ):
+        self.mattermost = mattermost
+        self.channel_id = channel_id
+        self.root_id = root_id
+        self.deps = deps
+        self.started_at = monotonic()
+        self.first_post_at: Optional[float] = None
+        self.post_id: Optional[str] = None
+        self.text = ""
+        self.posted_text = ""
+        self.posted_at = 0.0
+        self.post_time = 0.0  # Seconds spent in Mattermost calls
+
+    async def write(self, content: str):
+        """Post a complete text part."""
+        await self.start()
+        self.text = content
+        await self.flush()
+
+    async def stream(self, stream: AsyncIterable[ModelResponseStreamEvent]):
+        async for event in stream:
+            if isinstance(event, PartStartEvent) and isinstance(event.part, TextPart):
+                await self.start()
+                await self.append(event.part.content)
+            elif isinstance(event, PartDeltaEvent) and isinstance(
+                event.delta, TextPartDelta
+            ):
+                await self.append(event.delta.content_delta)
+
+        await self.flush()
+
+    async def interrupt(self, reason: str, details: str):
+        """Post the answer written so far and why it stops there."""
+        interrupted_counter.add(1, {"reason": reason})
+        await self.write(f"_Answer interrupted: {details}._")
+
+    async def start(self):
+        # Finish the previous part, the next one goes to a new post
+        await self.flush()
+        self.post_id = None
+        self.text = ""
+        self.posted_text = ""
+
+    async def append(self, delta: str):
+        self.text += delta
+        if (
+            self.post_id is None
+            or monotonic() - self.posted_at >= settings.MATTERMOST_STREAM_INTERVAL
+            or len(self.text) - len(self.posted_text)
+            >= settings.MATTERMOST_STREAM_CHARS
+        ):
+            await self.flush()
+
+    async def flush(self):
+        if self.text == self.posted_text or not self.text.strip():
+            return
+
+        started_at = monotonic()
+        if self.post_id is None:
+            self.post_id = await self.mattermost.send_message(
+                self.channel_id,
+                self.text,
+                root_id=self.root_id,
+                file_ids=list(self.deps.generated_files_ids),
+            )
+            self.deps.generated_files_ids.clear()
+            if self.first_post_at is None:
+                self.first_post_at = monotonic()
+                time_to_first_post = self.first_post_at - self.started_at
+                logfire.info(
+                    "First post after {duration:.2f}s", duration=time_to_first_post
+                )
+                time_to_first_post_histogram.record(
+                    time_to_first_post,
+                    {"streaming": settings.MATTERMOST_STREAMING},
+                )
+        else:
+            await self.mattermost.update_message(self.post_id, self.text)
+
+        self.posted_text = self.text
+        self.posted_at = monotonic()
+        self.post_time += self.posted_at - started_at
+
+
+def get_client(**kwargs) -> AsyncClient:
     return AsyncClient(
         base_url=settings.MATTERMOST_BASE_URL + "/api/v4",
         headers={"Authorization": f"Bearer {settings.MATTERMOST_API_TOKEN}"},
+        **kwargs,
     )
 
 
 class Mattermost:
     def __init__(self):
-        self.client_http = get_client()
+        self.client_http = get_client(
+            transport=create_mattermost_transport(),
+            timeout=Timeout(
+                settings.MATTERMOST_HTTP_TIMEOUT,
+                connect=settings.MATTERMOST_HTTP_CONNECT_TIMEOUT,
+            ),
+        )
+        # The WebSocket upgrade requires HTTP/1.1 and must not be retried
+        self.client_upgrade = get_client()
         self.client_ws: Optional[AsyncWebSocketSession] = None
         self.me_mm_id: Optional[str] = None
         self.me_name: Optional[str] = None
+        self.me_username: Optional[str] = None
         self.current_seq = 0
+        self.connection_id: Optional[str] = None
+        self.server_seq = 0
+        self.seen_posts: OrderedDict[str, None] = OrderedDict()
+        # Timestamp of the last post received per channel, flushed periodically
+        self.cursors: dict[str, int] = {}
+        self.dirty_cursors: set[str] = set()
+        # Mentions not handled yet per channel, the flushed cursors stay before them
+        self.held_posts: dict[str, dict[str, int]] = {}
+        self.members = ChannelMembersCache(self.client_http)
+        self.scheduler = Scheduler(
+            settings.MATTERMOST_WORKERS, settings.MATTERMOST_QUEUE_SIZE
+        )
+        self.background_tasks: set[Task] = set()
+        # Posts waiting for the in-flight run of their thread, by root id
+        self.threads: dict[str, list[ThreadPost]] = {}
+        self.quotas = Quotas()
+        # Set by the queue workers, which retry the posts failing unanswered
+        self.retry_unanswered = False
         self.agent = Agent(
             deps_type=MattermostDeps,
             capabilities=[
+                # Stable instructions first, they make the cached prompt prefix
                 PersonalityCapability(),
+                InstructionsCapability(),
                 ConversationCapability(),
                 MattermostCapability(),
-                InstructionsCapability(),
                 MemoryCapability(),
                 CurrentTimeCapability(),
+                PromptCachingCapability(),
                 WebSearch(builtin=False),
                 WebFetch(builtin=False),
             ],
@@ -78,29 +303,415 @@ class Mattermost:
 
     async def __aenter__(self):
         await self.client_http.__aenter__()
+        await self.client_upgrade.__aenter__()
+        await self.scheduler.__aenter__()
+        self.create_background_task(bedrock_providers.warm())
+        await self.quotas.flush()
+        self.create_background_task(self.quotas.flush_periodically())
 
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        for task in self.background_tasks:
+            task.cancel()
+
+        await self.scheduler.__aexit__(exc_type, exc_val, exc_tb)
+        await self.flush_cursors()
+        await self.quotas.flush()
+        await self.client_upgrade.__aexit__(exc_type, exc_val, exc_tb)
         await self.client_http.__aexit__(exc_type, exc_val, exc_tb)
+        await client_pool.aclose()
 
-    async def run(self):
-        me = (await self.client_http.get("/users/me")).json()
+    async def fetch_me(self):
+        r = await self.client_http.get("/users/me")
+        r.raise_for_status()
+        me = r.json()
         self.me_mm_id = me["id"]
         self.me_name = me["first_name"] or me["username"]
-        async with aconnect_ws("websocket", self.client_http) as ws:
-            self.client_ws = ws
-            while True:
-                event = await ws.receive_json()
-                if kind := event.get("event"):
-                    # Concurrently handle events
-                    create_task(self.handle_event(kind, event["data"]))
+        self.me_username = me["username"]
+
+    async def run(self):
+        await self.fetch_me()
+        self.create_background_task(self.flush_cursors_periodically())
+
+        attempt = 0
+        disconnected_at = None
+        while True:
+            params = {}
+            if self.connection_id is not None:
+                # Ask the server to replay the events we missed
+                params = {
+                    "connection_id": self.connection_id,
+                    "sequence_number": self.server_seq,
+                }
+
+            try:
+                async with aconnect_ws(
+                    "websocket", self.client_upgrade, params=params
+                ) as ws:
+                    self.client_ws = ws
+                    self.current_seq = 0
+                    while True:
+                        text = await ws.receive_text()
+                        try:
+                            event = loads(text)
+                            if event.get("event") == "hello":
+                                attempt = 0
+                                if disconnected_at is not None:
+                                    downtime_histogram.record(
+                                        monotonic() - disconnected_at
+                                    )
+                                    disconnected_at = None
+
+                            self.receive(event)
+                        except Exception:
+                            # A malformed event must not drop the connection
+                            logfire.exception(
+                                "Skipping WebSocket event {event}", event=text
+                            )
+            except (HTTPError, HTTPXWSException, OSError) as e:
+                logfire.warn("WebSocket connection lost: {error}", error=str(e))
+            finally:
+                self.client_ws = None
+
+            if disconnected_at is None:
+                disconnected_at = monotonic()
+
+            # Exponential backoff with full jitter
+            delay = random.uniform(
+                0,
+                min(
+                    settings.MATTERMOST_RECONNECT_MAX_DELAY,
+                    settings.MATTERMOST_RECONNECT_MIN_DELAY * 2**attempt,
+                ),
+            )
+            attempt += 1
+            reconnect_counter.add(1)
+            await sleep(delay)
+
+    def receive(self, event: Mapping[str, Any]):
+        kind = event.get("event")
+        if kind == "hello":
+            self.hello(event["data"])
+
+        if (seq := event.get("seq")) is not None:
+            if seq != self.server_seq:
+                logfire.warn(
+                    "WebSocket sequence gap, expected {expected} got {seq}",
+                    expected=self.server_seq,
+                    seq=seq,
+                )
+            self.server_seq = seq + 1
+
+        if kind is None or kind == "hello":
+            return
+
+        data = event["data"]
+        # Membership events carry the channel in the broadcast
+        if "channel_id" not in data and (
+            channel_id := event.get("broadcast", {}).get("channel_id")
+        ):
+            data = {**data, "channel_id": channel_id}
+
+        match kind:
+            case "user_added":
+                self.members.add(data["channel_id"], data["user_id"])
+            case "user_removed" if "user_id" in data:
+                self.members.remove(data["channel_id"], data["user_id"])
+            case "user_removed" | "channel_deleted":
+                # We have been removed from the channel, or it is gone
+                self.members.forget(data["channel_id"])
+
+        if kind == "posted":
+            post = loads(data["post"])
+            if self.is_duplicate(post["id"]):
+                duplicate_counter.add(1)
+                return
+
+            self.advance_cursor(post["channel_id"], post["create_at"])
+
+        self.dispatch(kind, data)
+
+    def hello(self, data: Mapping[str, Any]):
+        self.members.live = True
+        connection_id = data.get("connection_id")
+        if connection_id != self.connection_id:
+            # The server couldn't resume the previous session, start over
+            logfire.info(
+                "New WebSocket session {connection_id}", connection_id=connection_id
+            )
+            self.connection_id = connection_id
+            self.server_seq = 0
+            # Membership events may have been missed too
+            self.members.forget()
+            # Events sent while we were away are lost, fetch the missed mentions
+            self.create_background_task(self.backfill())
+
+    def is_duplicate(self, post_id: str) -> bool:
+        """Remember the post id, return True if it has already been seen."""
+        if post_id in self.seen_posts:
+            self.seen_posts.move_to_end(post_id)
+            return True
+
+        self.seen_posts[post_id] = None
+        if len(self.seen_posts) > settings.MATTERMOST_SEEN_POSTS_SIZE:
+            self.seen_posts.popitem(last=False)
+
+        return False
+
+    def advance_cursor(self, channel_id: str, create_at: int):
+        if create_at > self.cursors.get(channel_id, 0):
+            self.cursors[channel_id] = create_at
+            self.dirty_cursors.add(channel_id)
+
+    def hold_cursor(self, post: Mapping[str, Any]):
+        held = self.held_posts.setdefault(post["channel_id"], {})
+        held[post["id"]] = post["create_at"]
+
+    def release_cursor(self, post: Mapping[str, Any]):
+        channel_id = post["channel_id"]
+        if (held := self.held_posts.get(channel_id)) is None:
+            return
+
+        held.pop(post["id"], None)
+        if not held:
+            del self.held_posts[channel_id]
+        if channel_id in self.cursors:
+            self.dirty_cursors.add(channel_id)
+
+    def flushed_cursor(self, channel_id: str) -> int:
+        """Cursor of the channel, before its mentions not handled yet so the
+        next backfill fetches them again."""
+        cursor = self.cursors[channel_id]
+        if held := self.held_posts.get(channel_id):
+            cursor = min(cursor, min(held.values()) - 1)
+
+        return cursor
+
+    async def flush_cursors(self):
+        if not self.dirty_cursors:
+            return
+
+        cursors = [
+            MattermostChannelCursor(
+                channel_id=channel_id, last_post_at=self.flushed_cursor(channel_id)
+            )
+            for channel_id in self.dirty_cursors
+        ]
+        self.dirty_cursors = set()
+        await MattermostChannelCursor.objects.abulk_create(
+            cursors,
+            update_conflicts=True,
+            unique_fields=["channel_id"],
+            update_fields=["last_post_at"],
+        )
+
+    async def flush_cursors_periodically(self):
+        while True:
+            await sleep(settings.MATTERMOST_CURSOR_FLUSH_INTERVAL)
+            try:
+                await self.flush_cursors()
+            except Exception:
+                logfire.exception("Failed to flush channel cursors")
+
+    @logfire.instrument("backfill")
+    async def backfill(self):
+        async for cursor in MattermostChannelCursor.objects.all():
+            self.advance_cursor(cursor.channel_id, cursor.last_post_at)
+
+        # Never seen anything, nothing to catch up
+        if not self.cursors:
+            return
+
+        # Channels without cursor are caught up since the last post we received
+        default_since = max(self.cursors.values())
+        floor = int((time() - settings.MATTERMOST_BACKFILL_MAX_AGE) * 1000)
+
+        r = await self.client_http.get("/users/me/channels")
+        r.raise_for_status()
+        for channel in r.json():
+            since = max(self.cursors.get(channel["id"], default_since), floor)
+            if channel["last_post_at"] <= since:
+                continue
+
+            posts = [
+                post
+                for post in await self.fetch_posts_since(channel["id"], since)
+                if self.mentions_me(channel, post)
+            ]
+            if not posts:
+                continue
+
+            r = await self.client_http.post(
+                "/users/ids", json=list({post["user_id"] for post in posts})
+            )
+            r.raise_for_status()
+            usernames = {u["id"]: u["username"] for u in r.json()}
+
+            for post in sorted(posts, key=lambda p: p["create_at"]):
+                if self.is_duplicate(post["id"]):
+                    duplicate_counter.add(1)
+                    continue
+
+                logfire.info("Backfilling post {post_id}", post_id=post["id"])
+                backfill_counter.add(1)
+                self.advance_cursor(channel["id"], post["create_at"])
+                sender_name = f"@{usernames.get(post['user_id'], post['user_id'])}"
+                self.dispatch(
+                    "posted",
+                    {
+                        "mentions": dumps([self.me_mm_id]),
+                        "sender_name": sender_name,
+                        "post": dumps(post),
+                        "channel_type": channel["type"],
+                        "channel_display_name": channel["display_name"] or sender_name,
+                    },
+                )
+                # Don't flood the model providers after a long downtime
+                await sleep(1 / settings.MATTERMOST_BACKFILL_RATE)
+
+    async def fetch_posts_since(
+        self, channel_id: str, since: int
+    ) -> list[Mapping[str, Any]]:
+        posts = []
+        page = 0
+        per_page = settings.MATTERMOST_BACKFILL_PAGE_SIZE
+        while True:
+            r = await self.client_http.get(
+                f"/channels/{channel_id}/posts",
+                params={"page": page, "per_page": per_page},
+            )
+            r.raise_for_status()
+            body = r.json()
+
+            # Posts are ordered from the newest to the oldest
+            for post_id in body["order"]:
+                post = body["posts"][post_id]
+                if post["create_at"] <= since:
+                    return posts
+
+                posts.append(post)
+
+            if len(body["order"]) < per_page:
+                return posts
+
+            page += 1
+
+    def mentions_me(self, channel: Mapping[str, Any], post: Mapping[str, Any]) -> bool:
+        # System messages and our own messages
+        if post.get("type") or post["user_id"] == self.me_mm_id:
+            return False
+
+        if channel["type"] == "D":
+            return True
+
+        return f"@{self.me_username}".lower() in post["message"].lower()
+
+    def get_handler(
+        self, kind: str
+    ) -> Optional[Callable[[Mapping[str, Any]], Awaitable[None]]]:
+        return getattr(self, f"on_{kind.replace(' ', '_')}", None)
+
+    def event_priority(self, kind: str, data: Mapping[str, Any]) -> int:
+        if kind == "posted" and self.me_mm_id in data.get("mentions", ""):
+            return events.post_priority(data)
+
+        priorities = settings.MATTERMOST_PRIORITIES
+        return priorities.get("event", len(priorities))
+
+    def dispatch(self, kind: str, data: Mapping[str, Any]):
+        # Events without handler are dropped before reaching the queue
+        if self.get_handler(kind) is None:
+            return
+
+        # Only mentions are worth a queue slot, on_posted ignores the chatter
+        if kind == "posted" and self.me_mm_id not in data.get("mentions", ""):
+            return
+
+        if kind == "posted":
+            # Kept for the next backfill until handled or queued
+            self.hold_cursor(loads(data["post"]))
+
+        if settings.MATTERMOST_EVENT_QUEUE:
+            if kind == "posted":
+                self.create_background_task(self.enqueue(kind, data))
+            return
+
+        if self.scheduler.submit(
+            self.event_priority(kind, data), partial(self.handle_dispatched, kind, data)
+        ):
+            return
+
+        logfire.warn("Event queue is full, dropping {kind} event", kind=kind)
+        if kind == "posted":
+            self.release_cursor(loads(data["post"]))
+            self.create_background_task(self.send_busy(data))
+
+    async def enqueue(self, kind: str, data: Mapping[str, Any]):
+        try:
+            await events.enqueue(kind, data, self.event_priority(kind, data))
+        except Exception:
+            logfire.exception("Failed to queue {kind} event", kind=kind)
+            return
+
+        self.release_cursor(loads(data["post"]))
+
+    def create_background_task(self, coro: Awaitable[None]) -> Task:
+        # Keep a reference so the task isn't garbage collected while running
+        task = create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+        return task
+
+    async def send_busy(self, data: Mapping[str, Any]):
+        post_data = loads(data["post"])
+        if post_data["user_id"] == self.me_mm_id:
+            return
+
+        await self.send_message(
+            post_data["channel_id"],
+            "I'm too busy right now, please retry later.",
+            root_id=post_data["root_id"] or post_data["id"],
+        )
+
+    async def handle_dispatched(self, kind: str, data: Mapping[str, Any]):
+        await self.handle_event(kind, data)
+        # Not reached when cancelled at shutdown or failed, the mention is
+        # backfilled after the restart
+        if kind == "posted":
+            self.release_cursor(loads(data["post"]))
 
     async def handle_event(self, kind: str, data: Mapping[str, Any]):
-        if (handler := getattr(self, f"on_{kind.replace(' ', '_')}", None)) is not None:
+        if (handler := self.get_handler(kind)) is not None:
             await sync_to_async(close_old_connections)()
             await handler(data)
 
+    @logfire.instrument("on_webhook")
+    async def on_webhook(self, data: Mapping[str, Any]):
+        """Answer a post received from an outgoing webhook.
+
+        The payload lacks most of the post details, fetch them.
+        """
+        r = await self.client_http.get(f"/posts/{data['post_id']}")
+        r.raise_for_status()
+        post = r.json()
+
+        r = await self.client_http.get(f"/channels/{post['channel_id']}")
+        r.raise_for_status()
+        channel = r.json()
+
+        sender_name = f"@{data['user_name']}"
+        await self.on_posted(
+            {
+                "mentions": dumps([self.me_mm_id]),
+                "sender_name": sender_name,
+                "post": dumps(post),
+                "channel_type": channel["type"],
+                "channel_display_name": channel["display_name"] or sender_name,
+            }
+        )
+
     @logfire.instrument("on_posted")
     async def on_posted(self, data: Mapping[str, Any]):
         # Not mentioned, not a DM, not a group DM, so ignore
@@ -123,7 +734,6 @@ class Mattermost:
         root_id = post_data["root_id"] or post_data["id"]
         message = post_data["message"]
 
-        conversation = None
         try:
             try:
                 user = await User.objects.aget(mm_binding__mm_id=sender_mm_id)
@@ -148,7 +758,38 @@ class Mattermost:
                     root_id=root_id,
                 )
                 return
+        except Exception as e:
+            await self.fail_unanswered(channel_id, root_id, e)
+            return
+
+        post = ThreadPost(user=user, data=data, post_data=post_data)
+        if (pending := self.threads.get(root_id)) is not None:
+            # A run is in flight for this thread, its lane will pick the post up
+            pending.append(post)
+            return
 
+        self.threads[root_id] = [post]
+        try:
+            while posts := self.threads[root_id]:
+                self.threads[root_id] = []
+                for batch in coalesce(posts):
+                    await self.reply(root_id, batch)
+        finally:
+            del self.threads[root_id]
+
+    async def reply(self, root_id: str, posts: list[ThreadPost]):
+        user = posts[0].user
+        data = posts[-1].data
+        channel_id = posts[-1].post_data["channel_id"]
+
+        started_at = monotonic()
+        # Since the oldest post, as stamped by the Mattermost server
+        queue_wait = max(0.0, time() - posts[0].post_data["create_at"] / 1000)
+
+        conversation = None
+        writer = None
+        error = None
+        try:
             agent_config = await AgentConfig.objects.aget(user=user)
             if agent_config.model is None:
                 await self.send_message(
@@ -158,8 +799,33 @@ class Mattermost:
                 )
                 return
 
+            if reason := self.quotas.exceeded(user.id, channel_id):
+                await self.send_message(
+                    channel_id,
+                    f"{reason}, the quota is reached. Please retry later.",
+                    root_id=root_id,
+                )
+                return
+
+            history = []
+            if previous := await MattermostConversation.objects.filter(
+                root_id=root_id
+            ).afirst():
+                history = await previous.amessages()
+
+            tier = MattermostConversationRun.Tier.FULL
+            if agent_config.light_model:
+                tier = classify(
+                    "\n".join(post.post_data["message"] for post in posts),
+                    any(
+                        post.post_data.get("metadata", {}).get("files")
+                        for post in posts
+                    ),
+                    history,
+                )
+
             try:
-                model = await create_model_for_user(user, agent_config.model)
+                chain = await create_model_chain_for_user(user, agent_config, tier)
             except NoCredentialsError:
                 await self.send_message(
                     channel_id,
@@ -168,44 +834,46 @@ class Mattermost:
                 )
                 return
 
-            user_prompt = {
-                "user_id": user.id,
-                "message": message,
-                "datetime": datetime.fromtimestamp(
-                    post_data["create_at"] / 1000, tz=ZoneInfo(settings.TIME_ZONE)
-                ).isoformat(),
-            }
+            user_prompts = []
+            for post in posts:
+                user_prompt = {
+                    "user_id": user.id,
+                    "message": post.post_data["message"],
+                    "datetime": datetime.fromtimestamp(
+                        post.post_data["create_at"] / 1000,
+                        tz=ZoneInfo(settings.TIME_ZONE),
+                    ).isoformat(),
+                }
 
-            post_metadata = post_data.get("metadata", {})
-            if files_data := post_metadata.get("files", []):
-                files = []
-                for file in files_data:
-                    files.append(
-                        {
-                            "id": file["id"],
-                            "name": file["name"],
-                            "size": file["size"],
-                            "mime_type": file["mime_type"],
-                        }
-                    )
-                user_prompt["files"] = files
+                post_metadata = post.post_data.get("metadata", {})
+                if files_data := post_metadata.get("files", []):
+                    files = []
+                    for file in files_data:
+                        files.append(
+                            {
+                                "id": file["id"],
+                                "name": file["name"],
+                                "size": file["size"],
+                                "mime_type": file["mime_type"],
+                            }
+                        )
+                    user_prompt["files"] = files
 
+                user_prompts.append(dumps(user_prompt))
+
+            member_ids = await self.members.user_ids(
+                channel_id, posts[-1].post_data["user_id"]
+            )
+            users = [
+                member
+                async for member in with_prompt_context(
+                    User.objects.filter(id__in={user.id, *member_ids}).order_by("id")
+                )
+            ]
             deps = MattermostDeps(
                 agent_name=self.me_name,
-                current_user=user,
-                all_users=[
-                    user
-                    async for user in User.objects.filter(
-                        mm_binding__mm_id__in=[
-                            m["user_id"]
-                            for m in (
-                                await self.client_http.get(
-                                    f"/channels/{channel_id}/members"
-                                )
-                            ).json()
-                        ]
-                    )
-                ],
+                current_user=next(member for member in users if member.id == user.id),
+                all_users=[member for member in users if member.id in member_ids],
                 channel_id=channel_id,
                 channel_name=data["channel_display_name"],
                 mattermost_client=self.client_http,
@@ -216,48 +884,127 @@ class Mattermost:
                 defaults={"channel_id": channel_id},
             )
 
-            await self.user_typing(channel_id)
-
-            async with self.agent.iter(
-                dumps(user_prompt),
-                deps=deps,
-                model=model,
-                message_history=await conversation.amessages(),
-            ) as run:
-                async for node in run:
-                    if self.agent.is_call_tools_node(node):
-                        for part in node.model_response.parts:
-                            if isinstance(part, TextPart):
-                                await self.send_message(
-                                    channel_id,
-                                    part.content,
-                                    root_id=root_id,
-                                    file_ids=deps.generated_files_ids,
-                                )
-                                deps.generated_files_ids.clear()
-
+            async with (
+                self.quotas.slot(user.id),
+                self.typing(channel_id, root_id),
+            ):
+                writer = PostWriter(self, channel_id, root_id, deps)
+                stats = RunStats()
+                run = await self.follow(
+                    writer,
+                    stats,
+                    agent_config.run_deadline(),
+                    "\n".join(user_prompts),
+                    deps=deps,
+                    model=chain.model,
+                    message_history=history,
+                    usage_limits=agent_config.usage_limits(),
+                )
+                tier, model_name = chain.answered()
+                self.quotas.record(
+                    user.id,
+                    channel_id,
+                    stats.usage.input_tokens + stats.usage.output_tokens,
+                    stats.usage.requests,
+                )
                 await conversation.runs.acreate(
                     user=user,
-                    messages_json=run.new_messages_json(),
+                    # An interrupted run may end on unanswered tool calls, it is
+                    # not kept in the history of the thread
+                    messages_json=run.new_messages_json() if run else b"[]",
+                    interrupted=run is None,
+                    input_tokens=stats.usage.input_tokens,
+                    output_tokens=stats.usage.output_tokens,
+                    cache_read_tokens=stats.usage.cache_read_tokens,
+                    cache_write_tokens=stats.usage.cache_write_tokens,
+                    requests=stats.usage.requests,
+                    tool_calls=stats.usage.tool_calls,
+                    tier=tier,
+                    model=model_name,
+                    queue_wait=queue_wait,
+                    preamble=writer.started_at - started_at,
+                    duration=monotonic() - writer.started_at,
+                    model_time=stats.model_time,
+                    tool_time=stats.tool_time,
+                    post_time=writer.post_time,
                 )
         except Exception as e:
-            await self.send_message(
-                channel_id,
-                f"An error occurred while processing your message. Please try again later.\nError details: {e}",
-                root_id=root_id,
-            )
+            error = e
 
         # If the conversation has no runs, delete it to save space
         if conversation and not await conversation.runs.aexists():
             await conversation.adelete()
 
+        if error is not None:
+            if writer is None or writer.first_post_at is None:
+                await self.fail_unanswered(channel_id, root_id, error)
+            else:
+                await self.send_error(channel_id, root_id, error)
+
+    async def follow(
+        self,
+        writer: PostWriter,
+        stats: RunStats,
+        deadline: int,
+        user_prompt: str,
+        **kwargs,
+    ) -> Optional[AgentRun[MattermostDeps, str]]:
+        """Run the agent, posting the answer as it goes. Return the run, or
+        None if it was interrupted by a usage limit or the deadline."""
+        try:
+            # Cancel the whole run on the deadline, its graph tasks included
+            async with timeout(deadline) as cm:
+                async with self.agent.iter(user_prompt, **kwargs) as run:
+                    previous = None
+                    try:
+                        async for node in run:
+                            stats.record(previous, writer)
+                            previous = node
+                            if settings.MATTERMOST_STREAMING:
+                                if self.agent.is_model_request_node(node):
+                                    async with node.stream(run.ctx) as stream:
+                                        await writer.stream(stream)
+                            elif self.agent.is_call_tools_node(node):
+                                for part in node.model_response.parts:
+                                    if isinstance(part, TextPart):
+                                        await writer.write(part.content)
+                    finally:
+                        stats.record(previous, writer)
+                        stats.usage = run.usage
+        except UsageLimitExceeded as e:
+            await writer.interrupt("usage_limit", str(e))
+            return None
+        except TimeoutError:
+            if not cm.expired():
+                raise
+
+            await writer.interrupt(
+                "deadline", f"It took longer than {deadline} seconds"
+            )
+            return None
+
+        return run
+
+    async def fail_unanswered(self, channel_id: str, root_id: str, error: Exception):
+        if self.retry_unanswered:
+            raise events.UnansweredError(channel_id, root_id, error) from error
+
+        await self.send_error(channel_id, root_id, error)
+
+    async def send_error(self, channel_id: str, root_id: str, error: Exception):
+        await self.send_message(
+            channel_id,
+            f"An error occurred while processing your message. Please try again later.\nError details: {error}",
+            root_id=root_id,
+        )
+
     async def send_message(
         self,
         channel_id: str,
         message: str,
         root_id: Optional[str] = None,
         file_ids: Optional[list[str]] = None,
-    ):
+    ) -> str:
         data = {"channel_id": channel_id, "message": message}
         if root_id is not None:
             data["root_id"] = root_id
@@ -265,10 +1012,20 @@ class Mattermost:
         if file_ids:
             data["file_ids"] = file_ids
 
-        await self.client_http.post(
+        r = await self.client_http.post(
             "/posts",
             json=data,
         )
+        r.raise_for_status()
+
+        return r.json()["id"]
+
+    async def update_message(self, post_id: str, message: str):
+        r = await self.client_http.put(
+            f"/posts/{post_id}/patch",
+            json={"message": message},
+        )
+        r.raise_for_status()
 
     async def handle_commands(
         self,
@@ -380,5 +1137,35 @@ Available commands:
             }
         )
 
-    async def user_typing(self, channel_id: str) -> None:
-        await self.ws_send("user_typing", {"channel_id": channel_id})
+    async def user_typing(
+        self, channel_id: str, parent_id: Optional[str] = None
+    ) -> None:
+        # Best effort, the indicator is lost while we are reconnecting
+        if self.client_ws is None:
+            return
+
+        data = {"channel_id": channel_id}
+        if parent_id is not None:
+            data["parent_id"] = parent_id
+
+        await self.ws_send("user_typing", data)
+
+    @asynccontextmanager
+    async def typing(self, channel_id: str, parent_id: Optional[str] = None):
+        """Keep the typing indicator alive for the duration of the block."""
+        task = create_task(self.typing_heartbeat(channel_id, parent_id))
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(CancelledError):
+                await task
+
+    async def typing_heartbeat(self, channel_id: str, parent_id: Optional[str]):
+        while True:
+            try:
+                await self.user_typing(channel_id, parent_id)
+            except Exception as e:
+                logfire.warn("Failed to send typing indicator: {error}", error=str(e))
+
+            await sleep(settings.MATTERMOST_TYPING_INTERVAL)
@@ -0,0 +1,107 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from time import monotonic
+from typing import Optional
+
+from django.conf import settings
+from httpx import AsyncClient
+
+from camille.models import MattermostBinding
+
+
+class ChannelMembersCache:
+    """Members of the Mattermost channels, and the users bound to them.
+
+    Channels are fetched once then kept up to date from the WebSocket
+    events, or refetched when stale in the processes not listening to them.
+    Bindings are reloaded when stale or when an unknown sender shows up.
+    """
+
+    def __init__(self, client: AsyncClient):
+        self.client = client
+        self.channels: dict[str, set[str]] = {}
+        self.channels_loaded_at: dict[str, float] = {}
+        # Set once the WebSocket delivers the membership events
+        self.live = False
+        self.bindings: dict[str, int] = {}  # Mattermost id -> Django user id
+        self.bindings_loaded_at: Optional[float] = None
+
+    async def members(self, channel_id: str) -> set[str]:
+        members = self.channels.get(channel_id)
+        if members is None or (
+            not self.live
+            and monotonic() - self.channels_loaded_at[channel_id]
+            > settings.MATTERMOST_MEMBERS_TTL
+        ):
+            members = await self.fetch_members(channel_id)
+            self.channels[channel_id] = members
+            self.channels_loaded_at[channel_id] = monotonic()
+
+        return members
+
+    async def fetch_members(self, channel_id: str) -> set[str]:
+        members = set()
+        page = 0
+        per_page = settings.MATTERMOST_MEMBERS_PAGE_SIZE
+        while True:
+            r = await self.client.get(
+                f"/channels/{channel_id}/members",
+                params={"page": page, "per_page": per_page},
+            )
+            r.raise_for_status()
+            body = r.json()
+            members.update(m["user_id"] for m in body)
+            if len(body) < per_page:
+                return members
+
+            page += 1
+
+    async def load_bindings(self):
+        self.bindings = {
+            binding.mm_id: binding.user_id
+            async for binding in MattermostBinding.objects.all()
+        }
+        self.bindings_loaded_at = monotonic()
+
+    async def user_ids(self, channel_id: str, sender_mm_id: str) -> list[int]:
+        """Ids of the Django users in the channel."""
+        members = await self.members(channel_id)
+        if (
+            self.bindings_loaded_at is None
+            or monotonic() - self.bindings_loaded_at > settings.MATTERMOST_BINDINGS_TTL
+            or sender_mm_id not in self.bindings
+        ):
+            await self.load_bindings()
+
+        return [user_id for mm_id in members if (user_id := self.bindings.get(mm_id))]
+
+    def add(self, channel_id: str, mm_id: str):
+        if (members := self.channels.get(channel_id)) is not None:
+            members.add(mm_id)
+
+    def remove(self, channel_id: str, mm_id: str):
+        if (members := self.channels.get(channel_id)) is not None:
+            members.discard(mm_id)
+
+    def forget(self, channel_id: Optional[str] = None):
+        """Forget a channel, or all of them."""
+        if channel_id is None:
+            self.channels.clear()
+            self.channels_loaded_at.clear()
+        else:
+            self.channels.pop(channel_id, None)
+            self.channels_loaded_at.pop(channel_id, None)
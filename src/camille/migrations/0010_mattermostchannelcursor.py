@@ -0,0 +1,29 @@
+# Generated by Django 6.0.5 on 2026-10-18 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0009_agentmemory_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MattermostChannelCursor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("channel_id", models.CharField(max_length=26, unique=True)),
+                ("last_post_at", models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 6.0.5 on 2026-10-18 05:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0010_mattermostchannelcursor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MattermostEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("kind", models.CharField(max_length=64)),
+                ("data", models.JSONField()),
+                ("root_id", models.CharField(max_length=26)),
+                ("priority", models.SmallIntegerField(default=0)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("processing", "Processing"),
+                            ("dead", "Dead"),
+                        ],
+                        default="pending",
+                        max_length=16,
+                    ),
+                ),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                (
+                    "available_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("locked_at", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["status", "priority", "available_at"],
+                        name="camille_mat_status_c2cb48_idx",
+                    ),
+                    models.Index(
+                        fields=["root_id", "status"],
+                        name="camille_mat_root_id_536850_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
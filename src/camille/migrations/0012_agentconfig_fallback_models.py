@@ -0,0 +1,21 @@
+# Generated by Django 6.0.5 on 2026-10-18 05:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0011_mattermostevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="agentconfig",
+            name="fallback_models",
+            field=models.TextField(
+                blank=True,
+                help_text="One model per line, tried in order when the model is unavailable",
+            ),
+        ),
+    ]
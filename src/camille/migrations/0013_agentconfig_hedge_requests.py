@@ -0,0 +1,21 @@
+# Generated by Django 6.0.5 on 2026-10-18 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0012_agentconfig_fallback_models"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="agentconfig",
+            name="hedge_requests",
+            field=models.BooleanField(
+                default=False,
+                help_text="Send a duplicate request to the first fallback model, or the model itself, when the model is slower than usual. Costs more tokens.",
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.5 on 2026-10-18 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0013_agentconfig_hedge_requests"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="cache_read_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="cache_write_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="input_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="output_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0.5 on 2026-10-18 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0014_mattermostconversationrun_usage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="agentconfig",
+            name="light_model",
+            field=models.CharField(
+                blank=True,
+                help_text="Faster and cheaper model answering the trivial messages, leave empty to always use the model",
+                max_length=64,
+            ),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="duration",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="model",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="tier",
+            field=models.CharField(
+                choices=[("light", "Light"), ("full", "Full")],
+                default="full",
+                max_length=8,
+            ),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 6.0.5 on 2026-10-18 06:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0015_routing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="agentconfig",
+            name="deadline",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Seconds per answer, empty for the default",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="agentconfig",
+            name="max_input_tokens",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Summed over the requests of an answer, empty for the default",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="agentconfig",
+            name="max_output_tokens",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Summed over the requests of an answer, empty for the default",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="agentconfig",
+            name="max_tool_calls",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Per answer, empty for the default", null=True
+            ),
+        ),
+    ]
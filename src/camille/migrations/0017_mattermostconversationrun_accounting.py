@@ -0,0 +1,61 @@
+# Generated by Django 6.0.5 on 2026-10-18 06:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0016_agentconfig_limits"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="interrupted",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="model_time",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="post_time",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="preamble",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="queue_wait",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="requests",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="tool_calls",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="mattermostconversationrun",
+            name="tool_time",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="mattermostconversationrun",
+            index=models.Index(
+                fields=["created_at"], name="camille_mat_created_cfc0e7_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 6.0.5 on 2026-10-18 06:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0017_mattermostconversationrun_accounting"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UsageBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "scope",
+                    models.CharField(
+                        choices=[("user", "User"), ("channel", "Channel")], max_length=8
+                    ),
+                ),
+                ("key", models.CharField(max_length=26)),
+                ("minute", models.BigIntegerField()),
+                ("tokens", models.PositiveBigIntegerField(default=0)),
+                ("requests", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["minute"], name="camille_usa_minute_a59dd5_idx"
+                    )
+                ],
+                "unique_together": {("scope", "key", "minute")},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.5 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0018_usage_buckets"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="agentconfig",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="agentpersonality",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
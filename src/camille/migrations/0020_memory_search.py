@@ -0,0 +1,100 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+# Generated by Django 6.0.5 on 2026-10-18 06:38
+
+from django.db import migrations
+
+# Full-text index of the memories, kept in sync by the database itself
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE camille_agentmemory ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+    """,
+    """
+    CREATE INDEX camille_agentmemory_search_idx ON camille_agentmemory
+    USING GIN (search_vector)
+    """,
+]
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX camille_agentmemory_search_idx",
+    "ALTER TABLE camille_agentmemory DROP COLUMN search_vector",
+]
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE camille_agentmemory_fts USING fts5(
+        content,
+        content='camille_agentmemory',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER camille_agentmemory_fts_insert
+    AFTER INSERT ON camille_agentmemory BEGIN
+        INSERT INTO camille_agentmemory_fts(rowid, content)
+        VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER camille_agentmemory_fts_delete
+    AFTER DELETE ON camille_agentmemory BEGIN
+        INSERT INTO camille_agentmemory_fts(camille_agentmemory_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER camille_agentmemory_fts_update
+    AFTER UPDATE OF content ON camille_agentmemory BEGIN
+        INSERT INTO camille_agentmemory_fts(camille_agentmemory_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO camille_agentmemory_fts(rowid, content)
+        VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO camille_agentmemory_fts(camille_agentmemory_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER camille_agentmemory_fts_update",
+    "DROP TRIGGER camille_agentmemory_fts_delete",
+    "DROP TRIGGER camille_agentmemory_fts_insert",
+    "DROP TABLE camille_agentmemory_fts",
+]
+
+
+def run(statements):
+    def inner(apps, schema_editor):
+        # The other databases fall back to a plain search
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return inner
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0019_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"postgresql": POSTGRESQL_FORWARD, "sqlite": SQLITE_FORWARD}),
+            reverse_code=run(
+                {"postgresql": POSTGRESQL_BACKWARD, "sqlite": SQLITE_BACKWARD}
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.5 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camille", "0020_memory_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mattermostevent",
+            name="post_id",
+            field=models.CharField(max_length=26, null=True, unique=True),
+        ),
+    ]
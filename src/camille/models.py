@@ -14,13 +14,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+from collections import defaultdict
+from statistics import quantiles
+from typing import Any, Optional
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Avg, Count, Q, Sum
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from encrypted_fields.fields import EncryptedCharField
 from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter
+from pydantic_ai.usage import UsageLimits
 
 
 class MattermostBinding(models.Model):
@@ -44,6 +51,7 @@ class AgentPersonality(models.Model):
     name = models.SlugField(max_length=64)
     description = models.CharField(max_length=255, blank=True)
     prompt_template = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ("user", "name")
@@ -61,12 +69,71 @@ class AgentConfig(models.Model):
     model = models.CharField(
         max_length=64, help_text="https://pydantic.dev/docs/ai/models/overview/"
     )
+    fallback_models = models.TextField(
+        blank=True,
+        help_text="One model per line, tried in order when the model is unavailable",
+    )
+    light_model = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text="Faster and cheaper model answering the trivial messages, "
+        "leave empty to always use the model",
+    )
+    hedge_requests = models.BooleanField(
+        default=False,
+        help_text="Send a duplicate request to the first fallback model, or the "
+        "model itself, when the model is slower than usual. Costs more tokens.",
+    )
     personality = models.ForeignKey(
         AgentPersonality, on_delete=models.SET_NULL, null=True, blank=True
     )
     instructions = models.TextField(
         blank=True
     )  # Additional instructions to the agent, appended to the personality prompt
+    # Bounds of a single answer, the server defaults apply when empty
+    max_tool_calls = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Per answer, empty for the default"
+    )
+    max_input_tokens = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Summed over the requests of an answer, empty for the default",
+    )
+    max_output_tokens = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Summed over the requests of an answer, empty for the default",
+    )
+    deadline = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Seconds per answer, empty for the default"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def model_chain(self) -> list[str]:
+        """The model followed by its fallback models."""
+        return [self.model] + [
+            model
+            for line in self.fallback_models.splitlines()
+            if (model := line.strip())
+        ]
+
+    def usage_limits(self) -> UsageLimits:
+        def limit(value: Optional[int], default: int) -> int:
+            return default if value is None else value
+
+        return UsageLimits(
+            tool_calls_limit=limit(self.max_tool_calls, settings.AGENT_MAX_TOOL_CALLS),
+            input_tokens_limit=limit(
+                self.max_input_tokens, settings.AGENT_MAX_INPUT_TOKENS
+            ),
+            output_tokens_limit=limit(
+                self.max_output_tokens, settings.AGENT_MAX_OUTPUT_TOKENS
+            ),
+        )
+
+    def run_deadline(self) -> int:
+        """Seconds an answer may take."""
+        return settings.AGENT_DEADLINE if self.deadline is None else self.deadline
 
     def clean(self):
         if self.personality and self.personality.user != self.user:
@@ -148,13 +215,155 @@ class MattermostConversation(models.Model):
         return messages
 
 
+class MattermostConversationRunQuerySet(models.QuerySet):
+    def rollup(self, *fields: str, **expressions: Any) -> models.QuerySet:
+        """Totals and mean durations of the runs, grouped by the fields and
+        the expressions."""
+        return (
+            self.annotate(**expressions)
+            .values(*fields, *expressions)
+            .annotate(
+                runs=Count("id"),
+                interruptions=Count("id", filter=Q(interrupted=True)),
+                total_input_tokens=Sum("input_tokens"),
+                total_output_tokens=Sum("output_tokens"),
+                total_cache_read_tokens=Sum("cache_read_tokens"),
+                total_cache_write_tokens=Sum("cache_write_tokens"),
+                total_requests=Sum("requests"),
+                total_tool_calls=Sum("tool_calls"),
+                total_duration=Sum("duration"),
+                total_tool_time=Sum("tool_time"),
+                mean_queue_wait=Avg("queue_wait"),
+                mean_preamble=Avg("preamble"),
+                mean_duration=Avg("duration"),
+                mean_model_time=Avg("model_time"),
+                mean_tool_time=Avg("tool_time"),
+                mean_post_time=Avg("post_time"),
+            )
+            .order_by(*fields, *expressions)
+        )
+
+    def percentiles(
+        self,
+        field: str,
+        *fields: str,
+        percentiles: tuple[int, ...] = (50, 95, 99),
+        **expressions: Any,
+    ) -> dict[tuple, list[float]]:
+        """Percentiles of a duration, grouped by the fields and the
+        expressions. Computed in Python, as SQLite has no percentile
+        function."""
+        samples = defaultdict(list)
+        for *group, value in (
+            self.exclude(**{f"{field}__isnull": True})
+            .annotate(**expressions)
+            .values_list(*fields, *expressions, field)
+        ):
+            samples[tuple(group)].append(value)
+
+        result = {}
+        for group, values in samples.items():
+            if len(values) == 1:
+                result[group] = values * len(percentiles)
+            else:
+                cuts = quantiles(values, n=100, method="inclusive")
+                result[group] = [cuts[p - 1] for p in percentiles]
+
+        return result
+
+
 class MattermostConversationRun(models.Model):
+    class Tier(models.TextChoices):
+        LIGHT = "light"  # Answered by the light model
+        FULL = "full"
+
     conversation = models.ForeignKey(
         MattermostConversation, on_delete=models.CASCADE, related_name="runs"
     )
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     messages_json = models.BinaryField()
+    input_tokens = models.PositiveIntegerField(default=0)
+    output_tokens = models.PositiveIntegerField(default=0)
+    # Part of the input tokens, read from or written to the provider prompt cache
+    cache_read_tokens = models.PositiveIntegerField(default=0)
+    cache_write_tokens = models.PositiveIntegerField(default=0)
+    requests = models.PositiveIntegerField(default=0)
+    tool_calls = models.PositiveIntegerField(default=0)
+    tier = models.CharField(max_length=8, choices=Tier.choices, default=Tier.FULL)
+    model = models.CharField(max_length=64, blank=True)  # Model of the last response
+    # Stopped by a usage limit or the deadline, its messages are not kept
+    interrupted = models.BooleanField(default=False)
+    # Seconds, between the post and the start of the reply
+    queue_wait = models.FloatField(null=True, blank=True)
+    # Seconds, between the start of the reply and the start of the agent run
+    preamble = models.FloatField(null=True, blank=True)
+    # Seconds, the agent run split in model requests, tool calls and posting
+    duration = models.FloatField(null=True, blank=True)
+    model_time = models.FloatField(null=True, blank=True)
+    tool_time = models.FloatField(null=True, blank=True)
+    post_time = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = MattermostConversationRunQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["created_at"])]
+
     def messages(self) -> list[ModelMessage]:
         return ModelMessagesTypeAdapter.validate_json(self.messages_json)
+
+
+class MattermostChannelCursor(models.Model):
+    """High-water mark of the posts processed from a Mattermost channel."""
+
+    channel_id = models.CharField(max_length=26, unique=True)
+    last_post_at = models.BigIntegerField()  # Milliseconds since epoch, as Mattermost
+
+
+class MattermostEvent(models.Model):
+    """Mattermost event waiting for a worker."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        PROCESSING = "processing"
+        DEAD = "dead"
+
+    kind = models.CharField(max_length=64)
+    data = models.JSONField()
+    root_id = models.CharField(max_length=26)
+    # Deduplicates the posts received from several sources
+    post_id = models.CharField(max_length=26, null=True, unique=True)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "priority", "available_at"]),
+            models.Index(fields=["root_id", "status"]),
+        ]
+
+
+class UsageBucket(models.Model):
+    """Tokens and model requests of a user or a channel during a minute, for
+    the quotas."""
+
+    class Scope(models.TextChoices):
+        USER = "user"
+        CHANNEL = "channel"
+
+    scope = models.CharField(max_length=8, choices=Scope.choices)
+    key = models.CharField(max_length=26)  # User id or Mattermost channel id
+    minute = models.BigIntegerField()  # Minutes since epoch
+    tokens = models.PositiveBigIntegerField(default=0)
+    requests = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("scope", "key", "minute")
+        indexes = [models.Index(fields=["minute"])]
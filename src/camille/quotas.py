@@ -0,0 +1,176 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import Semaphore, sleep
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from time import time
+from typing import Optional
+
+import logfire
+from django.conf import settings
+from django.db.models import F
+
+from camille.models import UsageBucket
+
+Scope = UsageBucket.Scope
+# Tokens and requests by minute, by (scope, key)
+Buckets = dict[tuple[str, str], dict[int, list[int]]]
+
+rejected_counter = logfire.metric_counter(
+    "camille.quotas.rejected",
+    description="Number of runs rejected because their user or channel was over quota",
+)
+deferred_counter = logfire.metric_counter(
+    "camille.quotas.deferred",
+    description="Number of runs waiting for another run of their user to end",
+)
+
+
+def current_minute() -> int:
+    return int(time() // 60)
+
+
+def merge(
+    buckets: Buckets, key: tuple[str, str], minute: int, tokens: int, requests: int
+):
+    bucket = buckets.setdefault(key, {}).setdefault(minute, [0, 0])
+    bucket[0] += tokens
+    bucket[1] += requests
+
+
+class Quotas:
+    """Rolling token and request budgets of the users and channels, and a cap
+    on the concurrent runs of a user.
+
+    The usage is counted in memory by minute. It is periodically added to the
+    database, then reloaded from it so the processes see the usage of each
+    other.
+    """
+
+    def __init__(self):
+        self.persisted: Buckets = {}
+        self.pending: Buckets = {}
+        self.flushing: Buckets = {}  # Pending usage being added to the database
+        self.semaphores: dict[int, Semaphore] = {}
+
+    def totals(self, scope: str, key: str) -> tuple[int, int]:
+        """Tokens and requests over the window."""
+        since = current_minute() - settings.QUOTA_WINDOW // 60
+        tokens = requests = 0
+        for buckets in (self.persisted, self.flushing, self.pending):
+            for minute, (bucket_tokens, bucket_requests) in buckets.get(
+                (scope, key), {}
+            ).items():
+                if minute > since:
+                    tokens += bucket_tokens
+                    requests += bucket_requests
+
+        return tokens, requests
+
+    def exceeded(self, user_id: int, channel_id: str) -> Optional[str]:
+        """Why a new run of the user in the channel is over quota, if it is."""
+        for scope, key, who, max_tokens, max_requests in (
+            (
+                Scope.USER,
+                str(user_id),
+                "You have",
+                settings.QUOTA_USER_TOKENS,
+                settings.QUOTA_USER_REQUESTS,
+            ),
+            (
+                Scope.CHANNEL,
+                channel_id,
+                "This channel has",
+                settings.QUOTA_CHANNEL_TOKENS,
+                settings.QUOTA_CHANNEL_REQUESTS,
+            ),
+        ):
+            tokens, requests = self.totals(scope, key)
+            if max_tokens and tokens >= max_tokens:
+                reason = f"{who} used {tokens} of {max_tokens} tokens"
+            elif max_requests and requests >= max_requests:
+                reason = f"{who} made {requests} of {max_requests} model requests"
+            else:
+                continue
+
+            rejected_counter.add(1, {"scope": scope.value})
+            return f"{reason} over the last {settings.QUOTA_WINDOW // 60} minutes"
+
+        return None
+
+    def record(self, user_id: int, channel_id: str, tokens: int, requests: int):
+        minute = current_minute()
+        for key in (
+            (Scope.USER.value, str(user_id)),
+            (Scope.CHANNEL.value, channel_id),
+        ):
+            merge(self.pending, key, minute, tokens, requests)
+
+    @asynccontextmanager
+    async def slot(self, user_id: int) -> AsyncIterator[None]:
+        """Hold one of the concurrent runs of the user, waiting for one to end
+        if they are all taken."""
+        if (semaphore := self.semaphores.get(user_id)) is None:
+            semaphore = self.semaphores[user_id] = Semaphore(
+                settings.QUOTA_USER_CONCURRENCY
+            )
+
+        if semaphore.locked():
+            deferred_counter.add(1)
+
+        async with semaphore:
+            yield
+
+    async def flush(self):
+        self.flushing, self.pending = self.pending, {}
+        try:
+            for (scope, key), buckets in list(self.flushing.items()):
+                for minute, (tokens, requests) in list(buckets.items()):
+                    bucket, _ = await UsageBucket.objects.aget_or_create(
+                        scope=scope, key=key, minute=minute
+                    )
+                    await UsageBucket.objects.filter(pk=bucket.pk).aupdate(
+                        tokens=F("tokens") + tokens, requests=F("requests") + requests
+                    )
+                    # Still counted until the usage is reloaded
+                    del buckets[minute]
+                    merge(self.persisted, (scope, key), minute, tokens, requests)
+        finally:
+            # Anything not written is retried on the next flush
+            for (scope, key), buckets in self.flushing.items():
+                for minute, (tokens, requests) in buckets.items():
+                    merge(self.pending, (scope, key), minute, tokens, requests)
+            self.flushing = {}
+
+        since = current_minute() - settings.QUOTA_WINDOW // 60
+        await UsageBucket.objects.filter(minute__lte=since).adelete()
+
+        persisted: Buckets = {}
+        async for bucket in UsageBucket.objects.filter(minute__gt=since):
+            persisted.setdefault((bucket.scope, bucket.key), {})[bucket.minute] = [
+                bucket.tokens,
+                bucket.requests,
+            ]
+        self.persisted = persisted
+
+    async def flush_periodically(self):
+        while True:
+            await sleep(settings.QUOTA_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                logfire.exception("Failed to flush the quotas")
@@ -0,0 +1,93 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import PriorityQueue, QueueFull, Task, create_task, gather
+from collections.abc import Awaitable, Callable
+from itertools import count
+from time import monotonic
+
+import logfire
+
+Job = Callable[[], Awaitable[None]]
+
+queue_depth_gauge = logfire.metric_gauge(
+    "camille.scheduler.queue_depth",
+    description="Number of jobs waiting for a worker",
+)
+wait_time_histogram = logfire.metric_histogram(
+    "camille.scheduler.wait_time",
+    unit="s",
+    description="Time spent by a job in the queue before a worker picked it",
+)
+rejected_counter = logfire.metric_counter(
+    "camille.scheduler.rejected",
+    description="Number of jobs rejected because the queue was full",
+)
+
+
+class Scheduler:
+    """A fixed-size pool of workers consuming a bounded priority queue.
+
+    Lower priority values are served first, jobs of the same priority are
+    served in submission order.
+    """
+
+    def __init__(self, workers: int, maxsize: int):
+        self.workers = workers
+        self.queue: PriorityQueue[tuple[int, int, float, Job]] = PriorityQueue(maxsize)
+        self.counter = count()
+        self.tasks: list[Task] = []
+
+    async def __aenter__(self):
+        self.tasks = [create_task(self.worker()) for _ in range(self.workers)]
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        for task in self.tasks:
+            task.cancel()
+
+        await gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def submit(self, priority: int, job: Job) -> bool:
+        """Queue a job, return False if the queue is full."""
+        try:
+            self.queue.put_nowait((priority, next(self.counter), monotonic(), job))
+        except QueueFull:
+            rejected_counter.add(1, {"priority": priority})
+            return False
+
+        queue_depth_gauge.set(self.depth)
+        return True
+
+    async def worker(self):
+        while True:
+            priority, _, enqueued_at, job = await self.queue.get()
+            queue_depth_gauge.set(self.depth)
+            wait_time_histogram.record(
+                monotonic() - enqueued_at, {"priority": priority}
+            )
+            try:
+                await job()
+            except Exception:
+                logfire.exception("Scheduled job failed")
+            finally:
+                self.queue.task_done()
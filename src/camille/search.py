@@ -0,0 +1,112 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import re
+from typing import Any
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from camille.models import AgentMemory
+
+word_re = re.compile(r"\w+")
+
+POSTGRESQL_SEARCH = """
+    SELECT m.id, m.user_id, m.created_at,
+        ts_headline('simple', m.content, q,
+            'StartSel=**, StopSel=**, MaxFragments=2, MaxWords=24, MinWords=8')
+    FROM camille_agentmemory m, websearch_to_tsquery('simple', %s) q
+    WHERE m.search_vector @@ q AND m.user_id = ANY(%s)
+    ORDER BY ts_rank(m.search_vector, q) DESC, m.id DESC
+    LIMIT %s OFFSET %s
+"""
+SQLITE_SEARCH = """
+    SELECT m.id, m.user_id, m.created_at,
+        snippet(camille_agentmemory_fts, 0, '**', '**', '…', 24)
+    FROM camille_agentmemory_fts
+    JOIN camille_agentmemory m ON m.id = camille_agentmemory_fts.rowid
+    WHERE camille_agentmemory_fts MATCH %s AND m.user_id IN ({user_ids})
+    ORDER BY bm25(camille_agentmemory_fts), m.id DESC
+    LIMIT %s OFFSET %s
+"""
+
+
+def search_memories(
+    query: str, user_ids: list[int], page: int = 1
+) -> tuple[list[dict[str, Any]], bool]:
+    """Memories of the users matching all the words of the query, the best
+    matches first. Return a page of results, with the matches highlighted,
+    and whether there are more."""
+    words = word_re.findall(query)
+    if not words or not user_ids:
+        return [], False
+
+    limit = settings.MEMORY_SEARCH_PAGE_SIZE
+    offset = (max(page, 1) - 1) * limit
+    if connection.vendor == "postgresql":
+        sql = POSTGRESQL_SEARCH
+        params = [query, user_ids, limit + 1, offset]
+    elif connection.vendor == "sqlite":
+        sql = SQLITE_SEARCH.format(user_ids=", ".join(["%s"] * len(user_ids)))
+        # Quoted, the words can't be taken for the FTS5 query syntax
+        params = [" ".join(f'"{word}"' for word in words), *user_ids]
+        params += [limit + 1, offset]
+    else:
+        return search_memories_without_index(words, user_ids, limit, offset)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    return [
+        {"id": id, "user_id": user_id, "created_at": created_at, "snippet": snippet}
+        for id, user_id, created_at, snippet in rows[:limit]
+    ], len(rows) > limit
+
+
+def search_memories_without_index(
+    words: list[str], user_ids: list[int], limit: int, offset: int
+) -> tuple[list[dict[str, Any]], bool]:
+    memories = AgentMemory.objects.filter(user_id__in=user_ids)
+    for word in words:
+        memories = memories.filter(content__icontains=word)
+
+    rows = list(memories.order_by("-id")[offset : offset + limit + 1])
+    return [
+        {
+            "id": memory.id,
+            "user_id": memory.user_id,
+            "created_at": memory.created_at,
+            "snippet": memory.content,
+        }
+        for memory in rows[:limit]
+    ], len(rows) > limit
+
+
+def search_memories_in_thread(
+    query: str, user_ids: list[int], page: int = 1
+) -> tuple[list[dict[str, Any]], bool]:
+    # Like a request, the worker thread drops its expired or broken connection
+    close_old_connections()
+    try:
+        return search_memories(query, user_ids, page)
+    finally:
+        close_old_connections()
+
+
+# Off the thread shared by the ORM calls, the searches are the slow queries
+asearch_memories = sync_to_async(search_memories_in_thread, thread_sensitive=False)
@@ -194,6 +194,152 @@ LOGOUT_REDIRECT_URL = "home"
 # Mattermost settings
 MATTERMOST_BASE_URL = environ.get("MATTERMOST_BASE_URL")
 MATTERMOST_API_TOKEN = environ.get("MATTERMOST_API_TOKEN")
+MATTERMOST_WORKERS = int(environ.get("MATTERMOST_WORKERS", "8"))
+MATTERMOST_QUEUE_SIZE = int(environ.get("MATTERMOST_QUEUE_SIZE", "64"))
+MATTERMOST_RECONNECT_MIN_DELAY = float(
+    environ.get("MATTERMOST_RECONNECT_MIN_DELAY", "1")
+)
+MATTERMOST_RECONNECT_MAX_DELAY = float(
+    environ.get("MATTERMOST_RECONNECT_MAX_DELAY", "60")
+)
+# Number of post ids remembered to drop replayed events
+MATTERMOST_SEEN_POSTS_SIZE = 4096
+# Flush interval in seconds of the per-channel high-water marks
+MATTERMOST_CURSOR_FLUSH_INTERVAL = 10
+# Mentions older than this (in seconds) are not backfilled after a downtime
+MATTERMOST_BACKFILL_MAX_AGE = int(environ.get("MATTERMOST_BACKFILL_MAX_AGE", "86400"))
+# Backfilled mentions dispatched per second
+MATTERMOST_BACKFILL_RATE = float(environ.get("MATTERMOST_BACKFILL_RATE", "1"))
+MATTERMOST_BACKFILL_PAGE_SIZE = 200
+MATTERMOST_MEMBERS_PAGE_SIZE = 200
+# Lifetime in seconds of the cached channel members outside the WebSocket listener
+MATTERMOST_MEMBERS_TTL = 300
+# Lifetime in seconds of the cached Mattermost to Django users mapping
+MATTERMOST_BINDINGS_TTL = 300
+# Stream the replies by progressively editing the posts
+MATTERMOST_STREAMING = environ.get("MATTERMOST_STREAMING", "true").lower() in [
+    "true",
+    "1",
+    "on",
+]
+# A streamed post is patched every interval seconds or every chars characters
+MATTERMOST_STREAM_INTERVAL = float(environ.get("MATTERMOST_STREAM_INTERVAL", "1"))
+MATTERMOST_STREAM_CHARS = int(environ.get("MATTERMOST_STREAM_CHARS", "400"))
+# Delay in seconds between two typing indicators during an agent run
+MATTERMOST_TYPING_INTERVAL = float(environ.get("MATTERMOST_TYPING_INTERVAL", "3"))
+# HTTP client of the Mattermost REST API
+MATTERMOST_HTTP2 = environ.get("MATTERMOST_HTTP2", "true").lower() in [
+    "true",
+    "1",
+    "on",
+]
+MATTERMOST_HTTP_MAX_CONNECTIONS = int(
+    environ.get("MATTERMOST_HTTP_MAX_CONNECTIONS", "20")
+)
+MATTERMOST_HTTP_MAX_KEEPALIVE = int(environ.get("MATTERMOST_HTTP_MAX_KEEPALIVE", "10"))
+# Generous enough to upload the generated files
+MATTERMOST_HTTP_TIMEOUT = float(environ.get("MATTERMOST_HTTP_TIMEOUT", "60"))
+MATTERMOST_HTTP_CONNECT_TIMEOUT = 10
+# Attempts of a rate limited or failed request, including the first one
+MATTERMOST_HTTP_RETRIES = int(environ.get("MATTERMOST_HTTP_RETRIES", "5"))
+# Queue the mentions in the database for the mattermost_worker processes instead
+# of answering them from the WebSocket listener
+MATTERMOST_EVENT_QUEUE = environ.get("MATTERMOST_EVENT_QUEUE", "false").lower() in [
+    "true",
+    "1",
+    "on",
+]
+# A queued event is retried with exponential backoff, then marked as dead
+MATTERMOST_EVENT_MAX_ATTEMPTS = int(environ.get("MATTERMOST_EVENT_MAX_ATTEMPTS", "5"))
+MATTERMOST_EVENT_RETRY_DELAY = 10
+# Seconds after which an event still in processing is claimed again, the
+# worker processing it renews the lease while alive
+MATTERMOST_EVENT_LEASE = int(environ.get("MATTERMOST_EVENT_LEASE", "900"))
+MATTERMOST_WORKER_POLL_INTERVAL = 1
+# Token of the outgoing webhook posting to /mattermost/webhook/
+MATTERMOST_WEBHOOK_TOKEN = environ.get("MATTERMOST_WEBHOOK_TOKEN")
+# Key signing the WebSocket events forwarded to /mattermost/webhook/ by a relay
+MATTERMOST_WEBHOOK_SECRET = environ.get("MATTERMOST_WEBHOOK_SECRET")
+# Mattermost user id of the bot, the relayed posts not mentioning it are skipped
+MATTERMOST_BOT_USER_ID = environ.get("MATTERMOST_BOT_USER_ID")
+# Maximum age in seconds of a signed request
+MATTERMOST_WEBHOOK_TOLERANCE = 300
+# Priority classes of the incoming events, highest priority first
+MATTERMOST_PRIORITIES = {
+    name: priority
+    for priority, name in enumerate(
+        environ.get("MATTERMOST_PRIORITIES", "command,direct,mention,event").split(",")
+    )
+}
+
+# HTTP clients of the model providers, shared by all the users
+MODEL_CLIENT_MAX_CONNECTIONS = int(environ.get("MODEL_CLIENT_MAX_CONNECTIONS", "100"))
+# Seconds an idle connection to a model provider is kept open
+MODEL_CLIENT_KEEPALIVE_EXPIRY = float(
+    environ.get("MODEL_CLIENT_KEEPALIVE_EXPIRY", "60")
+)
+
+# Bedrock providers kept by API key and region
+BEDROCK_PROVIDER_CACHE_SIZE = 64
+# Rendered instructions fragments kept, each user has a few
+INSTRUCTIONS_CACHE_SIZE = 2048
+# Models kept ready to use, by user and model string
+MODEL_CACHE_SIZE = int(environ.get("MODEL_CACHE_SIZE", "256"))
+MODEL_CACHE_TTL = int(environ.get("MODEL_CACHE_TTL", "300"))
+
+# Circuit breakers of the models, shared by all the users. A breaker opens when
+# the calls failed or slower than MODEL_BREAKER_SLOW_CALL seconds reach the
+# error rate over the window, then lets a trial call through after the cool down
+MODEL_BREAKER_WINDOW = int(environ.get("MODEL_BREAKER_WINDOW", "300"))
+MODEL_BREAKER_MIN_CALLS = int(environ.get("MODEL_BREAKER_MIN_CALLS", "5"))
+MODEL_BREAKER_ERROR_RATE = float(environ.get("MODEL_BREAKER_ERROR_RATE", "0.5"))
+MODEL_BREAKER_SLOW_CALL = float(environ.get("MODEL_BREAKER_SLOW_CALL", "60"))
+MODEL_BREAKER_COOL_DOWN = float(environ.get("MODEL_BREAKER_COOL_DOWN", "60"))
+
+# Hedged requests are duplicated when slower than this percentile of the recent
+# requests to the model, or than the default delay until enough samples
+MODEL_HEDGE_PERCENTILE = int(environ.get("MODEL_HEDGE_PERCENTILE", "95"))
+MODEL_HEDGE_DEFAULT_DELAY = float(environ.get("MODEL_HEDGE_DEFAULT_DELAY", "10"))
+MODEL_HEDGE_MIN_SAMPLES = 20
+MODEL_HEDGE_SAMPLES = 200
+# Maximum number of duplicated requests per user and per hour
+MODEL_HEDGE_BUDGET = int(environ.get("MODEL_HEDGE_BUDGET", "20"))
+
+# Cache breakpoints after the tool definitions and the static instructions, for
+# the providers needing explicit ones (Anthropic, Bedrock). TTL is 5m or 1h
+MODEL_PROMPT_CACHING = environ.get("MODEL_PROMPT_CACHING", "true").lower() in [
+    "true",
+    "1",
+    "on",
+]
+MODEL_PROMPT_CACHE_TTL = environ.get("MODEL_PROMPT_CACHE_TTL", "5m")
+
+# Messages routed to the light model of the users having one are at most this
+# long, without files, links or code
+MODEL_ROUTER_LIGHT_MAX_CHARS = int(environ.get("MODEL_ROUTER_LIGHT_MAX_CHARS", "200"))
+
+# Bounds of an answer, for the users not setting theirs
+AGENT_MAX_TOOL_CALLS = int(environ.get("AGENT_MAX_TOOL_CALLS", "25"))
+AGENT_MAX_INPUT_TOKENS = int(environ.get("AGENT_MAX_INPUT_TOKENS", "1000000"))
+AGENT_MAX_OUTPUT_TOKENS = int(environ.get("AGENT_MAX_OUTPUT_TOKENS", "32000"))
+AGENT_DEADLINE = int(environ.get("AGENT_DEADLINE", "300"))  # Seconds
+
+# Rolling budgets over the window, 0 for no limit
+QUOTA_WINDOW = int(environ.get("QUOTA_WINDOW", "3600"))  # Seconds
+QUOTA_USER_TOKENS = int(environ.get("QUOTA_USER_TOKENS", "2000000"))
+QUOTA_USER_REQUESTS = int(environ.get("QUOTA_USER_REQUESTS", "200"))
+QUOTA_CHANNEL_TOKENS = int(environ.get("QUOTA_CHANNEL_TOKENS", "0"))
+QUOTA_CHANNEL_REQUESTS = int(environ.get("QUOTA_CHANNEL_REQUESTS", "0"))
+# Concurrent answers of a user, the next ones wait for a slot
+QUOTA_USER_CONCURRENCY = int(environ.get("QUOTA_USER_CONCURRENCY", "2"))
+QUOTA_FLUSH_INTERVAL = 10  # Seconds
+
+# Memories of a user put in the instructions, the most relevant to the
+# conversation first
+MEMORY_TOKEN_BUDGET = int(environ.get("MEMORY_TOKEN_BUDGET", "2000"))
+MEMORY_TOP_K = int(environ.get("MEMORY_TOP_K", "50"))
+MEMORY_QUERY_MESSAGES = 6  # Last messages matched against the memories
+MEMORY_SEARCH_PAGE_SIZE = 10
 
 # Camille settings
 DEFAULT_PROMPT_TEMPLATE = """\
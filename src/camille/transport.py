@@ -0,0 +1,176 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import re
+from asyncio import sleep
+from time import monotonic
+from typing import Optional
+
+import logfire
+from django.conf import settings
+from httpx import (
+    AsyncBaseTransport,
+    AsyncHTTPTransport,
+    ConnectError,
+    HTTPStatusError,
+    Limits,
+    Request,
+    Response,
+)
+from pydantic_ai.retries import AsyncTenacityTransport, RetryConfig, wait_retry_after
+from tenacity import retry_if_exception_type, stop_after_attempt, wait_exponential
+
+latency_histogram = logfire.metric_histogram(
+    "camille.mattermost.http.latency",
+    unit="s",
+    description="Latency of the Mattermost REST API calls",
+)
+throttled_counter = logfire.metric_counter(
+    "camille.mattermost.http.throttled",
+    description="Number of Mattermost REST API calls delayed by rate limiting",
+)
+
+# Mattermost ids are 26 lowercase alphanumeric characters
+ID_RE = re.compile(r"/[a-z0-9]{26}(?=/|$)")
+
+
+def endpoint(request: Request) -> str:
+    return f"{request.method} {ID_RE.sub('/{id}', request.url.path)}"
+
+
+class TokenBucket:
+    """Token bucket driven by the X-RateLimit-* headers of the server.
+
+    Unlimited until the server tells us its limits.
+    """
+
+    def __init__(self):
+        self.rate: Optional[float] = None  # Tokens per second
+        self.capacity = 0.0
+        self.tokens = 0.0
+        self.updated_at = monotonic()
+
+    def refill(self):
+        now = monotonic()
+        if self.rate is not None:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+        self.updated_at = now
+
+    async def acquire(self, endpoint: str):
+        while True:
+            self.refill()
+            if self.rate is None:
+                return
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            throttled_counter.add(1, {"endpoint": endpoint, "source": "client"})
+            await sleep((1 - self.tokens) / self.rate)
+
+    def update(self, response: Response):
+        try:
+            limit = float(response.headers["X-RateLimit-Limit"])
+            remaining = float(response.headers["X-RateLimit-Remaining"])
+        except (KeyError, ValueError):
+            return
+
+        self.refill()
+        # Mattermost limits are expressed in requests per second
+        self.rate = self.capacity = max(limit, 1.0)
+        self.tokens = min(self.tokens, remaining)
+        if response.status_code == 429:
+            # Empty the bucket until the server resets it
+            try:
+                reset = float(response.headers["X-RateLimit-Reset"])
+            except (KeyError, ValueError):
+                reset = 1.0
+            self.tokens = -reset * self.rate
+
+
+class RateLimitedTransport(AsyncBaseTransport):
+    """Transport throttling the requests to the rate limits of the server."""
+
+    def __init__(self, wrapped: AsyncBaseTransport):
+        self.wrapped = wrapped
+        self.bucket = TokenBucket()
+
+    async def handle_async_request(self, request: Request) -> Response:
+        name = endpoint(request)
+        await self.bucket.acquire(name)
+
+        started_at = monotonic()
+        response = await self.wrapped.handle_async_request(request)
+        latency_histogram.record(
+            monotonic() - started_at,
+            {"endpoint": name, "status": response.status_code},
+        )
+
+        self.bucket.update(response)
+        if response.status_code == 429:
+            throttled_counter.add(1, {"endpoint": name, "source": "server"})
+
+        return response
+
+    async def __aenter__(self):
+        await self.wrapped.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type=None, exc_value=None, traceback=None):
+        await self.wrapped.__aexit__(exc_type, exc_value, traceback)
+
+    async def aclose(self):
+        await self.wrapped.aclose()
+
+
+def should_retry_status(response: Response):
+    """Raise for the responses worth retrying.
+
+    Server errors are only retried for idempotent methods, we don't want to
+    post the same message twice.
+    """
+    if response.status_code == 429 or (
+        response.status_code in (502, 503, 504)
+        and response.request.method in ("GET", "HEAD", "PUT", "DELETE")
+    ):
+        response.raise_for_status()
+
+
+def create_mattermost_transport() -> AsyncBaseTransport:
+    return AsyncTenacityTransport(
+        config=RetryConfig(
+            retry=retry_if_exception_type((HTTPStatusError, ConnectError)),
+            wait=wait_retry_after(
+                fallback_strategy=wait_exponential(multiplier=0.5, max=10),
+                max_wait=60,
+            ),
+            stop=stop_after_attempt(settings.MATTERMOST_HTTP_RETRIES),
+            reraise=True,
+        ),
+        wrapped=RateLimitedTransport(
+            AsyncHTTPTransport(
+                http2=settings.MATTERMOST_HTTP2,
+                limits=Limits(
+                    max_connections=settings.MATTERMOST_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.MATTERMOST_HTTP_MAX_KEEPALIVE,
+                ),
+            )
+        ),
+        validate_response=should_retry_status,
+    )
@@ -38,6 +38,11 @@ from camille import views
 
 urlpatterns = [
     path("", views.HomeView.as_view(), name="home"),
+    path(
+        "mattermost/webhook/",
+        views.MattermostWebhookView.as_view(),
+        name="mattermost_webhook",
+    ),
     # Agent management
     path(
         "agent/config/edit/",
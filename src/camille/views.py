@@ -14,15 +14,29 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import hmac
+from hashlib import sha256
+from json import JSONDecodeError, loads
+from time import time
+
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
-from django.http import HttpResponseRedirect
+from django.http import (
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    JsonResponse,
+)
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import CreateView, DeleteView, TemplateView, UpdateView, View
 
+from camille.events import new_event, post_priority
 from camille.models import (
     AgentConfig,
     AgentMemory,
@@ -31,6 +45,7 @@ from camille.models import (
     AWSBedrockCredentials,
     GoogleGLACredentials,
     MattermostBinding,
+    MattermostEvent,
     MistralCredentials,
     OpenRouterCredentials,
 )
@@ -42,7 +57,18 @@ class HomeView(LoginRequiredMixin, TemplateView):
 
 class AgentConfigEditView(LoginRequiredMixin, UpdateView):
     model = AgentConfig
-    fields = ["model", "personality", "instructions"]
+    fields = [
+        "model",
+        "fallback_models",
+        "light_model",
+        "hedge_requests",
+        "personality",
+        "instructions",
+        "max_tool_calls",
+        "max_input_tokens",
+        "max_output_tokens",
+        "deadline",
+    ]
     success_url = reverse_lazy("home")
 
     def get_object(self, queryset=None):
@@ -345,3 +371,93 @@ class PasswordlessLoginView(View):
         # Login user
         login(request, user, backend="django.contrib.auth.backends.ModelBackend")
         return HttpResponseRedirect(reverse_lazy("home"))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class MattermostWebhookView(View):
+    """Queue the posts pushed over HTTP for the Mattermost workers.
+
+    Accepts the Mattermost outgoing webhooks, authenticated by their token, and
+    the WebSocket events forwarded by a relay, signed with HMAC-SHA256.
+    """
+
+    def post(self, request):
+        if "X-Camille-Signature" in request.headers:
+            if not self.verify_signature(request):
+                return HttpResponseForbidden()
+
+            try:
+                event = loads(request.body)
+            except JSONDecodeError:
+                return HttpResponseBadRequest()
+
+            if not isinstance(event, dict):
+                return HttpResponseBadRequest()
+
+            # Anything else is handled by the WebSocket listener
+            if event.get("event") != "posted":
+                return JsonResponse({})
+
+            kind = "posted"
+            try:
+                data = event["data"]
+                priority = post_priority(data)
+            except (AttributeError, KeyError, TypeError, JSONDecodeError):
+                return HttpResponseBadRequest()
+
+            if not isinstance(mentions := data.get("mentions", ""), str):
+                return HttpResponseBadRequest()
+
+            # Channel chatter, a worker would only drop it
+            bot_id = settings.MATTERMOST_BOT_USER_ID
+            if bot_id and bot_id not in mentions:
+                return JsonResponse({})
+        else:
+            if request.content_type == "application/json":
+                try:
+                    data = loads(request.body)
+                except JSONDecodeError:
+                    return HttpResponseBadRequest()
+            else:
+                data = request.POST.dict()
+
+            if not isinstance(data, dict) or not isinstance(
+                received_token := data.pop("token", ""), str
+            ):
+                return HttpResponseBadRequest()
+
+            token = settings.MATTERMOST_WEBHOOK_TOKEN
+            if not token or not hmac.compare_digest(received_token, token):
+                return HttpResponseForbidden()
+
+            kind = "webhook"
+            priority = settings.MATTERMOST_PRIORITIES.get("mention", 0)
+
+        try:
+            event = new_event(kind, data, priority)
+        except (KeyError, TypeError, JSONDecodeError):
+            return HttpResponseBadRequest()
+
+        # Redeliveries and posts also queued by the listener are skipped
+        MattermostEvent.objects.bulk_create([event], ignore_conflicts=True)
+
+        # An empty answer, Mattermost would post any text
+        return JsonResponse({})
+
+    def verify_signature(self, request) -> bool:
+        if not (secret := settings.MATTERMOST_WEBHOOK_SECRET):
+            return False
+
+        try:
+            timestamp = int(request.headers["X-Camille-Timestamp"])
+        except (KeyError, ValueError):
+            return False
+
+        # Reject replayed requests
+        if abs(time() - timestamp) > settings.MATTERMOST_WEBHOOK_TOLERANCE:
+            return False
+
+        expected = hmac.new(
+            secret.encode(), f"{timestamp}.".encode() + request.body, sha256
+        ).hexdigest()
+        return hmac.compare_digest(expected, request.headers["X-Camille-Signature"])
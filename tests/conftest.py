@@ -17,6 +17,9 @@
 import pytest
 from django.contrib.auth.models import User
 
+from camille.ai.capabilities.rendering import fragments
+from camille.ai.models import model_cache
+from camille.ai.ranking import memory_index
 from camille.models import (
     AgentConfig,
     AgentPersonality,
@@ -29,6 +32,14 @@ from camille.models import (
 )
 
 
+@pytest.fixture(autouse=True)
+def clear_model_cache():
+    """Database ids are reused between tests, don't leak cached models."""
+    model_cache.clear()
+    fragments.fragments.clear()
+    memory_index.users.clear()
+
+
 @pytest.fixture
 def user(db):
     """Create a test user. The post_save signal auto-creates AgentConfig + default personality."""
@@ -0,0 +1,207 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import CancelledError, create_task, sleep
+from unittest.mock import patch
+
+import pytest
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart
+from pydantic_ai.models import ModelRequestParameters
+from pydantic_ai.models.fallback import FallbackModel
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from camille.ai.breakers import (
+    BreakerState,
+    CircuitBreaker,
+    CircuitBreakerModel,
+    CircuitOpenError,
+)
+
+
+@pytest.fixture(autouse=True)
+def breaker_settings(settings):
+    settings.MODEL_BREAKER_WINDOW = 60
+    settings.MODEL_BREAKER_MIN_CALLS = 2
+    settings.MODEL_BREAKER_ERROR_RATE = 0.5
+    settings.MODEL_BREAKER_SLOW_CALL = 10
+    settings.MODEL_BREAKER_COOL_DOWN = 30
+
+
+def answer(text):
+    def function(messages, info: AgentInfo):
+        return ModelResponse(parts=[TextPart(text)])
+
+    return FunctionModel(function, model_name=text)
+
+
+def failing(messages, info: AgentInfo):
+    raise ModelHTTPError(503, "failing")
+
+
+async def request(model):
+    return await model.request(
+        [ModelRequest.user_text_prompt("hi")], None, ModelRequestParameters()
+    )
+
+
+class TestCircuitBreaker:
+    def test_opens_on_error_rate(self):
+        breaker = CircuitBreaker("model")
+        breaker.record(1, failed=False)
+        assert breaker.state == BreakerState.CLOSED
+        breaker.record(1, failed=True)
+        assert breaker.state == BreakerState.OPEN
+        assert not breaker.allow()
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = CircuitBreaker("model")
+        breaker.record(11, failed=False)
+        breaker.record(11, failed=False)
+        assert breaker.state == BreakerState.OPEN
+
+    def test_half_opens_after_cool_down(self):
+        breaker = CircuitBreaker("model")
+        breaker.record(1, failed=True)
+        breaker.record(1, failed=True)
+
+        with patch(
+            "camille.ai.breakers.monotonic", return_value=breaker.opened_at + 31
+        ):
+            assert breaker.allow()
+            assert breaker.state == BreakerState.HALF_OPEN
+            # A single trial call at a time
+            assert not breaker.allow()
+
+            breaker.record(1, failed=False)
+
+        assert breaker.state == BreakerState.CLOSED
+        assert breaker.allow()
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker("model")
+        breaker.record(1, failed=True)
+        breaker.record(1, failed=True)
+
+        with patch(
+            "camille.ai.breakers.monotonic", return_value=breaker.opened_at + 31
+        ):
+            assert breaker.allow()
+            breaker.record(1, failed=True)
+
+        assert breaker.state == BreakerState.OPEN
+
+
+class TestCircuitBreakerModel:
+    async def test_fails_fast_when_open(self):
+        breaker = CircuitBreaker("model")
+        breaker.record(1, failed=True)
+        breaker.record(1, failed=True)
+
+        with pytest.raises(CircuitOpenError):
+            await request(CircuitBreakerModel(answer("primary"), breaker))
+
+    async def test_records_failures(self):
+        breaker = CircuitBreaker("model")
+        model = CircuitBreakerModel(FunctionModel(failing), breaker)
+
+        for _ in range(2):
+            with pytest.raises(ModelHTTPError):
+                await request(model)
+
+        assert breaker.state == BreakerState.OPEN
+
+    async def test_client_errors_are_not_recorded(self):
+        def unauthorized(messages, info: AgentInfo):
+            raise ModelHTTPError(401, "model")
+
+        breaker = CircuitBreaker("model")
+        model = CircuitBreakerModel(FunctionModel(unauthorized), breaker)
+
+        for _ in range(5):
+            with pytest.raises(ModelHTTPError):
+                await request(model)
+
+        assert breaker.state == BreakerState.CLOSED
+        assert not breaker.calls
+
+    async def test_rate_limits_are_recorded(self):
+        def rate_limited(messages, info: AgentInfo):
+            raise ModelHTTPError(429, "model")
+
+        breaker = CircuitBreaker("model")
+        model = CircuitBreakerModel(FunctionModel(rate_limited), breaker)
+
+        for _ in range(2):
+            with pytest.raises(ModelHTTPError):
+                await request(model)
+
+        assert breaker.state == BreakerState.OPEN
+
+    async def test_cancellations_are_not_recorded(self):
+        async def slow(messages, info: AgentInfo):
+            await sleep(10)
+
+        breaker = CircuitBreaker("model")
+        model = CircuitBreakerModel(FunctionModel(slow), breaker)
+
+        for _ in range(3):
+            task = create_task(request(model))
+            await sleep(0.01)
+            task.cancel()
+            with pytest.raises(CancelledError):
+                await task
+
+        assert breaker.state == BreakerState.CLOSED
+        assert not breaker.calls
+
+    async def test_cancelled_trial_is_released(self):
+        async def slow(messages, info: AgentInfo):
+            await sleep(10)
+
+        breaker = CircuitBreaker("model")
+        breaker.record(1, failed=True)
+        breaker.record(1, failed=True)
+        model = CircuitBreakerModel(FunctionModel(slow), breaker)
+
+        with patch(
+            "camille.ai.breakers.monotonic", return_value=breaker.opened_at + 31
+        ):
+            task = create_task(request(model))
+            await sleep(0.01)
+            task.cancel()
+            with pytest.raises(CancelledError):
+                await task
+
+            assert breaker.state == BreakerState.HALF_OPEN
+            assert breaker.allow()
+
+    async def test_fallback_skips_open_breaker(self):
+        primary = CircuitBreaker("primary")
+        primary.record(1, failed=True)
+        primary.record(1, failed=True)
+        fallback = CircuitBreaker("fallback")
+        model = FallbackModel(
+            CircuitBreakerModel(answer("primary"), primary),
+            CircuitBreakerModel(answer("fallback"), fallback),
+        )
+
+        response = await request(model)
+
+        assert response.parts[0].content == "fallback"
+        assert len(fallback.calls) == 1
+        assert model.models[0].answered_at is None
+        assert model.models[1].answered_at is not None
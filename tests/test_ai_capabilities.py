@@ -0,0 +1,269 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import User
+from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from camille.ai.capabilities.rendering import (
+    FragmentCache,
+    fragments,
+    render_histogram,
+    render_instructions,
+)
+from camille.ai.deps import MattermostDeps, with_prompt_context
+from camille.mattermost import Mattermost
+from camille.models import AgentMemory
+
+pytestmark = [pytest.mark.django_db(transaction=True)]
+
+
+@pytest.fixture
+def deps(user):
+    user = with_prompt_context(User.objects.filter(pk=user.pk)).get()
+    return MattermostDeps(
+        agent_name="Camille",
+        current_user=user,
+        all_users=[user],
+        channel_id="chan",
+        channel_name="General",
+        mattermost_client=None,
+    )
+
+
+@pytest.fixture
+def agent(settings):
+    settings.MATTERMOST_BASE_URL = "http://mattermost"
+    return Mattermost().agent
+
+
+async def run(agent, deps, prompt="Hello") -> AgentInfo:
+    infos = []
+
+    def function(messages, info: AgentInfo):
+        infos.append(info)
+        return ModelResponse(parts=[TextPart("Hi")])
+
+    await agent.run(prompt, deps=deps, model=FunctionModel(function))
+    return infos[0]
+
+
+class TestPromptLayout:
+    async def test_stable_instructions_first(self, agent, deps):
+        info = await run(agent, deps)
+
+        parts = info.model_request_parameters.instruction_parts
+        assert [part.dynamic for part in parts] == [False] * 4 + [True] * 2
+        assert parts[0].content.startswith("# System prompt")
+        assert parts[-1].content.startswith("## Current time")
+
+    async def test_cache_breakpoints(self, agent, deps, settings):
+        settings.MODEL_PROMPT_CACHE_TTL = "1h"
+
+        info = await run(agent, deps)
+
+        assert info.model_settings["anthropic_cache_instructions"] == "1h"
+        assert info.model_settings["bedrock_cache_tool_definitions"] == "1h"
+
+    async def test_caching_disabled(self, agent, deps, settings):
+        settings.MODEL_PROMPT_CACHING = False
+
+        info = await run(agent, deps)
+
+        assert "anthropic_cache_instructions" not in (info.model_settings or {})
+
+
+class TestPromptContext:
+    def test_no_queries_while_rendering(self, user, django_assert_num_queries):
+        for i in range(3):
+            User.objects.create_user(username=f"member{i}")
+
+        with django_assert_num_queries(1):
+            users = list(with_prompt_context(User.objects.order_by("id")))
+
+        with django_assert_num_queries(0):
+            personality = users[0].agent_config.personality.prompt_template
+            instructions = "".join(
+                render_instructions("user_instructions", {"user": user})
+                for user in users
+            )
+
+        assert "{agent_name}" in personality
+        assert "member2 (id=" in instructions
+
+    async def test_renders_in_the_event_loop(self, agent, deps):
+        with patch.object(render_histogram, "record") as record:
+            await run(agent, deps)
+
+        assert {call.args[1]["fragment"] for call in record.call_args_list} == {
+            "personality",
+            "instructions",
+            "user_instructions",
+            "conversation",
+            "mattermost",
+            "memory",
+            "user_memories",
+            "current_time",
+        }
+
+    async def test_memories_are_fresh_at_each_step(self, agent, deps):
+        await AgentMemory.objects.acreate(user=deps.current_user, content="Likes tea")
+        instructions = []
+
+        def function(messages, info: AgentInfo):
+            instructions.append(
+                "\n".join(
+                    part.content
+                    for part in info.model_request_parameters.instruction_parts
+                )
+            )
+            if len(instructions) == 1:
+                return ModelResponse(
+                    parts=[ToolCallPart("create_memory", {"content": "Hates coffee"})]
+                )
+            return ModelResponse(parts=[TextPart("Noted")])
+
+        await agent.run("Hello", deps=deps, model=FunctionModel(function))
+
+        assert "Likes tea" in instructions[0]
+        assert "Hates coffee" not in instructions[0]
+        assert instructions[1].index("Likes tea") < instructions[1].index(
+            "Hates coffee"
+        )
+
+    async def test_relevant_memories_within_budget(self, agent, deps, settings):
+        settings.MEMORY_TOP_K = 1
+        await AgentMemory.objects.acreate(user=deps.current_user, content="Likes tea")
+        await AgentMemory.objects.acreate(user=deps.current_user, content="Has a cat")
+
+        info = await run(agent, deps, "Which tea should I buy?")
+
+        instructions = "\n".join(
+            part.content for part in info.model_request_parameters.instruction_parts
+        )
+        assert "Likes tea" in instructions
+        assert "Has a cat" not in instructions
+        assert "1 other memories, less relevant" in instructions
+
+    async def test_search_memory(self, agent, deps, other_user):
+        await AgentMemory.objects.acreate(user=deps.current_user, content="Likes tea")
+        await AgentMemory.objects.acreate(user=other_user, content="Likes tea too")
+        returns = []
+
+        def function(messages, info: AgentInfo):
+            if len(messages) == 1:
+                return ModelResponse(
+                    parts=[
+                        ToolCallPart("search_memory", {"query": "tea"}),
+                        ToolCallPart(
+                            "search_memory", {"query": "tea", "user_id": other_user.id}
+                        ),
+                    ]
+                )
+            returns.extend(part.content for part in messages[-1].parts)
+            return ModelResponse(parts=[TextPart("Found")])
+
+        await agent.run("Hello", deps=deps, model=FunctionModel(function))
+
+        assert [result["snippet"] for result in returns[0]["results"]] == [
+            "Likes **tea**"
+        ]
+        assert "not in the conversation" in returns[1]
+
+
+def rendered(record) -> list[str]:
+    return [call.args[1]["fragment"] for call in record.call_args_list]
+
+
+class TestFragmentCache:
+    async def test_reused_across_runs(self, agent, deps):
+        await AgentMemory.objects.acreate(user=deps.current_user, content="Likes tea")
+        first = await run(agent, deps)
+
+        with patch.object(render_histogram, "record") as record:
+            second = await run(agent, deps)
+
+        assert sorted(rendered(record)) == [
+            "conversation",
+            "current_time",
+            "instructions",
+            "mattermost",
+            "memory",
+        ]
+        parts = second.model_request_parameters.instruction_parts
+        assert [part.content for part in parts][:-1] == [
+            part.content for part in first.model_request_parameters.instruction_parts
+        ][:-1]
+
+    async def test_edits_are_rendered(self, agent, deps):
+        await run(agent, deps)
+
+        agent_config = deps.current_user.agent_config
+        agent_config.instructions = "Answer in Occitan"
+        await agent_config.asave()
+        personality = agent_config.personality
+        personality.prompt_template = "You are {agent_name}, a cat."
+        await personality.asave()
+        memory = await AgentMemory.objects.acreate(
+            user=deps.current_user, content="Likes tea"
+        )
+
+        instructions = "\n".join(
+            part.content
+            for part in (
+                await run(agent, deps)
+            ).model_request_parameters.instruction_parts
+        )
+        assert "You are Camille, a cat." in instructions
+        assert "Answer in Occitan" in instructions
+        assert "Likes tea" in instructions
+
+        await memory.adelete()
+        instructions = "\n".join(
+            part.content
+            for part in (
+                await run(agent, deps)
+            ).model_request_parameters.instruction_parts
+        )
+        assert "Likes tea" not in instructions
+
+    async def test_only_outdated_memories_are_rendered(self, agent, deps, other_user):
+        other_user = await with_prompt_context(
+            User.objects.filter(pk=other_user.pk)
+        ).aget()
+        deps.all_users.append(other_user)
+        await run(agent, deps)
+
+        await AgentMemory.objects.acreate(user=other_user, content="Likes tea")
+        with patch.object(render_histogram, "record") as record:
+            await run(agent, deps)
+
+        assert rendered(record).count("user_memories") == 1
+
+    def test_evicts_least_recently_used(self, settings):
+        settings.INSTRUCTIONS_CACHE_SIZE = 2
+        cache = FragmentCache()
+        cache.render("current_time", (1,), {"current_time": None})
+        cache.render("current_time", (2,), {"current_time": None})
+        cache.lookup("current_time", (1,))
+        cache.render("current_time", (3,), {"current_time": None})
+
+        assert cache.lookup("current_time", (1,)) is not None
+        assert cache.lookup("current_time", (2,)) is None
+        assert fragments is not cache
@@ -0,0 +1,83 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from camille.ai.clients import BedrockProviderCache, ClientPool
+
+
+class TestClientPool:
+    async def test_shares_clients_by_provider(self):
+        pool = ClientPool()
+
+        client = pool.get("anthropic")
+
+        assert pool.get("anthropic") is client
+        assert pool.get("mistral") is not client
+        assert pool.get("anthropic", "https://proxy") is not client
+        await pool.aclose()
+
+    async def test_aclose(self):
+        pool = ClientPool()
+        client = pool.get("anthropic")
+
+        await pool.aclose()
+
+        assert client.is_closed
+        assert pool.get("anthropic") is not client
+        await pool.aclose()
+
+    async def test_connections(self):
+        pool = ClientPool()
+        pool.get("anthropic")
+
+        observations = list(pool.connections(None))
+
+        assert [o.attributes for o in observations] == [{"provider": "anthropic"}]
+        assert observations[0].value == 0
+        await pool.aclose()
+
+
+class TestBedrockProviderCache:
+    async def test_shares_providers_by_key_and_region(self):
+        cache = BedrockProviderCache()
+
+        provider = await cache.aget("key", "eu-west-3")
+
+        assert await cache.aget("key", "eu-west-3") is provider
+        assert await cache.aget("key", "us-east-1") is not provider
+        assert await cache.aget("other", "eu-west-3") is not provider
+        # The API key isn't kept in clear
+        assert all("key" not in key for key, _ in cache.providers)
+
+    def test_lru_eviction(self, settings):
+        settings.BEDROCK_PROVIDER_CACHE_SIZE = 1
+        cache = BedrockProviderCache()
+
+        cache.get("key", "eu-west-3")
+        cache.get("key", "us-east-1")
+
+        assert [region for _, region in cache.providers] == ["us-east-1"]
+
+    @pytest.mark.django_db(transaction=True)
+    async def test_warm(self, bedrock_credentials):
+        cache = BedrockProviderCache()
+
+        await cache.warm()
+
+        assert [region for _, region in cache.providers] == [
+            bedrock_credentials.region_name
+        ]
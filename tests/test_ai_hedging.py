@@ -0,0 +1,156 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import sleep
+
+import pytest
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart
+from pydantic_ai.models import ModelRequestParameters
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from camille.ai import hedging
+from camille.ai.breakers import CircuitBreaker, CircuitBreakerModel
+from camille.ai.hedging import HedgeBudget, HedgedModel, LatencyTracker
+
+
+@pytest.fixture(autouse=True)
+def hedge_settings(settings):
+    settings.MODEL_HEDGE_DEFAULT_DELAY = 0.05
+    settings.MODEL_HEDGE_MIN_SAMPLES = 5
+    settings.MODEL_HEDGE_SAMPLES = 100
+    settings.MODEL_HEDGE_PERCENTILE = 90
+    settings.MODEL_HEDGE_BUDGET = 1
+    hedging.latencies.clear()
+    hedging.budget = HedgeBudget()
+
+
+def answer(text, delay, calls):
+    async def function(messages, info: AgentInfo):
+        calls.append(text)
+        await sleep(delay)
+        return ModelResponse(parts=[TextPart(text)])
+
+    async def stream_function(messages, info: AgentInfo):
+        calls.append(text)
+        await sleep(delay)
+        yield text
+
+    return FunctionModel(function, stream_function=stream_function, model_name=text)
+
+
+def hedged(primary, alternate):
+    return HedgedModel(primary, "primary", alternate, "alternate", user_id=1)
+
+
+async def request(model):
+    return await model.request(
+        [ModelRequest.user_text_prompt("hi")], None, ModelRequestParameters()
+    )
+
+
+class TestLatencyTracker:
+    def test_default_delay_until_enough_samples(self):
+        tracker = LatencyTracker()
+        tracker.record(1)
+        assert tracker.delay() == 0.05
+
+    def test_percentile(self):
+        tracker = LatencyTracker()
+        for latency in range(1, 101):
+            tracker.record(latency)
+        assert tracker.delay() == pytest.approx(90, abs=1)
+
+
+class TestHedgeBudget:
+    def test_limits_hedges_per_user(self):
+        budget = HedgeBudget()
+        assert budget.allow(1)
+        assert not budget.allow(1)
+        assert budget.allow(2)
+
+
+class TestHedgedModel:
+    async def test_fast_primary_is_not_hedged(self):
+        calls = []
+        model = hedged(answer("primary", 0, calls), answer("alternate", 0, calls))
+
+        response = await request(model)
+
+        assert response.parts[0].content == "primary"
+        assert calls == ["primary"]
+        assert model.answered_by == "primary"
+
+    async def test_hedge_wins(self):
+        calls = []
+        model = hedged(answer("primary", 1, calls), answer("alternate", 0, calls))
+
+        response = await request(model)
+
+        assert response.parts[0].content == "alternate"
+        assert calls == ["primary", "alternate"]
+        assert model.answered_by == "alternate"
+
+    async def test_over_budget(self):
+        calls = []
+        model = hedged(answer("primary", 0.1, calls), answer("alternate", 0, calls))
+
+        await request(model)
+        calls.clear()
+        response = await request(model)
+
+        assert response.parts[0].content == "primary"
+        assert calls == ["primary"]
+
+    async def test_open_alternate_is_not_hedged(self, settings):
+        settings.MODEL_BREAKER_MIN_CALLS = 1
+        calls = []
+        breaker = CircuitBreaker("alternate")
+        breaker.record(1, failed=True)
+        model = hedged(
+            answer("primary", 0.1, calls),
+            CircuitBreakerModel(answer("alternate", 0, calls), breaker),
+        )
+
+        response = await request(model)
+
+        assert response.parts[0].content == "primary"
+        assert calls == ["primary"]
+
+    async def test_latencies_by_mode(self):
+        calls = []
+        model = hedged(answer("primary", 0, calls), answer("alternate", 0, calls))
+
+        await request(model)
+        async with model.request_stream(
+            [ModelRequest.user_text_prompt("hi")], None, ModelRequestParameters()
+        ) as stream:
+            async for _ in stream:
+                pass
+
+        assert set(hedging.latencies) == {("primary", "request"), ("primary", "stream")}
+
+    async def test_stream_hedge_wins(self):
+        calls = []
+        model = hedged(answer("primary", 1, calls), answer("alternate", 0, calls))
+
+        async with model.request_stream(
+            [ModelRequest.user_text_prompt("hi")], None, ModelRequestParameters()
+        ) as stream:
+            async for _ in stream:
+                pass
+
+        assert stream.get().parts[0].content == "alternate"
+        assert calls == ["primary", "alternate"]
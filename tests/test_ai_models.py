@@ -19,15 +19,22 @@ from unittest.mock import patch, AsyncMock
 
 pytestmark = [pytest.mark.django_db(transaction=True)]
 
+from pydantic_ai.models.fallback import FallbackModel
+
 from camille.ai.models import (
+    create_model_chain_for_user,
     create_model_for_user,
     create_anthropic_model_for_user,
     create_bedrock_model_for_user,
     create_google_model_for_user,
     create_mistral_model_for_user,
     create_openrouter_model_for_user,
+    ModelCache,
     NoCredentialsError,
 )
+from camille.ai.hedging import HedgedModel
+from camille.ai.router import Tier
+from camille.models import AgentConfig
 
 
 class TestCreateModelForUser:
@@ -87,3 +94,122 @@ class TestModelStringParsing:
     async def test_no_colon_raises(self, user):
         with pytest.raises(ValueError):
             await create_model_for_user(user, "no-colon-here")
+
+
+class TestModelCache:
+    async def test_reuses_model(self, user, anthropic_credentials):
+        model = await create_model_for_user(user, "anthropic:claude-3-opus")
+        assert await create_model_for_user(user, "anthropic:claude-3-opus") is model
+        assert (
+            await create_model_for_user(user, "anthropic:claude-3-haiku") is not model
+        )
+
+    async def test_invalidated_on_credentials_change(self, user, anthropic_credentials):
+        model = await create_model_for_user(user, "anthropic:claude-3-opus")
+        anthropic_credentials.api_key = "new-key"
+        await anthropic_credentials.asave()
+        assert await create_model_for_user(user, "anthropic:claude-3-opus") is not model
+
+    async def test_invalidated_on_credentials_delete(self, user, anthropic_credentials):
+        await create_model_for_user(user, "anthropic:claude-3-opus")
+        await anthropic_credentials.adelete()
+        with pytest.raises(NoCredentialsError):
+            await create_model_for_user(user, "anthropic:claude-3-opus")
+
+    async def test_expires(self, user, anthropic_credentials, settings):
+        settings.MODEL_CACHE_TTL = -1
+        model = await create_model_for_user(user, "anthropic:claude-3-opus")
+        assert await create_model_for_user(user, "anthropic:claude-3-opus") is not model
+
+    def test_lru_eviction(self, settings):
+        settings.MODEL_CACHE_SIZE = 2
+        cache = ModelCache()
+        cache.set((1, "a"), "model a")
+        cache.set((1, "b"), "model b")
+        cache.get((1, "a"))
+        cache.set((1, "c"), "model c")
+        assert cache.get((1, "b")) is None
+        assert cache.get((1, "a")) == "model a"
+
+
+class TestModelChain:
+    async def test_single_model(self, user, anthropic_credentials):
+        config = await AgentConfig.objects.aget(user=user)
+        config.model = "anthropic:claude-3-opus"
+
+        chain = await create_model_chain_for_user(user, config)
+
+        assert not isinstance(chain.model, FallbackModel)
+        assert chain.answered() == (Tier.FULL, "anthropic:claude-3-opus")
+
+    async def test_fallback_models(self, user, anthropic_credentials):
+        config = await AgentConfig.objects.aget(user=user)
+        config.model = "anthropic:claude-3-opus"
+        # Mistral credentials are missing, skipped
+        config.fallback_models = "mistral:mistral-large\n\nanthropic:claude-3-haiku\n"
+
+        chain = await create_model_chain_for_user(user, config)
+
+        assert isinstance(chain.model, FallbackModel)
+        assert [m.breaker.name for m in chain.model.models] == [
+            "anthropic:claude-3-opus",
+            "anthropic:claude-3-haiku",
+        ]
+
+    async def test_hedged_alternate_has_breaker(self, user, anthropic_credentials):
+        config = await AgentConfig.objects.aget(user=user)
+        config.model = "anthropic:claude-3-opus"
+        config.fallback_models = "anthropic:claude-3-haiku"
+        config.hedge_requests = True
+
+        chain = await create_model_chain_for_user(user, config)
+
+        hedged = chain.model.models[0].wrapped
+        assert isinstance(hedged, HedgedModel)
+        assert hedged.alternate.breaker.name == "anthropic:claude-3-haiku"
+
+        # The hedge to the alternate model won
+        chain.model.models[0].answered_at = 1.0
+        hedged.answered_by = "anthropic:claude-3-haiku"
+        assert chain.answered() == (Tier.FULL, "anthropic:claude-3-haiku")
+
+    async def test_light_tier(self, user, anthropic_credentials):
+        config = await AgentConfig.objects.aget(user=user)
+        config.model = "anthropic:claude-3-opus"
+        config.light_model = "anthropic:claude-3-haiku"
+
+        chain = await create_model_chain_for_user(user, config, Tier.LIGHT)
+
+        assert [m.breaker.name for m in chain.model.models] == [
+            "anthropic:claude-3-haiku",
+            "anthropic:claude-3-opus",
+        ]
+        assert chain.answered() == (Tier.LIGHT, "anthropic:claude-3-haiku")
+
+        # The light model failed, the model answered
+        chain.model.models[1].answered_at = 1.0
+        assert chain.answered() == (Tier.FULL, "anthropic:claude-3-opus")
+
+        chain.model.models[0].answered_at = 2.0
+        assert chain.answered() == (Tier.LIGHT, "anthropic:claude-3-haiku")
+
+    async def test_light_tier_without_light_model_credentials(
+        self, user, anthropic_credentials
+    ):
+        config = await AgentConfig.objects.aget(user=user)
+        config.model = "anthropic:claude-3-opus"
+        config.light_model = "mistral:mistral-small"
+
+        chain = await create_model_chain_for_user(user, config, Tier.LIGHT)
+
+        assert chain.tier == Tier.FULL
+        assert chain.answered() == (Tier.FULL, "anthropic:claude-3-opus")
+
+    async def test_full_tier_ignores_light_model(self, user, anthropic_credentials):
+        config = await AgentConfig.objects.aget(user=user)
+        config.model = "anthropic:claude-3-opus"
+        config.light_model = "anthropic:claude-3-haiku"
+
+        chain = await create_model_chain_for_user(user, config, Tier.FULL)
+
+        assert not isinstance(chain.model, FallbackModel)
@@ -0,0 +1,147 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta, timezone
+from json import dumps
+
+import pytest
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart
+
+from camille.ai.ranking import (
+    MemoryIndex,
+    UserMemories,
+    estimate_tokens,
+    recent_text,
+    tokenize,
+)
+from camille.models import AgentMemory
+
+
+@pytest.fixture(autouse=True)
+def ranking_settings(settings):
+    settings.MEMORY_TOKEN_BUDGET = 1000
+    settings.MEMORY_TOP_K = 10
+    settings.MEMORY_QUERY_MESSAGES = 2
+
+
+def memory(id, content, minutes=0):
+    created_at = datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=minutes)
+    return AgentMemory(
+        id=id, user_id=1, content=content, created_at=created_at, updated_at=created_at
+    )
+
+
+@pytest.fixture
+def memories():
+    memories = UserMemories()
+    memories.add(memory(1, "Loves green tea and jasmine tea", 1))
+    memories.add(memory(2, "Works on a Django project named Camille", 2))
+    memories.add(memory(3, "Has a cat named Kropotkin", 3))
+    memories.add(memory(4, "Learns Occitan, prefers French", 4))
+    return memories
+
+
+def test_tokenize():
+    assert tokenize("L'Òc, 2 cats & a Dog!") == ["òc", "cats", "dog"]
+
+
+def test_recent_text():
+    messages = [
+        ModelRequest.user_text_prompt("old"),
+        ModelResponse(parts=[TextPart("answer")]),
+        ModelRequest.user_text_prompt("new"),
+    ]
+    assert recent_text(messages) == "answer\nnew"
+
+
+def test_recent_text_without_prompt_envelope(memories):
+    memories.add(memory(5, "The user id of their other account is 42", 5))
+    prompt = {
+        "user_id": 1,
+        "message": "Any news about Kropotkin?",
+        "datetime": "2026-01-01T00:00:00+00:00",
+        "files": [{"id": "f", "name": "vet.pdf", "size": 1, "mime_type": "a/b"}],
+    }
+    text = recent_text([ModelRequest.user_text_prompt(dumps(prompt))])
+    assert text == "Any news about Kropotkin?\nvet.pdf"
+    assert list(memories.scores(tokenize(text))) == [3]
+
+
+class TestUserMemories:
+    def test_scores(self, memories):
+        scores = memories.scores(tokenize("What tea should I drink?"))
+        assert list(scores) == [1]
+
+        scores = memories.scores(tokenize("My cat, my Django project"))
+        assert set(scores) == {2, 3}
+
+    def test_rare_terms_weigh_more(self, memories):
+        memories.add(memory(5, "Named a plant Camille", 5))
+        scores = memories.scores(tokenize("named Camille"))
+        assert scores[2] > scores[3]
+
+    def test_select_in_chronological_order(self, memories):
+        selected = memories.select(tokenize("cat tea"))
+        assert [memory.id for memory in selected] == [1, 2, 3, 4]
+
+    def test_select_within_budget(self, memories, settings):
+        settings.MEMORY_TOKEN_BUDGET = estimate_tokens(
+            memories.memories[1].content
+        ) + estimate_tokens(memories.memories[3].content)
+        selected = memories.select(tokenize("Which tea for my cat?"))
+        assert [memory.id for memory in selected] == [1, 3]
+
+    def test_select_most_recent_without_match(self, memories, settings):
+        settings.MEMORY_TOP_K = 2
+        selected = memories.select(tokenize("Hello"))
+        assert [memory.id for memory in selected] == [3, 4]
+
+    def test_incremental_updates(self, memories):
+        memories.add(memory(3, "Has a dog named Louise", 3))
+        assert memories.scores(tokenize("cat")) == {}
+        assert set(memories.scores(tokenize("dog"))) == {3}
+
+        memories.remove(3)
+        assert "dog" not in memories.postings
+        assert len(memories) == 3
+        assert memories.total_length == sum(memories.lengths.values())
+
+
+@pytest.mark.django_db(transaction=True)
+class TestMemoryIndex:
+    async def test_refresh(self, user, other_user):
+        index = MemoryIndex()
+        first = await AgentMemory.objects.acreate(user=user, content="Likes tea")
+        await index.refresh([user.id, other_user.id])
+        assert list(index.get(user.id).memories.values()) == [first]
+        assert len(index.get(other_user.id)) == 0
+
+        # Edited elsewhere
+        first.content = "Likes coffee"
+        await first.asave()
+        await index.refresh([user.id])
+        assert set(index.get(user.id).scores(["coffee"])) == {first.id}
+
+        await first.adelete()
+        await index.refresh([user.id])
+        assert len(index.get(user.id)) == 0
+
+    async def test_up_to_date_after_local_changes(self, user):
+        index = MemoryIndex()
+        memories = index.get(user.id)
+        memories.add(await AgentMemory.objects.acreate(user=user, content="Likes tea"))
+        await index.refresh([user.id])
+        assert index.get(user.id) is memories
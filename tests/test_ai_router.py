@@ -0,0 +1,80 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+)
+
+from camille.ai.router import Tier, classify, used_tools
+
+
+def turn(*responses):
+    return [ModelRequest.user_text_prompt("Hello"), *responses]
+
+
+class TestUsedTools:
+    def test_no_history(self):
+        assert not used_tools([])
+
+    def test_last_turn_used_tools(self):
+        history = turn(
+            ModelResponse(parts=[ToolCallPart("web_search", {"query": "q"})]),
+            ModelRequest(parts=[ToolReturnPart("web_search", "results")]),
+            ModelResponse(parts=[TextPart("Found it")]),
+        )
+        assert used_tools(history)
+
+    def test_earlier_turn_used_tools(self):
+        history = turn(
+            ModelResponse(parts=[ToolCallPart("web_search", {"query": "q"})]),
+            ModelRequest(parts=[ToolReturnPart("web_search", "results")]),
+            ModelResponse(parts=[TextPart("Found it")]),
+        ) + turn(ModelResponse(parts=[TextPart("Hi")]))
+        assert not used_tools(history)
+
+
+class TestClassify:
+    @pytest.fixture(autouse=True)
+    def max_chars(self, settings):
+        settings.MODEL_ROUTER_LIGHT_MAX_CHARS = 20
+
+    def test_short_message(self):
+        assert classify("Hello!", False, []) == Tier.LIGHT
+
+    @pytest.mark.parametrize(
+        "message",
+        [
+            "What is the meaning of life?",
+            "Run `ls`",
+            "See https://x.io",
+        ],
+    )
+    def test_full(self, message):
+        assert classify(message, False, []) == Tier.FULL
+
+    def test_files(self):
+        assert classify("Look", True, []) == Tier.FULL
+
+    def test_follow_up_of_tools(self):
+        history = turn(
+            ModelResponse(parts=[ToolCallPart("web_search", {"query": "q"})])
+        )
+        assert classify("And?", False, history) == Tier.FULL
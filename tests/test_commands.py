@@ -0,0 +1,53 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from camille.models import MattermostConversation, MattermostConversationRun
+
+pytestmark = [pytest.mark.django_db]
+
+
+class TestUsageCommand:
+    def test_rollup_by_user_and_model(self, user):
+        conv = MattermostConversation.objects.create(root_id="root", channel_id="chan")
+        MattermostConversationRun.objects.create(
+            conversation=conv,
+            user=user,
+            messages_json=b"[]",
+            model="anthropic:a",
+            input_tokens=1234,
+            duration=2.0,
+            tool_time=0.5,
+        )
+        out = StringIO()
+
+        call_command("usage", "--days", "1", stdout=out)
+
+        header, row = out.getvalue().splitlines()
+        assert header.split()[:3] == ["user", "model", "runs"]
+        assert row.split()[:5] == ["testuser", "anthropic:a", "1", "0", "1234"]
+        assert row.split()[-1] == "25%"
+
+    def test_by_day(self, user):
+        out = StringIO()
+
+        call_command("usage", "--by", "day", stdout=out)
+
+        assert out.getvalue().split()[0] == "day"
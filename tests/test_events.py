@@ -0,0 +1,129 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import timedelta
+from json import dumps, loads
+from unittest.mock import AsyncMock
+
+import pytest
+from asgiref.sync import sync_to_async
+from django.test import override_settings
+from django.utils import timezone
+
+from camille.events import EventWorker, claim, enqueue
+from camille.models import MattermostEvent
+
+pytestmark = [pytest.mark.django_db(transaction=True)]
+
+
+def posted(post_id, root_id=""):
+    return {
+        "mentions": '["bot"]',
+        "post": dumps({"id": post_id, "root_id": root_id, "message": "hi"}),
+    }
+
+
+def loads_post(event):
+    return loads(event.data["post"])
+
+
+class TestClaim:
+    async def test_by_priority(self):
+        await enqueue("posted", posted("post1"), priority=2)
+        await enqueue("posted", posted("post2"), priority=1)
+
+        event = await sync_to_async(claim)()
+
+        assert event.root_id == "post2"
+        assert event.status == MattermostEvent.Status.PROCESSING
+        assert event.attempts == 1
+
+    async def test_duplicate_post_queued_once(self):
+        await enqueue("posted", posted("post"), priority=1)
+        await enqueue("posted", posted("post"), priority=1)
+        await enqueue("webhook", {"post_id": "post", "user_name": "u"}, priority=1)
+
+        assert await MattermostEvent.objects.acount() == 1
+
+    async def test_one_event_per_thread(self):
+        await enqueue("posted", posted("root"), priority=0)
+        await enqueue("posted", posted("reply", root_id="root"), priority=0)
+
+        first = await sync_to_async(claim)()
+        second = await sync_to_async(claim)()
+
+        assert loads_post(first)["id"] == "root"
+        assert second is None
+
+    async def test_skips_backed_off_events(self):
+        await enqueue("posted", posted("post"), priority=0)
+        await MattermostEvent.objects.aupdate(
+            available_at=timezone.now() + timedelta(minutes=1)
+        )
+
+        assert await sync_to_async(claim)() is None
+
+    async def test_reclaims_expired_lease(self):
+        await enqueue("posted", posted("post"), priority=0)
+        await MattermostEvent.objects.aupdate(
+            status=MattermostEvent.Status.PROCESSING,
+            locked_at=timezone.now() - timedelta(hours=1),
+            attempts=1,
+        )
+
+        event = await sync_to_async(claim)()
+
+        assert event is not None
+        assert event.attempts == 2
+
+
+class TestEventWorker:
+    async def test_deletes_processed_events(self):
+        mattermost = AsyncMock()
+        await enqueue("posted", posted("post"), priority=0)
+        event = await sync_to_async(claim)()
+
+        await EventWorker(mattermost, 1).process(event)
+
+        mattermost.handle_event.assert_awaited_once_with("posted", event.data)
+        assert not await MattermostEvent.objects.aexists()
+
+    async def test_retries_with_backoff(self):
+        mattermost = AsyncMock()
+        mattermost.handle_event.side_effect = RuntimeError("boom")
+        await enqueue("posted", posted("post"), priority=0)
+        event = await sync_to_async(claim)()
+
+        await EventWorker(mattermost, 1).process(event)
+
+        event = await MattermostEvent.objects.aget()
+        assert event.status == MattermostEvent.Status.PENDING
+        assert event.available_at > timezone.now()
+        assert "boom" in event.last_error
+
+    @override_settings(MATTERMOST_EVENT_MAX_ATTEMPTS=1)
+    async def test_dead_letters_after_max_attempts(self):
+        mattermost = AsyncMock()
+        mattermost.handle_event.side_effect = RuntimeError("boom")
+        await enqueue("posted", posted("root"), priority=0)
+        await enqueue("posted", posted("reply", root_id="root"), priority=0)
+        event = await sync_to_async(claim)()
+
+        await EventWorker(mattermost, 1).process(event)
+
+        assert (await MattermostEvent.objects.aget(id=event.id)).status == "dead"
+        # A dead event doesn't block its thread
+        assert loads_post(await sync_to_async(claim)())["id"] == "reply"
@@ -14,12 +14,47 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-import pytest
+from asyncio import Event, create_task, sleep
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from json import dumps, loads
+from time import time
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import pytest
+from asgiref.sync import sync_to_async
+from django.test import override_settings
+from django.utils import timezone
+
 pytestmark = [pytest.mark.django_db(transaction=True)]
 
-from camille.mattermost import Mattermost
+from pydantic_ai import (
+    Agent,
+    ModelResponse,
+    PartDeltaEvent,
+    PartStartEvent,
+    TextPart,
+    TextPartDelta,
+    ToolCallPart,
+)
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from pydantic_ai.usage import UsageLimits
+
+from camille.ai.deps import MattermostDeps
+from camille.ai.models import ModelChain
+from camille.events import EventWorker, claim, enqueue
+from camille.mattermost import (
+    Mattermost,
+    PostWriter,
+    RunStats,
+    ThreadPost,
+    coalesce,
+)
+from camille.members import ChannelMembersCache
+from camille.models import MattermostChannelCursor, MattermostEvent
+from camille.quotas import Quotas
+from camille.scheduler import Scheduler
 
 
 @pytest.fixture
@@ -27,10 +62,24 @@ def mattermost():
     """Create a Mattermost instance with mocked HTTP client."""
     mm = Mattermost.__new__(Mattermost)
     mm.client_http = AsyncMock()
+    mm.client_upgrade = AsyncMock()
     mm.client_ws = AsyncMock()
     mm.me_mm_id = "bot_mm_id"
     mm.me_name = "Camille"
+    mm.me_username = "camille"
     mm.current_seq = 0
+    mm.connection_id = None
+    mm.server_seq = 0
+    mm.seen_posts = OrderedDict()
+    mm.cursors = {}
+    mm.dirty_cursors = set()
+    mm.held_posts = {}
+    mm.members = ChannelMembersCache(mm.client_http)
+    mm.scheduler = Scheduler(workers=1, maxsize=1)
+    mm.background_tasks = set()
+    mm.threads = {}
+    mm.quotas = Quotas()
+    mm.retry_unanswered = False
     mm.agent = MagicMock()
     return mm
 
@@ -46,6 +95,343 @@ class TestHandleEvent:
         await mattermost.handle_event("nonexistent_event", {})
 
 
+class TestDispatch:
+    def posted(self, mattermost, channel_type="O", message="hi"):
+        return {
+            "mentions": f'["{mattermost.me_mm_id}"]',
+            "sender_name": "@user",
+            "post": f'{{"user_id":"other","channel_id":"c","root_id":"","id":"p","message":"{message}","create_at":0}}',
+            "channel_type": channel_type,
+            "channel_display_name": "General",
+        }
+
+    def test_priorities(self, mattermost):
+        assert mattermost.event_priority("typing", {}) == 3
+        assert mattermost.event_priority("posted", {"mentions": "[]"}) == 3
+        assert mattermost.event_priority("posted", self.posted(mattermost)) == 2
+        assert mattermost.event_priority("posted", self.posted(mattermost, "D")) == 1
+        assert (
+            mattermost.event_priority("posted", self.posted(mattermost, "D", "!/help"))
+            == 0
+        )
+
+    def test_drops_events_without_handler(self, mattermost):
+        mattermost.dispatch("typing", {})
+        assert mattermost.scheduler.depth == 0
+
+    async def test_chatter_takes_no_queue_slot(self, mattermost):
+        mattermost.send_message = AsyncMock()
+        for _ in range(3):
+            mattermost.dispatch("posted", {**self.posted(mattermost), "mentions": "[]"})
+        assert mattermost.scheduler.depth == 0
+
+        mattermost.dispatch("posted", self.posted(mattermost))
+        assert mattermost.scheduler.depth == 1
+        mattermost.send_message.assert_not_called()
+
+    async def test_busy_reply_when_queue_full(self, mattermost):
+        mattermost.send_message = AsyncMock()
+        mattermost.dispatch("posted", self.posted(mattermost))
+        mattermost.dispatch("posted", self.posted(mattermost))
+        assert mattermost.scheduler.depth == 1
+
+        for task in list(mattermost.background_tasks):
+            await task
+
+        mattermost.send_message.assert_called_once()
+        assert "busy" in mattermost.send_message.call_args[0][1]
+
+    @override_settings(MATTERMOST_EVENT_QUEUE=True)
+    async def test_queues_mentions(self, mattermost):
+        mattermost.dispatch("posted", self.posted(mattermost))
+        mattermost.dispatch("posted", {"mentions": "[]", "post": "{}"})
+
+        for task in list(mattermost.background_tasks):
+            await task
+
+        assert mattermost.scheduler.depth == 0
+        assert mattermost.held_posts == {}
+        event = await MattermostEvent.objects.aget()
+        assert event.root_id == "p"
+        assert event.priority == 2
+
+
+class TestReceive:
+    def posted(self, post_id, seq):
+        return {
+            "event": "posted",
+            "seq": seq,
+            "data": {
+                "mentions": "[]",
+                "post": f'{{"id":"{post_id}","channel_id":"c","create_at":{seq}}}',
+            },
+        }
+
+    async def test_hello_starts_new_session(self, mattermost):
+        mattermost.backfill = AsyncMock()
+        mattermost.server_seq = 42
+        mattermost.receive(
+            {"event": "hello", "seq": 0, "data": {"connection_id": "conn"}}
+        )
+        assert mattermost.connection_id == "conn"
+        assert mattermost.server_seq == 1
+        assert mattermost.members.live
+        for task in list(mattermost.background_tasks):
+            await task
+        mattermost.backfill.assert_called_once()
+
+    def test_hello_resumes_session(self, mattermost):
+        mattermost.connection_id = "conn"
+        mattermost.server_seq = 42
+        mattermost.receive(
+            {"event": "hello", "seq": 42, "data": {"connection_id": "conn"}}
+        )
+        assert mattermost.server_seq == 43
+
+    def test_dedupes_posts(self, mattermost):
+        mattermost.dispatch = MagicMock()
+        mattermost.receive(self.posted("p1", 1))
+        mattermost.receive(self.posted("p1", 2))
+        mattermost.receive(self.posted("p2", 3))
+        assert mattermost.dispatch.call_count == 2
+        assert mattermost.server_seq == 4
+        assert mattermost.cursors == {"c": 3}
+
+    def test_membership_events(self, mattermost):
+        mattermost.members.channels = {"chan": {"a"}, "other": {"bot_mm_id"}}
+        mattermost.receive(
+            {
+                "event": "user_added",
+                "data": {"team_id": "team", "user_id": "b"},
+                "broadcast": {"channel_id": "chan"},
+            }
+        )
+        mattermost.receive(
+            {
+                "event": "user_removed",
+                "data": {"remover_id": "b", "user_id": "a"},
+                "broadcast": {"channel_id": "chan"},
+            }
+        )
+        assert mattermost.members.channels["chan"] == {"b"}
+
+        mattermost.receive(
+            {
+                "event": "user_removed",
+                "data": {"remover_id": "b", "channel_id": "other"},
+                "broadcast": {"channel_id": ""},
+            }
+        )
+        mattermost.receive(
+            {
+                "event": "channel_deleted",
+                "data": {"channel_id": "chan"},
+                "broadcast": {},
+            }
+        )
+        assert mattermost.members.channels == {}
+
+    def test_seen_posts_is_bounded(self, mattermost):
+        with patch("camille.mattermost.settings") as mock_settings:
+            mock_settings.MATTERMOST_SEEN_POSTS_SIZE = 2
+            assert mattermost.is_duplicate("a") is False
+            assert mattermost.is_duplicate("b") is False
+            assert mattermost.is_duplicate("c") is False
+            assert mattermost.is_duplicate("a") is False
+
+
+class TestBackfill:
+    def response(self, body):
+        return MagicMock(json=MagicMock(return_value=body))
+
+    def post(self, post_id, create_at, message="hello @camille", user_id="u1"):
+        return {
+            "id": post_id,
+            "create_at": create_at,
+            "user_id": user_id,
+            "channel_id": "chan",
+            "root_id": "",
+            "message": message,
+            "type": "",
+        }
+
+    async def test_flush_cursors(self, mattermost):
+        mattermost.advance_cursor("chan", 10)
+        mattermost.advance_cursor("chan", 5)
+        await mattermost.flush_cursors()
+        mattermost.advance_cursor("chan", 20)
+        await mattermost.flush_cursors()
+
+        cursor = await MattermostChannelCursor.objects.aget(channel_id="chan")
+        assert cursor.last_post_at == 20
+        assert mattermost.dirty_cursors == set()
+
+    async def test_cursor_held_before_unhandled_mentions(self, mattermost):
+        mattermost.on_posted = AsyncMock()
+
+        def posted(post_id, create_at, mentions):
+            post = {"id": post_id, "channel_id": "chan", "create_at": create_at}
+            return {"mentions": mentions, "post": dumps(post)}
+
+        mention = posted("m", 10, '["bot_mm_id"]')
+        mattermost.receive({"event": "posted", "data": mention})
+        mattermost.receive({"event": "posted", "data": posted("c", 20, "[]")})
+        assert mattermost.scheduler.depth == 1
+
+        # Dropped at shutdown, the mention is backfilled after the restart
+        await mattermost.flush_cursors()
+        cursor = await MattermostChannelCursor.objects.aget(channel_id="chan")
+        assert cursor.last_post_at == 9
+
+        await mattermost.handle_dispatched("posted", mention)
+        await mattermost.flush_cursors()
+        await cursor.arefresh_from_db()
+        assert cursor.last_post_at == 20
+
+    def test_mentions_me(self, mattermost):
+        channel = {"type": "O"}
+        assert mattermost.mentions_me(channel, self.post("p", 0))
+        assert not mattermost.mentions_me(channel, self.post("p", 0, "hello"))
+        assert mattermost.mentions_me({"type": "D"}, self.post("p", 0, "hello"))
+        assert not mattermost.mentions_me(
+            {"type": "D"}, self.post("p", 0, user_id="bot_mm_id")
+        )
+        assert not mattermost.mentions_me(
+            channel, {**self.post("p", 0), "type": "system_join_channel"}
+        )
+
+    async def test_fetch_posts_since_paginates(self, mattermost):
+        with patch("camille.mattermost.settings") as mock_settings:
+            mock_settings.MATTERMOST_BACKFILL_PAGE_SIZE = 2
+            mattermost.client_http.get.side_effect = [
+                self.response(
+                    {
+                        "order": ["p4", "p3"],
+                        "posts": {"p4": self.post("p4", 4), "p3": self.post("p3", 3)},
+                    }
+                ),
+                self.response(
+                    {
+                        "order": ["p2", "p1"],
+                        "posts": {"p2": self.post("p2", 2), "p1": self.post("p1", 1)},
+                    }
+                ),
+            ]
+            posts = await mattermost.fetch_posts_since("chan", 1)
+
+        assert [p["id"] for p in posts] == ["p4", "p3", "p2"]
+        assert mattermost.client_http.get.call_count == 2
+
+    async def test_backfill_dispatches_missed_mentions(self, mattermost):
+        await MattermostChannelCursor.objects.acreate(
+            channel_id="chan", last_post_at=int(time() * 1000) - 1000
+        )
+        now = int(time() * 1000)
+        mattermost.client_http.get.side_effect = [
+            self.response(
+                [
+                    {
+                        "id": "chan",
+                        "type": "O",
+                        "display_name": "General",
+                        "last_post_at": now,
+                    }
+                ]
+            ),
+            self.response(
+                {
+                    "order": ["p2", "p1"],
+                    "posts": {
+                        "p2": self.post("p2", now),
+                        "p1": self.post("p1", now, "unrelated"),
+                    },
+                }
+            ),
+        ]
+        mattermost.client_http.post.return_value = self.response(
+            [{"id": "u1", "username": "alice"}]
+        )
+        mattermost.dispatch = MagicMock()
+
+        with patch("camille.mattermost.sleep", AsyncMock()):
+            await mattermost.backfill()
+
+        mattermost.dispatch.assert_called_once()
+        kind, data = mattermost.dispatch.call_args[0]
+        assert kind == "posted"
+        assert data["sender_name"] == "@alice"
+        assert data["channel_display_name"] == "General"
+        assert mattermost.cursors["chan"] == now
+
+    async def test_backfill_without_cursor_does_nothing(self, mattermost):
+        await mattermost.backfill()
+        mattermost.client_http.get.assert_not_called()
+
+
+class TestRun:
+    @pytest.fixture
+    def connections(self, mattermost):
+        mattermost.client_http.get.return_value = MagicMock(
+            json=MagicMock(
+                return_value={
+                    "id": "bot_mm_id",
+                    "first_name": "Camille",
+                    "username": "camille",
+                }
+            )
+        )
+        mattermost.backfill = AsyncMock()
+        mattermost.flush_cursors_periodically = AsyncMock()
+        return []
+
+    async def run(self, mattermost, connections, frames):
+        from httpx_ws import WebSocketNetworkError
+
+        @asynccontextmanager
+        async def fake_connect(url, client, params):
+            connections.append(params)
+            ws = AsyncMock()
+            if len(connections) == 1:
+                ws.receive_text.side_effect = [*frames, WebSocketNetworkError()]
+            else:
+                ws.receive_text.side_effect = RuntimeError("stop")
+            yield ws
+
+        with (
+            patch("camille.mattermost.aconnect_ws", fake_connect),
+            patch("camille.mattermost.sleep", AsyncMock()),
+            pytest.raises(RuntimeError, match="stop"),
+        ):
+            await mattermost.run()
+
+    async def test_reconnects_with_resume_params(self, mattermost, connections):
+        hello = {"event": "hello", "seq": 0, "data": {"connection_id": "conn"}}
+        await self.run(mattermost, connections, [dumps(hello)])
+
+        assert connections == [
+            {},
+            {"connection_id": "conn", "sequence_number": 1},
+        ]
+        assert mattermost.client_ws is None
+
+    async def test_skips_malformed_events(self, mattermost, connections):
+        hello = {"event": "hello", "seq": 0, "data": {"connection_id": "conn"}}
+        typing = {"event": "typing", "seq": 2, "data": {}}
+        await self.run(
+            mattermost,
+            connections,
+            [
+                dumps(hello),
+                "not json",
+                "[]",
+                dumps({"event": "posted", "seq": 1, "data": {}}),
+                dumps(typing),
+            ],
+        )
+
+        assert connections[1] == {"connection_id": "conn", "sequence_number": 3}
+
+
 class TestHandleCommands:
     async def test_non_dm_ignored(self, mattermost):
         result = await mattermost.handle_commands(
@@ -137,6 +523,53 @@ class TestWsSend:
         assert mattermost.current_seq == 2
 
 
+class TestTyping:
+    async def test_user_typing_in_thread(self, mattermost):
+        await mattermost.user_typing("chan", "root")
+        mattermost.client_ws.send_json.assert_called_once_with(
+            {
+                "action": "user_typing",
+                "data": {"channel_id": "chan", "parent_id": "root"},
+                "seq": 1,
+            }
+        )
+
+    async def test_user_typing_while_disconnected(self, mattermost):
+        mattermost.client_ws = None
+        await mattermost.user_typing("chan")
+        assert mattermost.current_seq == 0
+
+    async def test_heartbeat_until_block_exits(self, mattermost):
+        with patch("camille.mattermost.settings") as mock_settings:
+            mock_settings.MATTERMOST_TYPING_INTERVAL = 0.01
+            async with mattermost.typing("chan", "root"):
+                await sleep(0.05)
+
+            sent = mattermost.client_ws.send_json.call_count
+            await sleep(0.05)
+
+        assert sent >= 2
+        assert mattermost.client_ws.send_json.call_count == sent
+
+    async def test_heartbeat_stops_on_error(self, mattermost):
+        with pytest.raises(RuntimeError):
+            async with mattermost.typing("chan"):
+                raise RuntimeError("boom")
+
+        sent = mattermost.client_ws.send_json.call_count
+        await sleep(0.01)
+        assert mattermost.client_ws.send_json.call_count == sent
+
+    async def test_heartbeat_survives_send_errors(self, mattermost):
+        mattermost.client_ws.send_json.side_effect = ConnectionError()
+        with patch("camille.mattermost.settings") as mock_settings:
+            mock_settings.MATTERMOST_TYPING_INTERVAL = 0.01
+            async with mattermost.typing("chan"):
+                await sleep(0.05)
+
+        assert mattermost.client_ws.send_json.call_count >= 2
+
+
 class TestOnPosted:
     async def test_ignores_unmentioned(self, mattermost):
         mattermost.send_message = AsyncMock()
@@ -176,3 +609,289 @@ class TestOnPosted:
             }
         )
         mattermost.send_message.assert_not_called()
+
+
+class TestThreadLanes:
+    def posted(self, post_id, message, root_id="root"):
+        return {
+            "mentions": '["bot_mm_id"]',
+            "sender_name": "@testuser",
+            "post": f'{{"user_id":"mm_test_id_123","channel_id":"c","root_id":"{root_id}","id":"{post_id}","message":"{message}","create_at":0}}',
+            "channel_type": "O",
+            "channel_display_name": "General",
+        }
+
+    def test_coalesce_groups_consecutive_posts_of_same_user(self, user, other_user):
+        posts = [
+            ThreadPost(user=user, data={}, post_data={"id": "1"}),
+            ThreadPost(user=user, data={}, post_data={"id": "2"}),
+            ThreadPost(user=other_user, data={}, post_data={"id": "3"}),
+            ThreadPost(user=user, data={}, post_data={"id": "4"}),
+        ]
+        batches = coalesce(posts)
+        assert [[p.post_data["id"] for p in batch] for batch in batches] == [
+            ["1", "2"],
+            ["3"],
+            ["4"],
+        ]
+
+    async def test_posts_during_run_are_coalesced(self, mattermost, mattermost_binding):
+        release = Event()
+        batches = []
+
+        async def reply(root_id, posts):
+            batches.append([p.post_data["message"] for p in posts])
+            await release.wait()
+
+        mattermost.reply = reply
+        first = create_task(mattermost.on_posted(self.posted("p1", "first")))
+        await sleep(0.1)
+        await mattermost.on_posted(self.posted("p2", "second"))
+        await mattermost.on_posted(self.posted("p3", "third"))
+        assert batches == [["first"]]
+
+        release.set()
+        await first
+        assert batches == [["first"], ["second", "third"]]
+        assert mattermost.threads == {}
+
+
+class TestQueuedAnswers:
+    @pytest.fixture
+    def failing(self, mattermost, mattermost_binding, agent_config):
+        agent_config.model = "anthropic:claude-sonnet-4-5"
+        agent_config.save()
+
+        def function(messages, info: AgentInfo):
+            raise ModelHTTPError(503, "model")
+
+        async def stream_function(messages, info: AgentInfo):
+            raise ModelHTTPError(503, "model")
+            yield
+
+        mattermost.agent = Agent(deps_type=MattermostDeps)
+        mattermost.members.user_ids = AsyncMock(
+            return_value=[mattermost_binding.user_id]
+        )
+        mattermost.send_message = AsyncMock(return_value="post_id")
+        with patch(
+            "camille.mattermost.create_model_chain_for_user",
+            AsyncMock(
+                return_value=ModelChain(
+                    FunctionModel(function, stream_function=stream_function),
+                    ["function"],
+                )
+            ),
+        ):
+            yield
+
+    async def process(self, worker):
+        await MattermostEvent.objects.aupdate(available_at=timezone.now())
+        await worker.process(await sync_to_async(claim)())
+        return await MattermostEvent.objects.aget()
+
+    @override_settings(MATTERMOST_EVENT_MAX_ATTEMPTS=2)
+    async def test_unanswered_posts_are_retried(self, mattermost, failing):
+        worker = EventWorker(mattermost, 1)
+        await enqueue("posted", TestThreadLanes().posted("p1", "hi"), priority=0)
+
+        event = await self.process(worker)
+        assert event.status == MattermostEvent.Status.PENDING
+        assert "503" in event.last_error
+        mattermost.send_message.assert_not_awaited()
+
+        event = await self.process(worker)
+        assert event.status == MattermostEvent.Status.DEAD
+        # The user is told once the event is given up
+        mattermost.send_message.assert_awaited_once()
+        assert "error occurred" in mattermost.send_message.await_args.args[1]
+
+    async def test_errors_are_posted_without_queue(self, mattermost, failing):
+        await mattermost.on_posted(TestThreadLanes().posted("p1", "hi"))
+
+        mattermost.send_message.assert_awaited_once()
+        assert "error occurred" in mattermost.send_message.await_args.args[1]
+
+    @override_settings(MATTERMOST_EVENT_LEASE=0.03)
+    async def test_lease_is_renewed(self, mattermost):
+        locks = []
+
+        async def handle_event(kind, data):
+            for _ in range(3):
+                await sleep(0.02)
+                event = await MattermostEvent.objects.aget()
+                locks.append(event.locked_at)
+
+        mattermost.handle_event = handle_event
+        await enqueue("posted", TestThreadLanes().posted("p1", "hi"), priority=0)
+        await EventWorker(mattermost, 1).process(await sync_to_async(claim)())
+
+        assert locks[0] < locks[-1]
+
+
+class TestPostWriter:
+    @pytest.fixture
+    def writer(self, mattermost):
+        mattermost.send_message = AsyncMock(return_value="post_id")
+        mattermost.update_message = AsyncMock()
+        deps = MattermostDeps(
+            agent_name="Camille",
+            current_user=None,
+            all_users=[],
+            channel_id="chan",
+            channel_name="General",
+            mattermost_client=mattermost.client_http,
+            generated_files_ids=["file"],
+        )
+        return PostWriter(mattermost, "chan", "root", deps)
+
+    async def events(self, *events):
+        for event in events:
+            yield event
+
+    async def test_write(self, writer, mattermost):
+        await writer.write("Hello")
+        await writer.write("World")
+        assert mattermost.send_message.call_count == 2
+        mattermost.send_message.assert_any_call(
+            "chan", "Hello", root_id="root", file_ids=["file"]
+        )
+        mattermost.send_message.assert_any_call(
+            "chan", "World", root_id="root", file_ids=[]
+        )
+        assert writer.first_post_at is not None
+
+    async def test_stream_throttles_updates(self, writer, mattermost):
+        with patch("camille.mattermost.settings") as mock_settings:
+            mock_settings.MATTERMOST_STREAM_INTERVAL = 3600
+            mock_settings.MATTERMOST_STREAM_CHARS = 10
+            await writer.stream(
+                self.events(
+                    PartStartEvent(index=0, part=TextPart("Hel")),
+                    PartDeltaEvent(index=0, delta=TextPartDelta("lo")),
+                    PartDeltaEvent(index=0, delta=TextPartDelta(" wonderful")),
+                    PartDeltaEvent(index=0, delta=TextPartDelta(" world")),
+                    PartStartEvent(
+                        index=1, part=ToolCallPart(tool_name="t", args="{}")
+                    ),
+                )
+            )
+
+        mattermost.send_message.assert_called_once_with(
+            "chan", "Hel", root_id="root", file_ids=["file"]
+        )
+        assert [c.args for c in mattermost.update_message.call_args_list] == [
+            ("post_id", "Hello wonderful"),
+            ("post_id", "Hello wonderful world"),
+        ]
+
+    async def test_stream_new_part_new_post(self, writer, mattermost):
+        await writer.stream(
+            self.events(
+                PartStartEvent(index=0, part=TextPart("")),
+                PartDeltaEvent(index=0, delta=TextPartDelta("First")),
+                PartStartEvent(index=1, part=TextPart("Second")),
+            )
+        )
+
+        assert [c.args[1] for c in mattermost.send_message.call_args_list] == [
+            "First",
+            "Second",
+        ]
+
+
+class TestFollow:
+    @pytest.fixture
+    def writer(self, mattermost, settings):
+        settings.MATTERMOST_STREAMING = False
+        mattermost.send_message = AsyncMock(return_value="post_id")
+        deps = MattermostDeps(
+            agent_name="Camille",
+            current_user=None,
+            all_users=[],
+            channel_id="chan",
+            channel_name="General",
+            mattermost_client=mattermost.client_http,
+        )
+        return PostWriter(mattermost, "chan", "root", deps)
+
+    @pytest.fixture
+    def agent(self, mattermost):
+        def function(messages, info: AgentInfo):
+            # Two tool calls, then the answer
+            if len(messages) > 4:
+                return ModelResponse(parts=[TextPart("Finished")])
+
+            return ModelResponse(
+                parts=[TextPart("Working"), ToolCallPart(tool_name="work", args={})]
+            )
+
+        mattermost.agent = Agent(FunctionModel(function), deps_type=MattermostDeps)
+
+        @mattermost.agent.tool_plain
+        async def work() -> str:
+            await sleep(0.05)
+            return "Done"
+
+        return mattermost.agent
+
+    async def test_completed(self, mattermost, writer, agent):
+        stats = RunStats()
+        run = await mattermost.follow(writer, stats, 60, "Hi", deps=writer.deps)
+
+        assert run is not None
+        assert stats.usage.requests == 3
+        assert stats.usage.tool_calls == 2
+        # The tool sleeps
+        assert stats.tool_time >= 0.1
+        messages = [c.args[1] for c in mattermost.send_message.call_args_list]
+        assert messages == ["Working", "Working", "Finished"]
+
+    async def test_usage_limit(self, mattermost, writer, agent):
+        stats = RunStats()
+        run = await mattermost.follow(
+            writer,
+            stats,
+            60,
+            "Hi",
+            deps=writer.deps,
+            usage_limits=UsageLimits(tool_calls_limit=1),
+        )
+
+        assert run is None
+        messages = [c.args[1] for c in mattermost.send_message.call_args_list]
+        assert messages[:2] == ["Working", "Working"]
+        assert messages[-1].startswith("_Answer interrupted: ")
+        assert "tool_calls_limit" in messages[-1]
+        assert stats.usage.tool_calls == 1
+
+    async def test_deadline(self, mattermost, writer, agent):
+        run = await mattermost.follow(writer, RunStats(), 0, "Hi", deps=writer.deps)
+
+        assert run is None
+        mattermost.send_message.assert_called_with(
+            "chan",
+            "_Answer interrupted: It took longer than 0 seconds._",
+            root_id="root",
+            file_ids=[],
+        )
+
+
+class TestWebhook:
+    async def test_fetches_post_details(self, mattermost):
+        post = {"id": "p", "root_id": "", "channel_id": "c", "user_id": "u"}
+        channel = {"id": "c", "type": "O", "display_name": "General"}
+        mattermost.client_http.get.side_effect = [
+            MagicMock(json=MagicMock(return_value=post)),
+            MagicMock(json=MagicMock(return_value=channel)),
+        ]
+        mattermost.on_posted = AsyncMock()
+
+        await mattermost.on_webhook({"post_id": "p", "user_name": "user"})
+
+        data = mattermost.on_posted.call_args.args[0]
+        assert mattermost.me_mm_id in data["mentions"]
+        assert data["sender_name"] == "@user"
+        assert data["channel_type"] == "O"
+        assert data["channel_display_name"] == "General"
+        assert loads(data["post"]) == post
@@ -0,0 +1,96 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from time import monotonic
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from camille.members import ChannelMembersCache
+from camille.models import MattermostBinding
+
+pytestmark = [pytest.mark.django_db(transaction=True)]
+
+
+def response(body):
+    return MagicMock(json=MagicMock(return_value=body))
+
+
+@pytest.fixture
+def cache():
+    return ChannelMembersCache(AsyncMock())
+
+
+class TestChannelMembersCache:
+    async def test_fetches_all_pages_once(self, cache):
+        cache.client.get.side_effect = [
+            response([{"user_id": "a"}, {"user_id": "b"}]),
+            response([{"user_id": "c"}]),
+        ]
+        with patch("camille.members.settings") as mock_settings:
+            mock_settings.MATTERMOST_MEMBERS_PAGE_SIZE = 2
+            mock_settings.MATTERMOST_MEMBERS_TTL = 300
+            assert await cache.members("chan") == {"a", "b", "c"}
+            assert await cache.members("chan") == {"a", "b", "c"}
+
+        assert cache.client.get.call_count == 2
+
+    async def test_stale_members_refetched(self, cache):
+        cache.client.get.side_effect = [
+            response([{"user_id": "a"}]),
+            response([{"user_id": "b"}]),
+        ]
+        assert await cache.members("chan") == {"a"}
+
+        cache.channels_loaded_at["chan"] = monotonic() - 301
+        assert await cache.members("chan") == {"b"}
+        assert cache.client.get.call_count == 2
+
+    async def test_live_members_kept(self, cache):
+        cache.live = True
+        cache.channels["chan"] = {"a"}
+        cache.channels_loaded_at["chan"] = monotonic() - 301
+        assert await cache.members("chan") == {"a"}
+        cache.client.get.assert_not_called()
+
+    async def test_incremental_updates(self, cache):
+        cache.channels["chan"] = {"a"}
+        cache.add("chan", "b")
+        cache.remove("chan", "a")
+        cache.add("unknown", "c")
+        assert cache.channels == {"chan": {"b"}}
+
+        cache.forget("chan")
+        assert cache.channels == {}
+
+    async def test_user_ids(self, cache, mattermost_binding, other_user):
+        cache.live = True
+        cache.channels["chan"] = {"mm_test_id_123", "unbound"}
+        assert await cache.user_ids("chan", "mm_test_id_123") == [
+            mattermost_binding.user_id
+        ]
+
+    async def test_unknown_sender_reloads_bindings(
+        self, cache, mattermost_binding, other_user
+    ):
+        cache.live = True
+        cache.channels["chan"] = {"mm_test_id_123", "mm_other"}
+        await cache.user_ids("chan", "mm_test_id_123")
+
+        await MattermostBinding.objects.acreate(user=other_user, mm_id="mm_other")
+        assert sorted(await cache.user_ids("chan", "mm_other")) == sorted(
+            [mattermost_binding.user_id, other_user.id]
+        )
@@ -62,6 +62,25 @@ class TestAgentConfigClean:
         agent_config.clean()  # Should not raise
 
 
+class TestAgentConfigLimits:
+    def test_defaults(self, agent_config, settings):
+        settings.AGENT_MAX_TOOL_CALLS = 10
+        settings.AGENT_DEADLINE = 60
+
+        assert agent_config.usage_limits().tool_calls_limit == 10
+        assert agent_config.run_deadline() == 60
+
+    def test_overrides(self, agent_config):
+        agent_config.max_tool_calls = 0
+        agent_config.max_output_tokens = 1000
+        agent_config.deadline = 30
+
+        limits = agent_config.usage_limits()
+        assert limits.tool_calls_limit == 0
+        assert limits.output_tokens_limit == 1000
+        assert agent_config.run_deadline() == 30
+
+
 class TestMattermostBinding:
     def test_str(self, mattermost_binding):
         assert str(mattermost_binding) == "testuser"
@@ -133,3 +152,42 @@ class TestMattermostConversationRun:
         )
         result = run.messages()
         assert len(result) == 1
+
+
+class TestMattermostConversationRunQuerySet:
+    @pytest.fixture
+    def runs(self, user, other_user):
+        conv = MattermostConversation.objects.create(root_id="root", channel_id="chan")
+        for run_user, model, duration, tool_time in [
+            (user, "anthropic:a", 1.0, 0.5),
+            (user, "anthropic:a", 3.0, 0.5),
+            (user, "mistral:m", 2.0, 0.0),
+            (other_user, "anthropic:a", 4.0, None),
+        ]:
+            MattermostConversationRun.objects.create(
+                conversation=conv,
+                user=run_user,
+                messages_json=b"[]",
+                model=model,
+                input_tokens=100,
+                tool_calls=1,
+                duration=duration,
+                tool_time=tool_time,
+            )
+
+    def test_rollup(self, runs):
+        rollups = list(MattermostConversationRun.objects.rollup("user__username"))
+
+        assert [r["user__username"] for r in rollups] == ["otheruser", "testuser"]
+        assert rollups[1]["runs"] == 3
+        assert rollups[1]["total_input_tokens"] == 300
+        assert rollups[1]["total_tool_calls"] == 3
+        assert rollups[1]["mean_duration"] == 2.0
+        assert rollups[1]["total_tool_time"] == 1.0
+
+    def test_percentiles(self, runs):
+        percentiles = MattermostConversationRun.objects.filter(
+            model="anthropic:a"
+        ).percentiles("duration", "user__username", percentiles=(50,))
+
+        assert percentiles == {("testuser",): [2.0], ("otheruser",): [4.0]}
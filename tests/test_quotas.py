@@ -0,0 +1,168 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import create_task, sleep
+from unittest.mock import patch
+
+import pytest
+from django.db import DatabaseError
+from django.db.models import QuerySet
+
+from camille import quotas
+from camille.models import UsageBucket
+from camille.quotas import Quotas, current_minute
+
+
+@pytest.fixture(autouse=True)
+def quota_settings(settings):
+    settings.QUOTA_WINDOW = 600
+    settings.QUOTA_USER_TOKENS = 1000
+    settings.QUOTA_USER_REQUESTS = 10
+    settings.QUOTA_CHANNEL_TOKENS = 0
+    settings.QUOTA_CHANNEL_REQUESTS = 0
+    settings.QUOTA_USER_CONCURRENCY = 1
+
+
+class TestQuotas:
+    def test_within_quota(self):
+        q = Quotas()
+        q.record(1, "channel", 999, 9)
+        assert q.totals("user", "1") == (999, 9)
+        assert q.totals("channel", "channel") == (999, 9)
+        assert q.exceeded(1, "channel") is None
+
+    def test_tokens_exceeded(self):
+        q = Quotas()
+        q.record(1, "channel", 600, 1)
+        q.record(1, "channel", 400, 1)
+        assert "1000 of 1000 tokens" in q.exceeded(1, "channel")
+        assert q.exceeded(2, "channel") is None
+
+    def test_requests_exceeded(self):
+        q = Quotas()
+        q.record(1, "channel", 10, 10)
+        assert "10 of 10 model requests" in q.exceeded(1, "channel")
+
+    def test_channel_quota(self, settings):
+        q = Quotas()
+        q.record(1, "channel", 500, 1)
+        assert q.exceeded(2, "channel") is None
+
+        settings.QUOTA_CHANNEL_TOKENS = 500
+        assert q.exceeded(2, "channel").startswith("This channel has used")
+        assert q.exceeded(2, "other") is None
+
+    def test_unlimited(self, settings):
+        settings.QUOTA_USER_TOKENS = 0
+        settings.QUOTA_USER_REQUESTS = 0
+        q = Quotas()
+        q.record(1, "channel", 10**9, 10**6)
+        assert q.exceeded(1, "channel") is None
+
+    def test_window(self):
+        q = Quotas()
+        minute = current_minute()
+        with patch.object(quotas, "current_minute", return_value=minute - 10):
+            q.record(1, "channel", 1000, 1)
+        assert q.totals("user", "1") == (0, 0)
+
+        with patch.object(quotas, "current_minute", return_value=minute - 9):
+            q.record(1, "channel", 1000, 1)
+        assert q.totals("user", "1") == (1000, 1)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestFlush:
+    async def test_persists_and_reloads(self):
+        q = Quotas()
+        q.record(1, "channel", 100, 1)
+        await q.flush()
+        q.record(1, "channel", 50, 1)
+        await q.flush()
+
+        bucket = await UsageBucket.objects.aget(
+            scope="user", key="1", minute=current_minute()
+        )
+        assert (bucket.tokens, bucket.requests) == (150, 2)
+        assert q.pending == {}
+        assert q.totals("user", "1") == (150, 2)
+
+        # Another process sees the usage
+        other = Quotas()
+        await other.flush()
+        assert other.totals("channel", "channel") == (150, 2)
+
+    async def test_usage_kept_on_failure(self):
+        q = Quotas()
+        q.record(1, "channel", 100, 1)
+        aupdate = QuerySet.aupdate
+        totals = []
+
+        async def failing_aupdate(queryset, **kwargs):
+            totals.append(q.totals("channel", "channel"))
+            if len(totals) == 2:
+                raise DatabaseError()
+            return await aupdate(queryset, **kwargs)
+
+        with (
+            patch.object(QuerySet, "aupdate", failing_aupdate),
+            pytest.raises(DatabaseError),
+        ):
+            await q.flush()
+
+        assert totals == [(100, 1), (100, 1)]
+        assert q.totals("user", "1") == (100, 1)
+        assert q.totals("channel", "channel") == (100, 1)
+
+        await q.flush()
+        assert [
+            (bucket.scope, bucket.tokens, bucket.requests)
+            async for bucket in UsageBucket.objects.order_by("scope")
+        ] == [("channel", 100, 1), ("user", 100, 1)]
+        assert q.totals("channel", "channel") == (100, 1)
+
+    async def test_deletes_expired_buckets(self):
+        await UsageBucket.objects.acreate(
+            scope="user", key="1", minute=current_minute() - 10, tokens=1000
+        )
+        await Quotas().flush()
+        assert not await UsageBucket.objects.aexists()
+
+
+class TestSlot:
+    async def test_defers_concurrent_runs_of_a_user(self):
+        q = Quotas()
+        order = []
+
+        async def run(user_id, name):
+            async with q.slot(user_id):
+                order.append(f"{name} started")
+                await sleep(0.05)
+                order.append(f"{name} ended")
+
+        with patch.object(quotas.deferred_counter, "add") as deferred:
+            await sleep(0)
+            first = create_task(run(1, "first"))
+            await sleep(0.01)
+            second = create_task(run(1, "second"))
+            other = create_task(run(2, "other"))
+            await first
+            await second
+            await other
+
+        deferred.assert_called_once_with(1)
+        assert order.index("first ended") < order.index("second started")
+        assert order.index("other started") < order.index("first ended")
@@ -0,0 +1,69 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import Event
+
+from camille.scheduler import Scheduler
+
+
+class TestScheduler:
+    async def test_rejects_when_full(self):
+        scheduler = Scheduler(workers=1, maxsize=1)
+
+        async def job():
+            pass
+
+        assert scheduler.submit(0, job) is True
+        assert scheduler.submit(0, job) is False
+        assert scheduler.depth == 1
+
+    async def test_runs_by_priority(self):
+        scheduler = Scheduler(workers=1, maxsize=10)
+        done = []
+
+        def make_job(name):
+            async def job():
+                done.append(name)
+
+            return job
+
+        scheduler.submit(2, make_job("low"))
+        scheduler.submit(0, make_job("high"))
+        scheduler.submit(1, make_job("medium"))
+        scheduler.submit(0, make_job("high2"))
+
+        async with scheduler:
+            await scheduler.queue.join()
+
+        assert done == ["high", "high2", "medium", "low"]
+
+    async def test_failing_job_does_not_kill_worker(self):
+        scheduler = Scheduler(workers=1, maxsize=10)
+        ran = Event()
+
+        async def failing():
+            raise RuntimeError("boom")
+
+        async def job():
+            ran.set()
+
+        async with scheduler:
+            scheduler.submit(0, failing)
+            scheduler.submit(0, job)
+            await scheduler.queue.join()
+
+        assert ran.is_set()
+        assert scheduler.tasks == []
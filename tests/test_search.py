@@ -0,0 +1,82 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from camille.models import AgentMemory
+from camille.search import asearch_memories, search_memories
+
+pytestmark = [pytest.mark.django_db(transaction=True)]
+
+
+@pytest.fixture
+def memories(user, other_user):
+    return [
+        AgentMemory.objects.create(user=user, content="Loves green tea"),
+        AgentMemory.objects.create(user=user, content="Drinks tea, tea and more tea"),
+        AgentMemory.objects.create(user=user, content="Has a cat named Kropotkin"),
+        AgentMemory.objects.create(user=other_user, content="Prefers black tea"),
+    ]
+
+
+def ids(results):
+    return [result["id"] for result in results]
+
+
+class TestSearchMemories:
+    def test_best_matches_first(self, user, memories):
+        results, has_more = search_memories("tea", [user.id])
+        assert ids(results) == [memories[1].id, memories[0].id]
+        assert not has_more
+
+    def test_all_words(self, user, other_user, memories):
+        results, _ = search_memories("green tea", [user.id, other_user.id])
+        assert ids(results) == [memories[0].id]
+
+    def test_users(self, other_user, memories):
+        results, _ = search_memories("tea", [other_user.id])
+        assert ids(results) == [memories[3].id]
+        assert results[0]["user_id"] == other_user.id
+
+    def test_snippet(self, user, memories):
+        results, _ = search_memories("cat", [user.id])
+        assert results[0]["snippet"] == "Has a **cat** named Kropotkin"
+
+    def test_pages(self, user, memories, settings):
+        settings.MEMORY_SEARCH_PAGE_SIZE = 1
+        first, has_more = search_memories("tea", [user.id])
+        assert has_more
+        second, has_more = search_memories("tea", [user.id], page=2)
+        assert not has_more
+        assert ids(first + second) == [memories[1].id, memories[0].id]
+
+    def test_index_in_sync(self, user, memories):
+        memories[2].content = "Has a dog named Louise"
+        memories[2].save()
+        memories[0].delete()
+
+        assert search_memories("cat", [user.id]) == ([], False)
+        assert ids(search_memories("dog", [user.id])[0]) == [memories[2].id]
+        assert ids(search_memories("green", [user.id])[0]) == []
+
+    @pytest.mark.parametrize("query", ['tea" OR (cat', "NEAR(tea", "*", ""])
+    def test_query_syntax_is_ignored(self, user, memories, query):
+        results, _ = search_memories(query, [user.id])
+        assert set(ids(results)) <= {memories[0].id, memories[1].id}
+
+    async def test_async_search(self, user, memories):
+        results, _ = await asearch_memories("tea", [user.id])
+        assert ids(results) == [memories[1].id, memories[0].id]
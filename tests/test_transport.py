@@ -0,0 +1,131 @@
+# Camille - An AI assistant
+# Copyright (C) Jonathan Tremesaygues <jonathan.tremesaygues@slaanesh.org>
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from unittest.mock import patch
+
+import pytest
+from httpx import AsyncClient, HTTPStatusError, MockTransport, Request, Response
+from pydantic_ai.retries import AsyncTenacityTransport, RetryConfig
+from tenacity import retry_if_exception_type, stop_after_attempt, wait_none
+
+from camille.transport import (
+    RateLimitedTransport,
+    TokenBucket,
+    endpoint,
+    should_retry_status,
+)
+
+
+def create_client(handler, attempts=3):
+    return AsyncClient(
+        base_url="http://mattermost/api/v4",
+        transport=AsyncTenacityTransport(
+            config=RetryConfig(
+                retry=retry_if_exception_type(HTTPStatusError),
+                wait=wait_none(),
+                stop=stop_after_attempt(attempts),
+                reraise=True,
+            ),
+            wrapped=RateLimitedTransport(MockTransport(handler)),
+            validate_response=should_retry_status,
+        ),
+    )
+
+
+class TestEndpoint:
+    def test_ids_are_normalized(self):
+        request = Request(
+            "PUT", "http://mattermost/api/v4/posts/abcdefghijklmnopqrstuvwxyz/patch"
+        )
+
+        assert endpoint(request) == "PUT /api/v4/posts/{id}/patch"
+
+
+class TestTokenBucket:
+    async def test_unlimited_until_headers(self):
+        bucket = TokenBucket()
+
+        with patch("camille.transport.sleep") as sleep:
+            for _ in range(100):
+                await bucket.acquire("GET /")
+
+        sleep.assert_not_called()
+
+    async def test_waits_when_empty(self):
+        bucket = TokenBucket()
+        bucket.update(
+            Response(
+                200,
+                headers={"X-RateLimit-Limit": "10", "X-RateLimit-Remaining": "0"},
+            )
+        )
+
+        with patch("camille.transport.sleep") as sleep:
+            # Let the bucket refill while "sleeping"
+            sleep.side_effect = lambda delay: bucket.__setattr__("tokens", 1)
+            await bucket.acquire("GET /")
+
+        sleep.assert_called_once()
+        assert sleep.call_args.args[0] == pytest.approx(0.1, abs=0.01)
+
+    def test_429_empties_until_reset(self):
+        bucket = TokenBucket()
+        bucket.update(
+            Response(
+                429,
+                headers={
+                    "X-RateLimit-Limit": "10",
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset": "2",
+                },
+            )
+        )
+
+        assert bucket.rate == 10
+        assert bucket.tokens == -20
+
+
+class TestRetries:
+    async def test_retries_429(self):
+        responses = [Response(429, headers={"Retry-After": "0"}), Response(201)]
+
+        async with create_client(lambda request: responses.pop(0)) as client:
+            r = await client.post("/posts", json={})
+
+        assert r.status_code == 201
+        assert responses == []
+
+    async def test_retries_5xx_for_idempotent_methods(self):
+        responses = [Response(503), Response(200)]
+
+        async with create_client(lambda request: responses.pop(0)) as client:
+            r = await client.put("/posts/abcdefghijklmnopqrstuvwxyz/patch", json={})
+
+        assert r.status_code == 200
+
+    async def test_does_not_retry_5xx_for_posts(self):
+        responses = [Response(503), Response(201)]
+
+        async with create_client(lambda request: responses.pop(0)) as client:
+            r = await client.post("/posts", json={})
+
+        assert r.status_code == 503
+        assert len(responses) == 1
+
+    async def test_gives_up(self):
+        async with create_client(lambda request: Response(429), attempts=2) as client:
+            with pytest.raises(HTTPStatusError):
+                await client.get("/users/me")
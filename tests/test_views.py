@@ -14,6 +14,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import hmac
+from hashlib import sha256
+from json import dumps
+from time import time
+
+import pytest
 from django.core.signing import TimestampSigner
 from django.urls import reverse
 
@@ -21,6 +27,7 @@ from camille.models import (
     AgentPersonality,
     AnthropicCredentials,
     MattermostBinding,
+    MattermostEvent,
 )
 
 
@@ -223,3 +230,126 @@ class TestPasswordlessLoginView:
         response = client.get(f"{reverse('passwordless_login')}?token={token}")
         assert response.status_code == 302
         assert response.url == reverse("login")
+
+
+class TestMattermostWebhookView:
+    @pytest.fixture(autouse=True)
+    def webhook_settings(self, settings):
+        settings.MATTERMOST_WEBHOOK_TOKEN = "token"
+        settings.MATTERMOST_WEBHOOK_SECRET = "key"
+
+    def signed_post(self, client, body, timestamp=None):
+        timestamp = str(int(time() if timestamp is None else timestamp))
+        signature = hmac.new(
+            b"key", f"{timestamp}.".encode() + body, sha256
+        ).hexdigest()
+        return client.post(
+            reverse("mattermost_webhook"),
+            body,
+            content_type="application/json",
+            headers={
+                "X-Camille-Timestamp": timestamp,
+                "X-Camille-Signature": signature,
+            },
+        )
+
+    def test_outgoing_webhook(self, client, db):
+        response = client.post(
+            reverse("mattermost_webhook"),
+            {"token": "token", "post_id": "p", "user_name": "user"},
+        )
+        assert response.status_code == 200
+        event = MattermostEvent.objects.get()
+        assert event.kind == "webhook"
+        assert event.root_id == "p"
+        assert "token" not in event.data
+
+    def test_outgoing_webhook_bad_token(self, client, db):
+        response = client.post(
+            reverse("mattermost_webhook"),
+            {"token": "wrong", "post_id": "p", "user_name": "user"},
+        )
+        assert response.status_code == 403
+        assert not MattermostEvent.objects.exists()
+
+    def test_signed_event(self, client, db):
+        body = dumps(
+            {
+                "event": "posted",
+                "data": {
+                    "channel_type": "D",
+                    "post": dumps({"id": "p", "root_id": "r", "message": "hi"}),
+                },
+            }
+        ).encode()
+        response = self.signed_post(client, body)
+        assert response.status_code == 200
+        event = MattermostEvent.objects.get()
+        assert event.kind == "posted"
+        assert event.root_id == "r"
+        assert event.priority == 1
+
+    def test_signed_chatter_skipped(self, client, db, settings):
+        settings.MATTERMOST_BOT_USER_ID = "bot"
+        post = dumps({"id": "p", "root_id": "", "message": "hi"})
+        for mentions, queued in (('["other"]', 0), ('["bot"]', 1)):
+            body = dumps(
+                {
+                    "event": "posted",
+                    "data": {"channel_type": "O", "mentions": mentions, "post": post},
+                }
+            ).encode()
+            assert self.signed_post(client, body).status_code == 200
+            assert MattermostEvent.objects.count() == queued
+
+    def test_duplicate_post_queued_once(self, client, db):
+        body = dumps(
+            {
+                "event": "posted",
+                "data": {
+                    "channel_type": "D",
+                    "post": dumps({"id": "p", "root_id": "", "message": "hi"}),
+                },
+            }
+        ).encode()
+        assert self.signed_post(client, body).status_code == 200
+        assert self.signed_post(client, body).status_code == 200
+        response = client.post(
+            reverse("mattermost_webhook"),
+            {"token": "token", "post_id": "p", "user_name": "user"},
+        )
+        assert response.status_code == 200
+        event = MattermostEvent.objects.get()
+        assert event.kind == "posted"
+        assert event.post_id == "p"
+
+    @pytest.mark.parametrize("body", [[], {"token": 1, "post_id": "p"}])
+    def test_outgoing_webhook_malformed(self, client, db, body):
+        response = client.post(
+            reverse("mattermost_webhook"), dumps(body), content_type="application/json"
+        )
+        assert response.status_code == 400
+        assert not MattermostEvent.objects.exists()
+
+    @pytest.mark.parametrize("body", [[], {"event": "posted", "data": []}])
+    def test_signed_event_malformed(self, client, db, body):
+        response = self.signed_post(client, dumps(body).encode())
+        assert response.status_code == 400
+        assert not MattermostEvent.objects.exists()
+
+    def test_signed_event_replayed(self, client, db):
+        body = dumps({"event": "posted", "data": {}}).encode()
+        response = self.signed_post(client, body, timestamp=time() - 3600)
+        assert response.status_code == 403
+
+    def test_bad_signature(self, client, db):
+        response = client.post(
+            reverse("mattermost_webhook"),
+            b"{}",
+            content_type="application/json",
+            headers={
+                "X-Camille-Timestamp": str(int(time())),
+                "X-Camille-Signature": "bad",
+            },
+        )
+        assert response.status_code == 403